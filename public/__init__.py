@@ -3,16 +3,25 @@ Directory containing javascript, html and css elements used by the front-end Rea
 """
 import os
 import shutil
+import hashlib
 root = os.path.dirname( __file__ )
 
 # specify which files to copy
 files = ['icon/', 'static/', 
          'md/help_en.md', 'md/notes_en.md', 'md/references_en.md',
          'asset-manifest.json','index.html','manifest.json','robots.txt']
-def copyTo( path, overwrite=False ):
+def copyTo( path, overwrite=False, link=False ):
     """
     Copy all needed files to start a RockHopper VFT from this directory to the 
     specified ones.
+
+    If overwrite is True, existing files are synchronised incrementally: only files
+    that have changed are copied, and stale files (e.g., old hashed javascript
+    bundles) are removed. Markdown files are never overwritten.
+
+    If link is True, files (except markdown) are hard-linked from this directory
+    rather than copied, falling back to copying if this is not possible. N.B. this
+    means edits to these files in the VFT will also change them here.
     """
     os.makedirs(path, exist_ok=True)
     for f in files:
@@ -22,13 +31,59 @@ def copyTo( path, overwrite=False ):
         if (".md" in f) and (os.path.exists( os.path.join(path, f) )):
             continue # don't overwrite any markdown files
         if os.path.isdir(pth):
-            if os.path.exists(os.path.join(path, f)):
-                shutil.rmtree(os.path.join(path, f))
-            shutil.copytree(pth, os.path.join(path, f), dirs_exist_ok=True)
+            # sync directory contents
+            for dirpath, _, filenames in os.walk(pth):
+                for fn in filenames:
+                    src = os.path.join(dirpath, fn)
+                    sync( src, os.path.join(path, f, os.path.relpath(src, pth)), link=link )
+            prune( pth, os.path.join(path, f) )
         else:
-            os.makedirs( os.path.dirname( os.path.join(path, f)), 
-                        exist_ok=True )
-            shutil.copy(pth, os.path.join(path, f))
+            sync( pth, os.path.join(path, f), link=link and (".md" not in f) )
+
+def sync( src, dst, link=False ):
+    """
+    Copy (or hard-link) src to dst, unless dst is already identical. Files with the same
+    size and modification time are assumed to be identical; otherwise their content hashes
+    are compared.
+    """
+    if os.path.exists(dst):
+        s, d = os.stat(src), os.stat(dst)
+        if os.path.samestat(s, d):
+            return # already linked
+        if s.st_size == d.st_size:
+            if (s.st_mtime == d.st_mtime) or (filehash(src) == filehash(dst)):
+                return # unchanged
+        os.remove(dst)
+    os.makedirs( os.path.dirname(dst), exist_ok=True )
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass # e.g., different file systems; copy instead
+    shutil.copy2(src, dst) # N.B. keep mtime so the next sync is quick
+
+def prune( src, dst ):
+    """
+    Remove files (and empty directories) from dst that do not exist in src.
+    """
+    for dirpath, dirnames, filenames in os.walk(dst, topdown=False):
+        rel = os.path.relpath(dirpath, dst)
+        for fn in filenames:
+            if not os.path.exists(os.path.join(src, rel, fn)):
+                os.remove(os.path.join(dirpath, fn))
+        if (rel != '.') and (len(os.listdir(dirpath)) == 0):
+            os.rmdir(dirpath)
+
+def filehash( path ):
+    """
+    Compute the sha1 hash of a file's contents.
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
 
 def ingest( source ):
     """
@@ -1,7 +1,19 @@
 """
 A python package for creating and testing rockhopper virtual field trips.
 """
+import importlib
 
 # expose these functions as "public"
-from .clouds import loadPLY, savePLY, exportZA
-from .server import VFT
\ No newline at end of file
+# (N.B. these are imported on first use, as the server and cloud conversion
+#  tools depend on several large packages that are slow to import)
+_lazy = {'loadPLY' : 'clouds', 'savePLY' : 'clouds', 'exportZA' : 'clouds',
+         'VFT' : 'server', 'TourHost' : 'hosting'}
+__all__ = list(_lazy.keys())
+
+def __getattr__(name):
+    if name in _lazy:
+        return getattr(importlib.import_module('.' + _lazy[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals().keys()) + __all__)
@@ -0,0 +1,5 @@
+"""
+Run the rockhopper command line interface (`python -m rockhopper ...`).
+"""
+from rockhopper.cli import main
+main()
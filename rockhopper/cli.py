@@ -0,0 +1,220 @@
+"""
+A command line interface for common rockhopper tasks, e.g.:
+
+```
+rockhopper serve ./my_tour --clouds ./my_clouds
+rockhopper host tours.json --port 8080
+rockhopper convert cloud.ply ./my_clouds/cloud.zarr --resolution 0.05
+rockhopper convert big.ply ./my_clouds/big.zarr --workers 8 --job /shared/big.job
+rockhopper worker /shared/big.job
+rockhopper dedupe ./blobs ./v1/clouds/*.zarr ./v2/clouds/*.zarr
+rockhopper photosphere ./my_tour site1 pano.jpg
+rockhopper export ./my_tour
+rockhopper loadtest ./my_tour --clouds ./my_clouds --clients 30 --duration 60
+```
+
+Subsystems (and their heavy dependencies) are only imported by the commands that need them.
+"""
+import argparse
+import time
+import sys
+
+def getMetrics(args):
+    """
+    Create a `rockhopper.metrics.Metrics` instance if metrics were requested.
+    """
+    if not (args.metrics or args.slow_log):
+        return None
+    from rockhopper.metrics import Metrics
+    return Metrics(slow=args.slow if args.slow_log else None, slow_log=args.slow_log)
+
+def serve(args):
+    """
+    Run a (development) server for an existing VFT until interrupted.
+    """
+    from rockhopper.server import VFT
+    vft = VFT(args.vft_path, cloud_path=args.clouds, devMode=not args.static, metrics=getMetrics(args))
+    vft.start(port=args.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping server")
+    vft.stop()
+
+def host(args):
+    """
+    Host several VFTs defined in a json config file until interrupted (see `rockhopper.hosting.TourHost`).
+    """
+    from rockhopper.hosting import TourHost
+    server = TourHost(config=args.config, devMode=args.dev, metrics=getMetrics(args))
+    server.start(port=args.port, host=args.host)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping server")
+    server.stop()
+
+def convert(args):
+    """
+    Convert a PLY file to a streamable zarr dataset (see `rockhopper.exportZA`).
+    """
+    import numpy as np
+    from rockhopper.clouds import loadPLY, exportZA
+    cloud = loadPLY(args.ply)
+    if 'rgb' not in cloud:
+        cloud['rgb'] = np.zeros_like(cloud['xyz'])
+    points = np.hstack([cloud['xyz'], cloud['rgb']] + ([cloud['attr']] if 'attr' in cloud else []))
+    normals = None if args.no_normals else cloud.get('normals', None)
+    print("Building stream with shape %s"%str(points.shape))
+    if (args.workers > 1) or (args.job is not None):
+        from rockhopper.tiling import convertTiled
+        assert args.codec is None, "Codec auto-tuning is not supported with several workers."
+        convertTiled(points, args.zarr, job_path=args.job, workers=args.workers, tile_size=args.tile_size,
+                     chunk_size=args.chunk_size, resolution=args.resolution,
+                     progressive=args.progressive, overviews=args.overviews,
+                     normals=normals, normal_bits=args.normal_bits, preview=args.preview or None)
+    else:
+        exportZA(points, args.zarr, chunk_size=args.chunk_size, resolution=args.resolution,
+                 codec=args.codec, progressive=args.progressive, overviews=args.overviews,
+                 normals=normals, normal_bits=args.normal_bits, preview=args.preview or None)
+
+def worker(args):
+    """
+    Help convert the tiles of a (shared) conversion job started using `rockhopper convert --job ...`.
+    """
+    from rockhopper.tiling import runWorker
+    n = runWorker(args.job, timeout=args.timeout)
+    print(f"Processed {n} tiles")
+
+def photosphere(args):
+    """
+    Add a photosphere to an existing VFT (see `rockhopper.VFT.addPhotosphere`).
+    """
+    from rockhopper.server import VFT
+    vft = VFT(args.vft_path)
+    vft.addPhotosphere(args.site, args.image)
+    vft.flush()
+
+def export(args):
+    """
+    Prepare a VFT for static hosting by refreshing the viewer files, writing
+    per-site tab bundles (see `rockhopper.VFT.buildBundles`) and planning the
+    order in which chunks are fetched (see `rockhopper.VFT.buildPrefetch`).
+    """
+    from rockhopper.server import VFT
+    vft = VFT(args.vft_path, cloud_path=args.clouds, overwrite=True)
+    vft.buildBundles()
+    for pth, n in vft.buildPrefetch(batch_size=args.batch_size).items():
+        print(f"Planned {n} views for {pth}")
+    vft.flush()
+    print(f"Exported {args.vft_path}")
+
+def dedupe(args):
+    """
+    Move the chunks of several streams into a shared, content-addressed blob store (see `rockhopper.clouds.storeBlobs`).
+    """
+    from rockhopper.clouds import storeBlobs, pruneBlobs
+    for pth in args.streams:
+        stats = storeBlobs(pth, args.blobs, symlink=args.symlink)
+        print(f"{pth}: {stats['files']} chunks, {stats['new']} new blobs, {stats['saved']/1e6:.1f} MB saved")
+    if args.prune:
+        print(f"Pruned {pruneBlobs(args.blobs)/1e6:.1f} MB of unused blobs")
+
+def loadtest(args):
+    """
+    Simulate many viewers streaming a tour at once and report latencies for each route (see `rockhopper.loadtest`).
+    """
+    from rockhopper.loadtest import runLoadTest
+    target = args.target
+    if not target.startswith('http'):
+        from rockhopper.server import VFT
+        target = VFT(args.target, cloud_path=args.clouds, devMode=False)
+    stats = runLoadTest(target, clients=args.clients, visits=args.visits, duration=args.duration,
+                        max_chunks=args.max_chunks, ramp=args.ramp, port=args.port)
+    print(stats.report())
+    if not isinstance(target, str):
+        target.stop()
+
+def addMetricsArgs(p):
+    p.add_argument('--metrics', action='store_true', help='Record request metrics and serve them at /metrics.')
+    p.add_argument('--slow-log', default=None, help='A file to log slow requests to (also enables metrics).')
+    p.add_argument('--slow', type=float, default=1.0, help='The time (in seconds) after which a request is slow.')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='rockhopper', description='Build and serve rockhopper virtual field trips.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('serve', help='Run a development server for a VFT.')
+    p.add_argument('vft_path', help='The VFT directory.')
+    p.add_argument('--clouds', default=None, help='The directory containing point cloud streams.')
+    p.add_argument('--port', type=int, default=4002, help='The port to serve on.')
+    p.add_argument('--static', action='store_true', help='Disable editing (as for deployment).')
+    addMetricsArgs(p)
+    p.set_defaults(func=serve)
+
+    p = commands.add_parser('host', help='Host many VFTs from one server process.')
+    p.add_argument('config', help='A json file mapping URL prefixes to VFT directories (reloaded when changed).')
+    p.add_argument('--port', type=int, default=4002, help='The port to serve on.')
+    p.add_argument('--host', default='127.0.0.1', help='The address to serve on.')
+    p.add_argument('--dev', action='store_true', help='Allow editing of the hosted tours.')
+    addMetricsArgs(p)
+    p.set_defaults(func=host)
+
+    p = commands.add_parser('convert', help='Convert a PLY point cloud to a streamable zarr dataset.')
+    p.add_argument('ply', help='The PLY file to convert.')
+    p.add_argument('zarr', help='The zarr store to create.')
+    p.add_argument('--resolution', type=float, default=0.1, help='The resolution to downsample to.')
+    p.add_argument('--chunk-size', type=int, default=200000, help='The number of points per chunk.')
+    p.add_argument('--codec', choices=['size', 'speed'], default=None, help='Auto-tune compression for this goal.')
+    p.add_argument('--progressive', action='store_true', help='Order points within each chunk progressively.')
+    p.add_argument('--overviews', type=int, default=1, help='The number of overview chunks.')
+    p.add_argument('--no-normals', action='store_true', help='Do not include normals from the PLY file.')
+    p.add_argument('--normal-bits', type=int, choices=[8, 16], default=16, help='Bits per encoded normal component.')
+    p.add_argument('--preview', type=int, default=256, help='The size of the preview image (0 to skip it).')
+    p.add_argument('--workers', type=int, default=1, help='Convert tiles of the cloud using this many local processes.')
+    p.add_argument('--tile-size', type=float, default=100.0, help='The width of each tile when using several workers.')
+    p.add_argument('--job', default=None, help='A (shared) directory to store the tiles in, such that other machines can help.')
+    p.set_defaults(func=convert)
+
+    p = commands.add_parser('worker', help='Help convert the tiles of a (shared) conversion job.')
+    p.add_argument('job', help='The job directory.')
+    p.add_argument('--timeout', type=float, default=3600, help='Seconds after which unfinished tiles are assumed to have crashed.')
+    p.set_defaults(func=worker)
+
+    p = commands.add_parser('photosphere', help='Add a photosphere site to a VFT.')
+    p.add_argument('vft_path', help='The VFT directory.')
+    p.add_argument('site', help='The name of the site to create.')
+    p.add_argument('image', help='The photosphere image.')
+    p.set_defaults(func=photosphere)
+
+    p = commands.add_parser('export', help='Prepare a VFT for static hosting.')
+    p.add_argument('vft_path', help='The VFT directory.')
+    p.add_argument('--clouds', default=None, help='The directory containing point cloud streams.')
+    p.add_argument('--batch-size', type=int, default=8, help='The number of chunks clients should fetch at once.')
+    p.set_defaults(func=export)
+
+    p = commands.add_parser('dedupe', help='Store the chunks of several streams only once, in a shared blob store.')
+    p.add_argument('blobs', help='The blob store directory.')
+    p.add_argument('streams', nargs='*', help='The zarr stores to deduplicate.')
+    p.add_argument('--symlink', action='store_true', help='Use symbolic (rather than hard) links.')
+    p.add_argument('--prune', action='store_true', help='Delete blobs that are no longer used by any stream.')
+    p.set_defaults(func=dedupe)
+
+    p = commands.add_parser('loadtest', help='Simulate many viewers streaming a tour at once.')
+    p.add_argument('target', help='A VFT directory (served locally) or the URL of a running server.')
+    p.add_argument('--clouds', default=None, help='The directory containing point cloud streams.')
+    p.add_argument('--clients', type=int, default=10, help='The number of concurrent viewers.')
+    p.add_argument('--visits', type=int, default=1, help='The number of sites each viewer visits.')
+    p.add_argument('--duration', type=float, default=None, help='Keep visiting sites for this many seconds.')
+    p.add_argument('--max-chunks', type=int, default=None, help='The maximum number of chunks to stream per visit.')
+    p.add_argument('--ramp', type=float, default=0.0, help='Start the viewers over this many seconds.')
+    p.add_argument('--port', type=int, default=4002, help='The port to serve a local VFT on.')
+    p.set_defaults(func=loadtest)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
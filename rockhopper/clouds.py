@@ -2,14 +2,11 @@
 Load and save point cloud data.
 """
 import os
+import time
 import numpy as np 
-import zarr
-from numcodecs import Blosc
-#from zarr.codecs import BloscCodec
-from sklearn.cluster import MiniBatchKMeans
-from tqdm import tqdm
-from scipy.spatial import KDTree
 import warnings
+# N.B. heavier dependencies (zarr, numcodecs, scikit-learn, scipy and tqdm) are imported
+# by the functions that need them, so that e.g., `loadPLY` can be used without loading them.
 
 def savePLY(path, xyz, rgb=None, normals=None, attr=None, names=None):
     """
@@ -138,9 +135,1129 @@ def loadPLY(path):
         del out['normals']
     return out
 
+def tuneCodec(samples, goal='size', filters=[]):
+    """
+    Try a range of Blosc compressors (and, optionally, filter chains) on some sample
+    data and return the one that best suits the specified goal.
+
+    Parameters
+    ----------
+    samples : list
+        A list of numpy arrays (e.g., a few representative chunks) to test candidate codecs on.
+    goal : str
+        The trade-off to optimise for. Options are 'size' (smallest compressed size, ties
+        broken by decode speed) or 'speed' (fastest decode).
+    filters : list
+        A list of filter chains (each a list of numcodecs codecs) to try in addition to
+        no filters. N.B. the bundled javascript viewer cannot decode zarr filters, so these
+        should only be used if the stream will be read by some other client.
+
+    Returns
+    --------
+    compressor : numcodecs.Blosc
+        The best compressor.
+    filters : list
+        The best filter chain (an empty list if no filters should be used).
+    report : dict
+        A (json serialisable) dictionary containing the selected codec, filters and the
+        measured compression ratio and decode speed.
+    """
+    from numcodecs import Blosc
+    assert goal in ['size', 'speed'], "Error - goal must be 'size' or 'speed', not %s" % goal
+    raw = sum([s.nbytes for s in samples])
+
+    # build candidate compressors
+    candidates = []
+    for cname, levels in [('zstd', [1, 3, 5, 9]), ('lz4', [1, 5, 9])]:
+        for clevel in levels:
+            for shuffle in [Blosc.NOSHUFFLE, Blosc.SHUFFLE, Blosc.BITSHUFFLE]:
+                candidates.append( Blosc(cname=cname, clevel=clevel, shuffle=shuffle) )
+
+    # evaluate each combination of compressor and filter chain
+    best = None
+    for chain in [[]] + list(filters):
+        encoded = []
+        for s in samples: # apply filters once per chain
+            buf = s
+            for f in chain:
+                buf = f.encode(buf)
+            encoded.append(buf)
+        for c in candidates:
+            nbytes = 0
+            dtime = 0
+            for buf in encoded:
+                b = c.encode(buf)
+                nbytes += len(b)
+                t = []
+                for _ in range(3): # take fastest of several decodes to reduce noise
+                    t0 = time.perf_counter()
+                    out = c.decode(b)
+                    for f in chain[::-1]:
+                        out = f.decode(out)
+                    t.append(time.perf_counter() - t0)
+                dtime += min(t)
+            score = (nbytes, dtime) if goal == 'size' else (dtime, nbytes)
+            if (best is None) or (score < best[0]):
+                best = (score, c, chain, nbytes, dtime)
+
+    _, compressor, chain, nbytes, dtime = best
+    report = dict( goal=goal,
+                   compressor=compressor.get_config(),
+                   filters=[f.get_config() for f in chain],
+                   ratio=float(raw / max(nbytes, 1)),
+                   decode_MBps=float(raw / max(dtime, 1e-9) / 1e6),
+                   candidates=len(candidates)*(len(filters)+1) )
+    return compressor, list(chain), report
+
+def progressiveOrder(xyz, resolution=None, seed=42, count=None):
+    """
+    Compute an ordering for the specified points such that any prefix of the re-ordered
+    points is a spatially uniform subsample of the whole. This is done by shuffling the points and then
+    sorting them by the coarsest level of an octree at which they are the first point in their voxel.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        Array of shape (N, 3+) containing the point positions.
+    resolution : float
+        The finest voxel size to consider. If None, octree levels are added until each point has its own voxel.
+    seed : int
+        Seed for the random shuffle, such that the ordering is deterministic.
+    count : int
+        If not None, refinement stops once the first `count` points have been ordered. This is much faster
+        when only a (stratified) subsample of the points is needed.
+
+    Returns
+    --------
+    An array of N indices that sort the points into progressive order.
+    """
+    n = len(xyz)
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(n)
+    if n < 2:
+        return order
+    p = xyz[order, :3] - np.min(xyz[:, :3], axis=0)
+    extent = max(float(np.max(p)), 1e-9)
+    nlevels = 20 # N.B. this keeps voxel keys within int64
+    if resolution:
+        nlevels = min(nlevels, int(np.ceil(np.log2(extent / resolution))) + 1)
+
+    # find the level at which each point first represents a voxel
+    level = np.full(n, nlevels, dtype=np.int32)
+    for L in range(nlevels):
+        nv = 2**L + 1
+        v = np.floor(p * (2**L / extent)).astype(np.int64)
+        key = (v[:, 0] * nv + v[:, 1]) * nv + v[:, 2]
+        _, first = np.unique(key, return_index=True) # N.B. first point in (shuffled) order
+        level[first[level[first] > L]] = L
+        if len(first) == n:
+            break # all points are in their own voxel
+        if (count is not None) and (len(first) >= count):
+            break # we have enough points
+    return order[np.argsort(level, kind='stable')]
+
+def styleBands(style):
+    """
+    Get the band indices needed to draw a stylesheet entry or highlight/mask group (see `exportZA`).
+
+    Parameters
+    ----------
+    style : dict
+        The stylesheet entry (e.g., `{'color': (2, {...})}`) or group (e.g., `{'iq': [6, '=', 3]}`).
+
+    Returns
+    --------
+    A list of band indices.
+    """
+    bands = []
+    if 'color' in style:
+        if isinstance(style['color'], dict): # ternary mapping
+            bands += [style['color'][c][0] for c in 'RGB']
+        elif (len(style['color']) == 2) and isinstance(style['color'][1], dict): # colour ramp
+            bands.append( style['color'][0] )
+    for k in ['iq', 'mask']: # groups
+        if k in style:
+            bands.append( style[k][0] )
+    return [int(b) for b in bands]
+
+def groupChunks(groups, categorical):
+    """
+    Find the chunks that a highlight or mask group needs to update, based on the categories present
+    in each chunk (see the `categorical` argument of `exportZA`).
+
+    Parameters
+    ----------
+    groups : dict
+        The groups dictionary passed to `exportZA`.
+    categorical : dict
+        The "categorical" attribute of a stream exported by `exportZA`.
+
+    Returns
+    --------
+    A dictionary containing, for each group with an "iq" or "mask" condition on a categorical band,
+    a list of the chunks containing points to highlight ("iq") and the chunks containing points that
+    remain visible ("mask").
+    """
+    ops = {'=' : np.equal, '!=' : np.not_equal, '<' : np.less_equal, '>' : np.greater_equal} # N.B. matches the viewer
+    bands = {v['band'] : v for v in categorical.values()}
+    out = {}
+    for name, g in groups.items():
+        for key in ['iq', 'mask']:
+            if (key not in g) or (g[key][0] not in bands) or (g[key][1] not in ops):
+                continue
+            band, op, value = g[key]
+            match = ops[op]( np.array(bands[band]['dictionary'], dtype=np.float64), value ) # which codes match? (N.B. null is NaN)
+            if key == 'mask':
+                match = ~match # masked points are hidden
+            out.setdefault(name, {})[key] = [i for i, p in enumerate(bands[band]['presence'])
+                                                if np.any(match[np.array(p, dtype=int)])]
+    return out
+
+def readChunk(zarr_store_path, index, count=None, columns=None):
+    """
+    Read the points in one chunk of a stream created using `exportZA`. If the stream was exported with a
+    `block_size`, only the blocks needed to return the first `count` points are read from the store.
+
+    Parameters
+    ----------
+    zarr_store_path : str
+        Path to the Zarr store.
+    index : int
+        The index of the chunk to read.
+    count : int
+        The number of points to read. If None, all points in the chunk are returned. For streams
+        exported with `progressive=True`, these will be a spatially uniform subsample of the chunk.
+    columns : list
+        For streams exported with a column layout, the names of the column groups to read. If None (default),
+        all columns are read.
+
+    Returns
+    --------
+    A numpy array of shape (count, d) containing the points (relative to the stream's origin). For
+    column layouts, bands are returned in the order of the selected column groups.
+    """
+    import zarr
+    z = zarr.open_group(zarr_store_path, mode='r')
+    if z.attrs.get('layout', 'rows') == 'rows':
+        return z["c%d" % index][:count]
+    if columns is None:
+        columns = sorted( z.attrs['columns'].keys(), key=lambda k: min(z.attrs['columns'][k]) )
+    out = []
+    for k in columns:
+        a = z["c%d/%s" % (index, k)][:count]
+        if k in z.attrs.get('categorical', {}): # decode categorical bands
+            a = np.array(z.attrs['categorical'][k]['dictionary'], dtype=np.float32)[a]
+        out.append(a)
+    return np.hstack(out)
+
+class BandStats(object):
+    """
+    Single-pass (streaming) statistics for each band of a point cloud. Chunks of points are added
+    using `update(...)`, which tracks the min, max, mean and variance of each band, as well as a
+    fixed-size uniform (bottom-k) sample of points from which quantiles and histograms are approximated.
+    Missing (NaN) values are ignored.
+    """
+    def __init__(self, nbands, sample_size=100000, bins=64, seed=42):
+        """
+        Parameters
+        ----------
+        nbands : int
+            The number of bands in each point.
+        sample_size : int
+            The number of points to keep for estimating quantiles and histograms.
+        bins : int
+            The number of histogram bins to compute for each band.
+        seed : int
+            Seed for the random sampling, such that the statistics are deterministic.
+        """
+        self.n = 0
+        self.count = np.zeros(nbands) # number of (non-NaN) values in each band
+        self.min = np.full(nbands, np.inf)
+        self.max = np.full(nbands, -np.inf)
+        self.mean = np.zeros(nbands)
+        self.m2 = np.zeros(nbands)
+        self.sample_size = sample_size
+        self.bins = bins
+        self.rng = np.random.default_rng(seed)
+        self.sample = np.zeros((0, nbands))
+        self.keys = np.zeros(0)
+
+    def update(self, points):
+        """
+        Add an (n, nbands) array of points to these statistics.
+        """
+        if len(points) == 0:
+            return
+        points = np.asarray(points, dtype=np.float64)
+        valid = ~np.isnan(points)
+        self.min = np.minimum(self.min, np.min(np.where(valid, points, np.inf), axis=0))
+        self.max = np.maximum(self.max, np.max(np.where(valid, points, -np.inf), axis=0))
+
+        # merge mean and variance (Chan et al.)
+        count = np.sum(valid, axis=0)
+        n = np.maximum(self.count + count, 1)
+        mean = np.where(valid, points, 0).sum(axis=0) / np.maximum(count, 1)
+        delta = mean - self.mean
+        self.m2 += np.sum(np.where(valid, points - mean, 0)**2, axis=0) + delta**2 * self.count * count / n
+        self.mean += delta * count / n
+        self.count = self.count + count
+        self.n += len(points)
+
+        # keep the points with the smallest random keys (a uniform sample)
+        keys = self.rng.random(len(points))
+        self.keys = np.hstack([self.keys, keys])
+        self.sample = np.vstack([self.sample, points])
+        if len(self.keys) > self.sample_size:
+            keep = np.argpartition(self.keys, self.sample_size)[:self.sample_size]
+            self.keys = self.keys[keep]
+            self.sample = self.sample[keep]
+
+    def merge(self, other):
+        """
+        Add the statistics of another BandStats instance (e.g., computed for a different part of the cloud) to these ones.
+        """
+        if other.n == 0:
+            return
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        n = np.maximum(self.count + other.count, 1)
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta**2 * self.count * other.count / n
+        self.mean += delta * other.count / n
+        self.count = self.count + other.count
+        self.n += other.n
+        self.keys = np.hstack([self.keys, other.keys])
+        self.sample = np.vstack([self.sample, other.sample])
+        if len(self.keys) > self.sample_size:
+            keep = np.argpartition(self.keys, self.sample_size)[:self.sample_size]
+            self.keys = self.keys[keep]
+            self.sample = self.sample[keep]
+
+    def save(self, path):
+        """
+        Save these statistics to a .npz file (see `BandStats.load`).
+        """
+        np.savez(path, n=self.n, count=self.count, min=self.min, max=self.max, mean=self.mean, m2=self.m2,
+                 sample=self.sample, keys=self.keys, sample_size=self.sample_size, bins=self.bins)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load statistics saved using `BandStats.save`.
+        """
+        f = np.load(path)
+        out = cls( len(f['mean']), sample_size=int(f['sample_size']), bins=int(f['bins']) )
+        out.n = int(f['n'])
+        for k in ['count', 'min', 'max', 'mean', 'm2', 'sample', 'keys']:
+            setattr(out, k, f[k])
+        return out
+
+    def quantile(self, q):
+        """
+        Get the (approximate) q'th quantile of each band.
+        """
+        if len(self.sample) == 0:
+            return np.full( np.shape(q) + (len(self.mean),), np.nan )
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # bands with only missing values
+            return np.nanquantile(self.sample, q, axis=0)
+
+    def toDict(self, quantiles=(0.01, 0.02, 0.05, 0.25, 0.5, 0.75, 0.95, 0.98, 0.99)):
+        """
+        Convert these statistics to a (json serialisable) dictionary.
+        """
+        q = self.quantile(quantiles)
+        bands = []
+        for b in range(len(self.mean)):
+            values = self.sample[:, b][~np.isnan(self.sample[:, b])]
+            counts, _ = np.histogram(values, bins=self.bins,
+                                     range=(self.min[b], self.max[b]) if self.count[b] > 0 else (0, 1))
+            counts = counts * (self.n / max(len(self.sample), 1)) # scale to full cloud
+            if self.count[b] == 0: # only missing values
+                bands.append( dict( min=None, max=None, mean=None, std=None, quantiles=[None for v in q[:, b]],
+                                    histogram=[0 for c in counts] ) )
+                continue
+            bands.append( dict( min=float(self.min[b]), max=float(self.max[b]),
+                                mean=float(self.mean[b]), std=float(np.sqrt(self.m2[b] / self.count[b])),
+                                quantiles=[float(v) for v in q[:, b]],
+                                histogram=[int(round(c)) for c in counts] ) )
+        return dict( count=int(self.n), quantiles=list(quantiles), bins=self.bins, bands=bands )
+
+def fitStyles(stylesheet, stats, lower=0.02, upper=0.98):
+    """
+    Fill in missing `limits` in a stylesheet (see `exportZA`) using band statistics. Colour ramps with
+    no limits (or limits set to 'auto') and ternary mappings with only a band index (or None for the min and max)
+    are stretched between the specified quantiles.
+
+    Parameters
+    ----------
+    stylesheet : dict
+        The stylesheet to update. This is not modified in place.
+    stats : BandStats | dict
+        Statistics for the bands in the cloud, or the "stats" attribute of an exported stream
+        (in which case limits are interpolated from the stored quantiles).
+    lower : float
+        The quantile to use as the lower limit.
+    upper : float
+        The quantile to use as the upper limit.
+
+    Returns
+    --------
+    A copy of the stylesheet with limits filled in.
+    """
+    if isinstance(stats, dict):
+        vmin, vmax = [np.array([np.interp(q, stats['quantiles'], b['quantiles']) for b in stats['bands']])
+                      for q in [lower, upper]]
+    else:
+        vmin, vmax = stats.quantile([lower, upper])
+    out = {}
+    for name, style in stylesheet.items():
+        style = dict(style)
+        color = style.get('color', None)
+        if isinstance(color, dict): # ternary mapping
+            color = dict(color)
+            for c in 'RGB':
+                v = list(color[c])
+                if (len(v) < 3) or (v[1] is None) or (v[2] is None):
+                    color[c] = [v[0], float(vmin[v[0]]), float(vmax[v[0]])]
+            style['color'] = color
+        elif (color is not None) and (len(color) == 2) and isinstance(color[1], dict): # colour ramp
+            index, options = color
+            options = dict(options)
+            limits = options.get('limits', 'auto')
+            if isinstance(limits, str) or (limits is None):
+                options['limits'] = [float(vmin[index]), float(vmax[index]), 255]
+            style['color'] = [index, options]
+        out[name] = style
+    return out
+
+def resolveColumns(columns, nbands):
+    """
+    Check (and, if `columns=True`, define) the column groups of a stream (see the `columns` argument of `exportZA`).
+
+    Returns
+    --------
+    A dictionary of `{name : [band indices]}`, or None for a rows layout.
+    """
+    if columns is True:
+        columns = {'xyz' : [0,1,2]}
+        if nbands >= 6:
+            columns['rgb'] = [3,4,5]
+        for b in range(len(sum(columns.values(), [])), nbands):
+            columns['b%d'%b] = [b] # one array per additional band
+    if columns is not None:
+        columns = {k : [int(b) for b in v] for k, v in columns.items()}
+        assert columns.get('xyz', None) == [0,1,2], "Error - columns must include an 'xyz' array containing bands [0,1,2]"
+        assert sorted(sum(columns.values(), [])) == list(range(nbands)), \
+                    "Error - columns must contain each band exactly once"
+    return columns
+
+def findCategorical(points, columns, categorical):
+    """
+    Find the categorical bands of a point cloud (see the `categorical` argument of `exportZA`).
+
+    Returns
+    --------
+    A dictionary of `{band index : column name}`.
+    """
+    catbands = {}
+    if categorical is not None:
+        assert columns is not None, "Error - categorical bands can only be encoded using a column layout (see `columns`)."
+        single = {v[0] : k for k, v in columns.items() if (len(v) == 1) and (k != 'xyz')}
+        auto = categorical == 'auto'
+        if auto:
+            categorical = list( single.keys() )
+        for b in categorical:
+            assert b in single, "Error - categorical band %d must be stored in its own column." % b
+            values = buildDictionary( points[:, b] )
+            finite = values[~np.isnan(values)] # N.B. NaN (missing values) gets its own category
+            if auto and ((len(values) > 256) or np.any(finite != np.round(finite))):
+                continue # not categorical
+            assert len(values) <= 65536, "Error - band %d has too many categories (%d)." % (b, len(values))
+            catbands[b] = single[b]
+    return catbands
+
+def buildDictionary(values):
+    """
+    Get the sorted (float32) categories of a categorical band, used to dictionary encode it (see `splitChunk`).
+    NaN values (if any) are kept as a single category after all others.
+    """
+    values = np.unique( np.asarray(values).astype(np.float32) )
+    nan = np.isnan(values)
+    if np.sum(nan) > 1: # N.B. older numpy versions do not merge NaNs
+        values = np.append( values[~nan], np.float32(np.nan) )
+    return values
+
+def dictionaryToJSON(values):
+    """
+    Convert the categories of a band (see `buildDictionary`) to a (json serialisable) list of ints and floats,
+    with NaN stored as None (null). This is read back as NaN by `np.array(..., dtype=np.float32)`.
+    """
+    return [None if np.isnan(d) else int(d) if d == int(d) else float(d) for d in values]
+
+def cullPoints(points, resolution, keep=[]):
+    """
+    Remove duplicate points (closer than the specified resolution) by replacing each group of
+    duplicates with their average, and round positions to a precision matching the resolution
+    (which helps achieve smaller sizes after compression).
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Array of shape (N, d) containing the points. N.B. this is modified in place.
+    resolution : float
+        The distance below which points are considered duplicates.
+    keep : list
+        Indices of bands (e.g., categorical ones) that should not be averaged. For these bands
+        the value of the retained point is kept instead.
+
+    Returns
+    --------
+    The culled array of points.
+    """
+    from tqdm import tqdm
+    from scipy.spatial import KDTree
+    tree = KDTree(points[:,:3])
+    mask = np.full( points.shape[0], True)
+    for i,p in enumerate( tqdm( points, desc='Culling points', leave=False ) ):
+        if not mask[i]: continue # skip points that are already "deleted"
+        o = tree.query_ball_point(p[:3], resolution)
+        m = np.mean( points[ o ], axis=0 ) # replace with average values
+        m[keep] = points[i, keep] # (except for categorical ones)
+        points[i] = m
+        mask[o] = False # flag points to be deleted
+        mask[i] = True # except this one!
+    points = points[mask]
+
+    # round position information to specific precision
+    decimals = int( 1-np.log10( resolution ) )
+    points[:,:3] = np.round( points[:,:3], int( decimals ) )
+    return points
+
+def splitChunk(c, columns=None, dictionaries={}):
+    """
+    Split a chunk of points into the arrays that are stored for it (see `exportZA`).
+
+    Parameters
+    ----------
+    c : np.ndarray
+        Array of shape (n, d) containing the points in the chunk.
+    columns : dict
+        The column groups, or None for a rows layout.
+    dictionaries : dict
+        The sorted values of each categorical column, used to dictionary encode it.
+
+    Returns
+    --------
+    A dictionary of `{name : array}`. For rows layouts this contains a single array with key None.
+    """
+    if columns is None:
+        return {None : c} # rows layout; one array per chunk
+    out = {k : c[:, b] for k, b in columns.items()}
+    for k, values in dictionaries.items(): # dictionary encode categorical bands
+        dtype = np.uint8 if len(values) <= 256 else np.uint16
+        out[k] = np.searchsorted( values, out[k] ).astype(dtype)
+    return out
+
+def writeChunk(z, index, arrays, codecs, block_size=None):
+    """
+    Write the arrays of one chunk (see `splitChunk`) into a zarr group.
+
+    Parameters
+    ----------
+    z : zarr.Group
+        The group to write to.
+    index : int
+        The index of the chunk.
+    arrays : dict
+        The arrays to write, as returned by `splitChunk`.
+    codecs : dict
+        A `(compressor, filters)` tuple for each array.
+    block_size : int
+        The number of points per block, or None to store each array as a single block.
+    """
+    for k, a in arrays.items():
+        compressor, filters = codecs[k]
+        main_array = z.create_dataset(
+            name="c%d"%index if k is None else "c%d/%s"%(index,k),
+            shape=a.shape,
+            chunks=(min(block_size or a.shape[0], a.shape[0]), a.shape[1]),
+            dtype=a.dtype,
+            compressor=compressor,
+            filters=filters
+        )
+        main_array[:] = a
+
+# exportZA arguments that change the chunks (rather than just the attributes) of a stream
+EXPORT_ARGS = ['chunk_size', 'resolution', 'codec', 'codec_filters', 'progressive',
+               'block_size', 'overviews', 'columns', 'categorical', 'tile_size', 'blob_store', 'normals', 'normal_bits']
+
+def fingerprintCloud(cloud, **kwds):
+    """
+    Compute fingerprints that identify the input and export parameters of a stream, such that redundant
+    conversions can be skipped (see `rockhopper.VFT.addCloud`).
+
+    Parameters
+    ----------
+    cloud : str | pathlib.Path | np.ndarray
+        The .ply file (identified by its path, size and modification time) or array (identified by
+        a hash of its contents) being converted.
+
+    Keywords
+    ---------
+    The keywords passed to `exportZA`.
+
+    Returns
+    --------
+    A dictionary containing an "input" fingerprint, an "export" fingerprint (for the arguments that
+    change the chunks; see `EXPORT_ARGS`) and a "style" fingerprint (for all other arguments, which
+    only change the attributes; see `updateStyles`).
+    """
+    import hashlib
+    import json
+    def digest(value):
+        def default(o):
+            if hasattr(o, 'get_config'): # numcodecs codec
+                return o.get_config()
+            if isinstance(o, np.ndarray): # N.B. hash rather than list large arrays (e.g., normals)
+                return hashlib.sha1( np.ascontiguousarray(o).view(np.uint8) ).hexdigest()
+            if isinstance(o, np.generic):
+                return o.item()
+            return str(o)
+        return hashlib.sha1( json.dumps(value, sort_keys=True, default=default).encode('utf8') ).hexdigest()
+    if isinstance(cloud, np.ndarray):
+        h = hashlib.sha1( np.ascontiguousarray(cloud).view(np.uint8) )
+        h.update( str((cloud.shape, cloud.dtype.str)).encode('utf8') )
+        source = h.hexdigest()
+    else:
+        st = os.stat(cloud)
+        source = digest( [os.path.abspath(cloud), st.st_size, st.st_mtime_ns] )
+    return dict( input=source,
+                 export=digest( {k : v for k, v in kwds.items() if k in EXPORT_ARGS} ),
+                 style=digest( {k : v for k, v in kwds.items() if k not in EXPORT_ARGS} ) )
+
+# vertical field of view (in degrees) assumed for the viewer's camera when ordering prefetches. N.B. this is the
+# widest default camera in `ThreeScene.js` (clouds start at 40), as a wider view only prefetches more chunks early
+VIEWER_FOV = 75
+
+def defaultView(centers):
+    """
+    Get the (pos, tgt) of the camera used by the viewer for sites that don't define a "view" (see `PointStream.js`).
+    """
+    lo, hi = np.min(centers[:, :3], axis=0), np.max(centers[:, :3], axis=0)
+    tgt = (lo + hi) / 2
+    d = np.linalg.norm(hi - lo) * 2
+    return tgt + np.array([0, -d/3, d/3]), tgt
+
+def prefetchOrder(centers, pos, tgt, fov=VIEWER_FOV, aspect=1.5, overviews=1, margin=0.1):
+    """
+    Order the chunks of a stream for a camera view, such that clients can fetch them in batches rather than
+    searching for the next chunk to load after each one arrives. Overview chunks come first, then chunks
+    whose center is visible ordered by their distance from the center of the screen (as in `PointStream.js`),
+    and then all other chunks ordered by their distance from the camera.
+
+    Parameters
+    ----------
+    centers : np.ndarray
+        The (n, 3+) chunk centers of the stream (see `exportZA`).
+    pos : np.ndarray
+        The position of the camera (in the stream's coordinates, relative to its origin).
+    tgt : np.ndarray
+        The point the camera looks at.
+    fov : float
+        The vertical field of view of the camera (in degrees). Defaults to `VIEWER_FOV`.
+    aspect : float
+        The aspect ratio (width / height) of the screen.
+    overviews : int
+        The number of overview chunks.
+    margin : float
+        Extra space around the edges of the screen (as a fraction of its size) within which chunks are treated as
+        visible (as points in chunks just off-screen will often still be visible).
+
+    Returns
+    --------
+    A list of chunk indices.
+    """
+    xyz = np.asarray(centers, dtype=np.float64)[:, :3]
+    pos, tgt = np.asarray(pos, dtype=np.float64), np.asarray(tgt, dtype=np.float64)
+    f = (tgt - pos) / (np.linalg.norm(tgt - pos) + 1e-12)
+    r = np.cross( f, [0, 0, 1] ) # N.B. the viewer keeps z up
+    if np.linalg.norm(r) < 1e-6: # looking straight up or down
+        r = np.cross( f, [0, 1, 0] )
+    r /= np.linalg.norm(r)
+    u = np.cross( r, f )
+
+    # project chunk centers into normalised screen coordinates
+    v = xyz - pos
+    depth = v @ f
+    h = np.tan( np.deg2rad(fov) / 2 ) * np.maximum( depth, 1e-12 )
+    sx, sy = (v @ r) / (h * aspect), (v @ u) / h
+    visible = (depth > 0) & (np.abs(sx) <= 1 + margin) & (np.abs(sy) <= 1 + margin)
+
+    # overview chunks, then visible chunks (closest to screen center first), then the rest (closest first)
+    ix = np.arange( len(xyz) )
+    spatial = ix >= overviews
+    order = list( ix[~spatial] )
+    order += list( ix[spatial & visible][ np.argsort( (sx**2 + sy**2)[spatial & visible], kind='stable' ) ] )
+    order += list( ix[spatial & ~visible][ np.argsort( np.linalg.norm(v, axis=1)[spatial & ~visible], kind='stable' ) ] )
+    return [int(i) for i in order]
+
+def writePrefetch(zarr_store_path, views, batch_size=8, fov=VIEWER_FOV, aspect=1.5):
+    """
+    Compute the chunk order (see `prefetchOrder`) for a set of camera views and store it in `prefetch.json`
+    within the stream, such that viewers can request the chunks needed for e.g., a site's start view or an
+    annotation in parallel batches immediately. The file and batch size are stored in the "prefetch" attribute.
+
+    Parameters
+    ----------
+    zarr_store_path : str
+        Path to the Zarr store (e.g., created using `exportZA`).
+    views : dict
+        A dictionary of `{name : {'pos' : [x, y, z], 'tgt' : [x, y, z]}}` camera views (in the stream's coordinates).
+        Views without a 'pos' and 'tgt' use the viewer's default view.
+    batch_size : int
+        The number of chunks clients should request at once.
+    fov : float
+        The vertical field of view of the viewer's camera (in degrees). Defaults to `VIEWER_FOV`.
+    aspect : float
+        The aspect ratio assumed for the viewer's screen.
+
+    Returns
+    --------
+    A dictionary of `{name : {'pos' : ..., 'tgt' : ..., 'chunks' : [...]}}` (as stored in `prefetch.json`).
+    """
+    import json
+    import zarr
+    z = zarr.open_group(zarr_store_path, mode='r+')
+    centers = z['chunk_centers'][:]
+    overviews = z.attrs.get('overviews', 1)
+    out = {}
+    for name, view in views.items():
+        view = view or {}
+        if ('pos' in view) and ('tgt' in view):
+            pos, tgt = np.array(view['pos']), np.array(view['tgt'])
+        else:
+            pos, tgt = defaultView( centers )
+        out[name] = dict( pos=[float(p) for p in pos], tgt=[float(t) for t in tgt],
+                          chunks=prefetchOrder( centers, pos, tgt, fov=fov, aspect=aspect, overviews=overviews ) )
+    with open( os.path.join(zarr_store_path, 'prefetch.json'), 'w' ) as f:
+        json.dump( dict( batch_size=int(batch_size), fov=fov, aspect=aspect, views=out ), f )
+    z.attrs['prefetch'] = dict( file='prefetch.json', batch_size=int(batch_size), views=sorted(out.keys()) )
+    return out
+
+def readPoints(zarr_store_path, index, count=None):
+    """
+    Read the points in one chunk of a stream (see `readChunk`), with bands in their original order for
+    both rows and column layouts.
+    """
+    import zarr
+    attrs = zarr.open_group(zarr_store_path, mode='r').attrs.asdict()
+    c = readChunk( zarr_store_path, index, count )
+    if attrs.get('layout', 'rows') == 'columns':
+        keys = sorted( attrs['columns'].keys(), key=lambda k: min(attrs['columns'][k]) )
+        c = c[:, np.argsort( np.concatenate([attrs['columns'][k] for k in keys]) )]
+    return c
+
+def updateStyles(zarr_store_path, stylesheet=None, styles=None, preview=256, preview_view='auto', **kwds):
+    """
+    Update the visualisation styles (and any other metadata) of an existing stream without re-chunking it. Missing
+    style limits are filled using the band statistics stored during export (see `fitStyles`).
+
+    Parameters
+    ----------
+    zarr_store_path : str
+        Path to the Zarr store created using `exportZA`.
+    stylesheet : dict
+        The new stylesheet (see `exportZA`). If None, the default stylesheet is used.
+    styles : list
+        The styles to make available to the front-end. If None, all keys from stylesheet are used.
+    preview : int | tuple
+        The size of the preview image, which is re-rendered using the new styles (see `writePreview`).
+        Set as None to keep the existing preview (if any).
+    preview_view : str | np.ndarray
+        The direction to render the preview from (see `renderPreview`).
+
+    Keywords
+    ---------
+    Any additional keyword arguments (e.g., "groups") are stored as metadata, as for `exportZA`.
+    """
+    import zarr
+    z = zarr.open_group(zarr_store_path, mode='r+')
+    attrs = z.attrs.asdict()
+    assert 'stats' in attrs, "Error - %s has no band statistics. Please re-export it." % zarr_store_path
+    nbands = len(attrs['stats']['bands'])
+    if stylesheet is None:
+        if nbands >= 6:
+            stylesheet = {'rgb':{'color':{'R':[3,0,1],'G':[4,0,1],'B':[5,0,1]}}}
+        else:
+            stylesheet = {'elev':{'color':(2, {'scale':'viridis', 'limits':'auto'})}}
+    if styles is None:
+        styles = list( stylesheet.keys() )
+    for k in styles:
+        assert k in stylesheet, "Style %s is not in the stylesheet?"%k
+
+    attrs.update( styles=styles, stylesheet=fitStyles( stylesheet, attrs['stats'] ), **kwds )
+    if 'groups' not in kwds: # groups were removed
+        for k in ['groups', 'group_columns', 'group_chunks']:
+            attrs.pop(k, None)
+    columns = attrs.get('columns', None)
+    if columns is not None:
+        def lookup(bands):
+            return ['xyz'] + [k for k, v in columns.items() if (k != 'xyz') and (len(set(v) & set(bands)) > 0)]
+        attrs['style_columns'] = {k : lookup(styleBands(stylesheet[k])) for k in styles}
+        if 'groups' in kwds:
+            attrs['group_columns'] = {k : lookup(styleBands(v)) for k, v in kwds['groups'].items()}
+    if ('categorical' in attrs) and ('groups' in kwds):
+        attrs['group_chunks'] = groupChunks( kwds['groups'], attrs['categorical'] )
+    z.attrs.put( attrs )
+    if preview is not None:
+        writePreview( zarr_store_path, size=preview, view=preview_view )
+
+def storeBlobs(zarr_store_path, blob_path, symlink=False):
+    """
+    Deduplicate the chunk payloads of a (directory) zarr store by moving them into a content-addressed blob store
+    (`blob_path/ab/abcdef...`, named by the SHA-256 of their bytes) and linking them back into the stream. Streams that
+    share a blob store (e.g., overlapping crops of the same scan, or several versions of a tour) then only store
+    (and upload) each distinct chunk once. The hash of each payload is written to `blobs.json` in the store, and
+    the location of the blob store to the "blobs" attribute.
+
+    Parameters
+    ----------
+    zarr_store_path : str
+        Path to the Zarr store (e.g., created using `exportZA`).
+    blob_path : str
+        The blob store directory. This is created if needed.
+    symlink : bool
+        If True, payloads are replaced by (relative) symbolic links. Otherwise hard links are used where possible,
+        which are transparent to any web server (and allow unused blobs to be found; see `pruneBlobs`).
+
+    Returns
+    --------
+    A dictionary containing the number of payloads, the number of new blobs and the bytes saved.
+    """
+    import hashlib
+    import json
+    import shutil
+    def link(blob, pth):
+        if not symlink:
+            try:
+                return os.link(blob, pth)
+            except OSError: # e.g., different filesystems
+                pass
+        os.symlink(os.path.relpath(blob, os.path.dirname(pth)), pth)
+
+    refs = {}
+    stats = dict(files=0, new=0, saved=0)
+    for dirpath, dirnames, filenames in os.walk(zarr_store_path):
+        for f in filenames:
+            if f.startswith('.') or (dirpath == zarr_store_path): # metadata (.zarray etc.) and blobs.json
+                continue
+            pth = os.path.join(dirpath, f)
+            with open(pth, 'rb') as fh:
+                key = hashlib.sha256( fh.read() ).hexdigest()
+            refs[os.path.relpath(pth, zarr_store_path).replace(os.sep, '/')] = key
+            stats['files'] += 1
+            if os.path.islink(pth):
+                continue # already linked
+            blob = os.path.join(blob_path, key[:2], key)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            if os.path.exists(blob):
+                if os.path.samefile(blob, pth) and not symlink:
+                    continue # already a hard link to this blob
+                if not os.path.samefile(blob, pth):
+                    stats['saved'] += os.path.getsize(pth)
+                os.remove(pth)
+                link(blob, pth)
+            else:
+                stats['new'] += 1
+                try: # move payload into the blob store without copying
+                    os.link(pth, blob)
+                    if symlink:
+                        os.remove(pth)
+                        link(blob, pth)
+                except OSError: # e.g., different filesystems
+                    shutil.copy2(pth, blob)
+                    os.remove(pth)
+                    link(blob, pth)
+
+    # record blob hashes (N.B. in a separate file, as viewers load all of the attributes)
+    with open(os.path.join(zarr_store_path, 'blobs.json'), 'w') as fh:
+        json.dump(dict(algorithm='sha256', refs=refs), fh)
+    attrs_path = os.path.join(zarr_store_path, '.zattrs')
+    attrs = {}
+    if os.path.exists(attrs_path):
+        with open(attrs_path, 'r') as fh:
+            attrs = json.load(fh)
+    attrs['blobs'] = dict(store=os.path.relpath(blob_path, zarr_store_path).replace(os.sep, '/'),
+                          algorithm='sha256', index='blobs.json')
+    with open(attrs_path, 'w') as fh:
+        json.dump(attrs, fh, indent=4, sort_keys=True)
+    return stats
+
+def pruneBlobs(blob_path):
+    """
+    Delete blobs (see `storeBlobs`) that are no longer hard linked into any stream. N.B. this cannot detect blobs
+    that are referenced using symbolic links, so should not be used for streams created with `symlink=True`.
+
+    Returns
+    --------
+    The number of bytes freed.
+    """
+    freed = 0
+    for dirpath, dirnames, filenames in os.walk(blob_path):
+        for f in filenames:
+            pth = os.path.join(dirpath, f)
+            st = os.stat(pth)
+            if st.st_nlink == 1:
+                freed += st.st_size
+                os.remove(pth)
+    return freed
+
+def encodeNormals(normals, bits=16):
+    """
+    Encode unit vectors using an octahedral mapping, which projects them onto an octahedron that is then
+    unfolded into a square. This needs only two (8 or 16 bit) integers per vector, instead of three floats.
+
+    Parameters
+    ----------
+    normals : np.ndarray
+        An (N, 3) array of normal vectors. These do not need to be normalised.
+    bits : int
+        The number of bits per component (8 or 16).
+
+    Returns
+    --------
+    An (N, 2) array of uint8 or uint16 codes (see `decodeNormals`).
+    """
+    n = np.asarray(normals, dtype=np.float64)
+    n = n / np.maximum( np.sum(np.abs(n), axis=1), 1e-12 )[:, None]
+    x, y, z = n[:, 0], n[:, 1], n[:, 2]
+    sx = np.where(x >= 0, 1.0, -1.0)
+    sy = np.where(y >= 0, 1.0, -1.0)
+    lower = z < 0 # fold the lower hemisphere over the upper one
+    u = np.where(lower, (1 - np.abs(y)) * sx, x)
+    v = np.where(lower, (1 - np.abs(x)) * sy, y)
+    scale = 2**bits - 1
+    q = np.round( (np.stack([u, v], axis=1) * 0.5 + 0.5) * scale )
+    return np.clip(q, 0, scale).astype(np.uint8 if bits == 8 else np.uint16)
+
+def decodeNormals(codes, bits=16):
+    """
+    Decode octahedrally encoded normals (see `encodeNormals`) to (N, 3) float32 unit vectors.
+    """
+    uv = np.asarray(codes, dtype=np.float64) / (2**bits - 1) * 2 - 1
+    u, v = uv[:, 0], uv[:, 1]
+    z = 1 - np.abs(u) - np.abs(v)
+    lower = z < 0
+    su = np.where(u >= 0, 1.0, -1.0)
+    sv = np.where(v >= 0, 1.0, -1.0)
+    x = np.where(lower, (1 - np.abs(v)) * su, u)
+    y = np.where(lower, (1 - np.abs(u)) * sv, v)
+    n = np.stack([x, y, z], axis=1)
+    return (n / np.linalg.norm(n, axis=1)[:, None]).astype(np.float32)
+
+def normalAttrs(columns, bits=16):
+    """
+    Get the "normals" attribute describing how normals are stored (see `exportZA`).
+    """
+    return dict( encoding='octahedral', bits=int(bits), dtype='uint8' if bits == 8 else 'uint16',
+                 array='c{i}/normals' if columns else 'n{i}',
+                 decode='uv = code / (2**bits - 1) * 2 - 1; z = 1 - |u| - |v|; ' + \
+                        'if z < 0: (u, v) = ((1 - |v|) * sign(u), (1 - |u|) * sign(v)); normal = normalize(u, v, z)' )
+
+def writeNormals(z, index, normals, columns=False, bits=16, block_size=None):
+    """
+    Encode and write the normals of one chunk (see `exportZA`).
+    """
+    from numcodecs import Blosc
+    a = encodeNormals( normals, bits )
+    out = z.create_dataset(
+        name=normalAttrs(columns, bits)['array'].format(i=index),
+        shape=a.shape,
+        chunks=(min(block_size or a.shape[0], a.shape[0]), 2),
+        dtype=a.dtype,
+        compressor=Blosc(cname="zstd", clevel=3, shuffle=Blosc.SHUFFLE)
+    )
+    out[:] = a
+
+def readNormals(zarr_store_path, index, count=None):
+    """
+    Read and decode the normals of one chunk of a stream exported with normals (see `exportZA`).
+
+    Returns
+    --------
+    An array of shape (count, 3) containing a unit normal for each point (see `readChunk`), or None if
+    the stream has no normals.
+    """
+    import zarr
+    z = zarr.open_group(zarr_store_path, mode='r')
+    if 'normals' not in z.attrs:
+        return None
+    info = z.attrs['normals']
+    return decodeNormals( z[info['array'].format(i=index)][:count], info['bits'] )
+
+# colour ramps (matching the chroma.js / ColorBrewer scales used by the viewer) for rendering previews
+RAMPS = {'viridis' : ['#440154', '#482878', '#3e4989', '#31688e', '#26828e', '#1f9e89', '#35b779', '#6ece58', '#b5de2b', '#fde725'],
+         'magma' : ['#000004', '#1c1044', '#4f127b', '#812581', '#b5367a', '#e55964', '#fb8761', '#fec287', '#fcfdbf'],
+         'spectral' : ['#9e0142', '#d53e4f', '#f46d43', '#fdae61', '#fee08b', '#ffffbf', '#e6f598', '#abdda4', '#66c2a5', '#3288bd', '#5e4fa2'],
+         'rdylbu' : ['#a50026', '#d73027', '#f46d43', '#fdae61', '#fee090', '#ffffbf', '#e0f3f8', '#abd9e9', '#74add1', '#4575b4', '#313695'],
+         'greys' : ['#ffffff', '#f0f0f0', '#d9d9d9', '#bdbdbd', '#969696', '#737373', '#525252', '#252525', '#000000'] }
+
+def styleColors(points, style):
+    """
+    Compute the (approximate) colour of each point for a (fitted; see `fitStyles`) style, as drawn by the viewer.
+    Named colour ramps not in `RAMPS` are drawn in grey.
+
+    Returns
+    --------
+    An array of shape (n, 3) containing RGB values between 0 and 1.
+    """
+    color = style.get('color', None)
+    if isinstance(color, dict): # ternary mapping
+        return np.clip( np.array([(points[:, color[c][0]] - color[c][1]) / max(color[c][2] - color[c][1], 1e-12)
+                                  for c in 'RGB']).T, 0, 1 )
+    if (color is not None) and (len(color) == 2) and isinstance(color[1], dict): # colour ramp
+        index, options = color
+        vmin, vmax = options['limits'][:2]
+        scale = options.get('scale', 'viridis')
+        if isinstance(scale, str):
+            scale = RAMPS.get(scale.lower(), ['#808080', '#808080'])
+        stops = np.array([[int(c.lstrip('#')[i:i+2], 16) / 255 for i in (0, 2, 4)] if str(c).startswith('#') else [0.5]*3
+                          for c in scale])
+        t = np.clip( (points[:, index] - vmin) / max(vmax - vmin, 1e-12), 0, 1 ) * (len(stops) - 1)
+        return np.array([np.interp(t, np.arange(len(stops)), stops[:, i]) for i in range(3)]).T
+    return np.full( (len(points), 3), 0.5 )
+
+def renderPreview(xyz, rgb, size=256, view='auto', normals=None, point_size=None):
+    """
+    Render an orthographic preview image of a (subsampled) point cloud by splatting each point onto a few pixels
+    and keeping the point closest to the viewer in each pixel (a z-buffer). This is fully vectorised, so
+    rendering e.g., an overview chunk (see `exportZA`) takes well under a second.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        Shape (n, 3) array of point positions.
+    rgb : np.ndarray
+        Shape (n, 3) array of point colours (between 0 and 1).
+    size : int | tuple
+        The size (in pixels) of the longest side of the image, or a (width, height) tuple.
+    view : str | np.ndarray
+        The direction (from the cloud towards the viewer) to render. Can be 'top' (plan view), 'auto' (look along
+        the direction of least variance, which gives a plan view of terrain and a face-on view of e.g., cliffs) or
+        a vector.
+    normals : np.ndarray
+        Optional (n, 3) array of point normals. These are used to choose which side of the cloud to view
+        from when `view='auto'`.
+    point_size : float
+        The radius (in pixels) of each splat. If None, this is estimated from the point density.
+
+    Returns
+    --------
+    A tuple containing an RGBA image (a uint8 array of shape (height, width, 4), with transparent pixels where
+    there are no points) and a dictionary describing the projection (the viewing direction, the directions of
+    the image's x and y axes and the bounds of the image along these).
+    """
+    xyz = np.asarray(xyz, dtype=np.float64)
+    if isinstance(view, str):
+        assert view in ['top', 'auto'], "Error - view must be 'top', 'auto' or a vector, not %s" % view
+        d = np.array([0., 0., 1.])
+        if view == 'auto':
+            _, vec = np.linalg.eigh( np.cov( (xyz - np.mean(xyz, axis=0)).T ) )
+            d = vec[:, 0] # N.B. eigenvalues are sorted in ascending order
+            sign = np.sum( normals @ d ) if normals is not None else d[2]
+            d = d if sign >= 0 else -d
+    else:
+        d = np.array(view, dtype=np.float64)
+    d /= np.linalg.norm(d)
+
+    # build image axes (keeping "up" up for side views)
+    if abs(d[2]) > 0.9:
+        u = np.cross( [0, 1, 0], d )
+    else:
+        u = np.cross( [0, 0, 1], d )
+    u /= np.linalg.norm(u)
+    v = np.cross( d, u )
+
+    # project points
+    pu, pv, depth = xyz @ u, xyz @ v, xyz @ d
+    lo, hi = np.array([np.min(pu), np.min(pv)]), np.array([np.max(pu), np.max(pv)])
+    extent = np.maximum( hi - lo, 1e-9 )
+    if np.isscalar(size):
+        scale = (int(size) - 1) / np.max(extent)
+        width, height = [int(np.round(e * scale)) + 1 for e in extent]
+    else:
+        width, height = int(size[0]), int(size[1])
+        scale = min( (width - 1) / extent[0], (height - 1) / extent[1] )
+    ix = np.round( (pu - lo[0]) * scale ).astype(np.int64)
+    iy = height - 1 - np.round( (pv - lo[1]) * scale ).astype(np.int64)
+
+    # splat each point onto a square of pixels
+    if point_size is None:
+        point_size = 0.5 * np.sqrt( width * height / max(len(xyz), 1) )
+    r = int( np.clip( np.round(point_size), 0, 4 ) )
+    dx, dy = [a.ravel() for a in np.meshgrid( np.arange(-r, r+1), np.arange(-r, r+1) )]
+    ix = (ix[None, :] + dx[:, None]).ravel()
+    iy = (iy[None, :] + dy[:, None]).ravel()
+    depth = np.tile( depth, len(dx) )
+    point = np.tile( np.arange(len(xyz)), len(dx) )
+    valid = (ix >= 0) & (ix < width) & (iy >= 0) & (iy < height)
+    pixel, depth, point = (iy * width + ix)[valid], depth[valid], point[valid]
+
+    # z-buffer: keep the point closest to the viewer in each pixel
+    o = np.lexsort( (depth, pixel) )
+    pixel, point = pixel[o], point[o]
+    last = np.append( pixel[1:] != pixel[:-1], True )
+    image = np.zeros( (height * width, 4), dtype=np.uint8 )
+    image[pixel[last], :3] = np.round( np.clip(rgb[point[last]], 0, 1) * 255 )
+    image[pixel[last], 3] = 255
+    info = dict( width=width, height=height, view=d.tolist(), x_axis=u.tolist(), y_axis=v.tolist(),
+                 bounds=[lo.tolist(), (lo + np.array([width - 1, height - 1]) / scale).tolist()] )
+    return image.reshape( (height, width, 4) ), info
+
+def writePreview(zarr_store_path, size=256, view='auto', style=None):
+    """
+    Render a preview image of a stream from its overview chunks (see `renderPreview`) and save it as `preview.png`
+    in the stream. The projection is stored in the "preview" attribute (with positions relative to the stream's origin).
+
+    Parameters
+    ----------
+    zarr_store_path : str
+        Path to the Zarr store (e.g., created using `exportZA`).
+    size : int | tuple
+        The size of the image (see `renderPreview`).
+    view : str | np.ndarray
+        The viewing direction (see `renderPreview`).
+    style : str
+        The style used to colour the points. If None, the first style of the stream is used.
+
+    Returns
+    --------
+    The preview image (see `renderPreview`).
+    """
+    import zarr
+    from rockhopper.utils import writePNG
+    z = zarr.open_group(zarr_store_path, mode='r+')
+    attrs = z.attrs.asdict()
+    if style is None:
+        style = attrs['styles'][0]
+    points, normals = [], []
+    for i in range( attrs.get('overviews', 1) ):
+        points.append( readPoints( zarr_store_path, i ) )
+        normals.append( readNormals( zarr_store_path, i ) )
+    points = np.vstack(points)
+    normals = np.vstack(normals) if normals[0] is not None else None
+    image, info = renderPreview( points[:, :3], styleColors( points, attrs['stylesheet'][style] ),
+                                 size=size, view=view, normals=normals )
+    writePNG( os.path.join(zarr_store_path, 'preview.png'), image )
+    z.attrs['preview'] = dict( file='preview.png', style=style, **info )
+    return image
+
 def exportZA(points, zarr_store_path, 
              chunk_size=200000, resolution=0.1,
-             stylesheet=None, styles=None, **kwds):
+             stylesheet=None, styles=None, codec=None, codec_filters=False,
+             progressive=False, block_size=None, overviews=1, columns=None, categorical=None, blob_store=None,
+             normals=None, normal_bits=16, preview=256, preview_view='auto', **kwds):
     """
     Convert a NumPy array of shape (N, 6) -> [x, y, z, r, g, b, ...]
     into a Zarr dataset. Also compute a second Zarr dataset
@@ -187,6 +1304,9 @@ def exportZA(points, zarr_store_path,
             `chroma.scale(...)` function (e.g., `'viridis'`, `'spectral'`, `'RdYlBu'`).  
         - `limits`: The `(min, max, nsteps)` defining the colour domain and the number
             of intervals used in the ramp. These values are passed to `chroma.limits(...)`.
+            If `limits` is omitted (or set to 'auto'), the 2nd and 98th percentiles of the band
+            (computed during export) are used instead. The same applies to ternary mappings
+            defined with only a band index, e.g. `'R': (3,)`.
 
         Default
         -------
@@ -197,7 +1317,7 @@ def exportZA(points, zarr_store_path,
                             'G': (4, 0, 1),
                             'B': (5, 0, 1)}},
             'elev': {'color': (2, {'scale': 'viridis',
-                                'limits': (-100, 100, 255)})}
+                                'limits': 'auto'})}
         }
         ```
 
@@ -224,6 +1344,58 @@ def exportZA(points, zarr_store_path,
         - **'rainbow'** colours points using a continuous ramp based on their second attribute
         (in this case, the y-coordinate), with values from -2 to 2 mapped through a
         "spectral" colour scale.
+    codec : str | numcodecs.abc.Codec
+        The compressor used for the point chunks. If None (default), Blosc with zstd (level 3) and
+        byte shuffling is used. Alternatively, 'size' or 'speed' can be passed to test a range of
+        candidate compressors on a sample of chunks (see `tuneCodec`) and pick the one giving the
+        smallest chunks or fastest decoding, respectively. The selected codec and measured compression
+        ratios are stored in the "compression" attribute.
+    codec_filters : bool
+        True if zarr filters (delta encoding and quantisation to the specified resolution) should also be
+        tried when auto-tuning the codec. Quantisation is only tried for the `xyz` column of column layouts,
+        as rows layouts store positions and attributes in the same array. Default is False, as the bundled
+        viewer cannot decode filters.
+    progressive : bool
+        True if points within each chunk should be re-ordered (see `progressiveOrder`) such that any
+        prefix of the chunk is a spatially uniform subsample of it. Default is False.
+    block_size : int
+        If not None, each chunk is stored as a series of blocks of this many points, such that
+        clients can fetch the first few blocks of a chunk and refine it later (see `readChunk`).
+    overviews : int
+        The number of overview chunks to create. These are spatially stratified subsamples of the whole cloud
+        (see `progressiveOrder`) stored as the first chunks of the stream, such that each additional overview
+        level increases the density of the initial view. Default is 1 (chunk 0 only).
+    columns : dict | bool
+        If not None, each chunk is stored as a zarr group containing one array per column group, such that
+        clients only need to fetch the bands required by the active style. Column groups are defined as a
+        dictionary of `{name : [band indices]}`, which must include `'xyz' : [0,1,2]` and contain each
+        band once. If True, bands are grouped as `xyz`, `rgb` and then one array per additional band (`b6`, `b7`, ...).
+        The arrays needed by each style and group are stored in the "style_columns" and "group_columns" attributes.
+        Default is None (one (n, d) array per chunk), as this is what the bundled viewer expects.
+    categorical : list | str
+        A list of band indices containing categorical values (e.g., class labels), or 'auto' to treat any
+        integer-valued band with 256 or fewer unique values as categorical. These bands are dictionary encoded
+        and stored as uint8 (or uint16) codes, and so must be stored in their own column (see `columns`). The
+        dictionary and the codes present in each chunk are stored in the "categorical" attribute, such that
+        groups can skip chunks that contain no matching class (see "group_chunks"). Missing (NaN) values are kept
+        as a separate (last) category, stored as null in the dictionary.
+    blob_store : str
+        If not None, chunk payloads are moved into this content-addressed blob store (which can be shared by many
+        streams) and linked back into the stream, such that identical chunks are only stored once (see `storeBlobs`).
+    normals : numpy.ndarray
+        An optional (N, 3) array of surface normals for each point. These are averaged when culling duplicate points,
+        octahedrally encoded (see `encodeNormals`) and stored as a separate (n, 2) integer array for each chunk
+        (`n0`, `n1`, ... or `c0/normals`, `c1/normals`, ... for column layouts). The array names and decoding
+        parameters are stored in the "normals" attribute.
+    normal_bits : int
+        The number of bits used to store each of the two encoded normal components (8 or 16). The mean angular
+        error is roughly 0.3 degrees for 8 bits and 0.005 degrees for 16 bits.
+    preview : int | tuple
+        The size (in pixels) of the longest side of a preview image rendered from the overview chunks (or a
+        (width, height) tuple), which is saved as `preview.png` in the stream (see `writePreview`). This can be
+        shown by e.g., site pickers before any chunks have loaded. Set as None to skip the preview. Default is 256.
+    preview_view : str | np.ndarray
+        The direction to render the preview from (see `renderPreview`). Default is 'auto'.
 
     Keywords:
     ---------
@@ -282,21 +1454,26 @@ def exportZA(points, zarr_store_path,
             ...     }
             ... }
     """
-    # remove duplicate points
-    tree = KDTree(points[:,:3])
-    keep = np.full( points.shape[0], True)
-    for i,p in enumerate( tqdm( points, desc='Culling points', leave=False ) ):
-        if not keep[i]: continue # skip points that are already "deleted"
-        o = tree.query_ball_point(p[:3], resolution)
-        points[i] = np.mean( points[ o ], axis=0 ) # replace with average values
-        keep[o] = False # flag points to be deleted
-        keep[i] = True # except this one!
-    points = points[keep]
+    import zarr
+    from numcodecs import Blosc, Delta, Quantize
+    #from zarr.codecs import BloscCodec
+    from sklearn.cluster import MiniBatchKMeans
+    from tqdm import tqdm
 
-    # round position information to specific precision
-    # (this helps achieve smaller size after compression)
+    # define column groups (if using a column layout) and find categorical bands
+    columns = resolveColumns( columns, points.shape[1] )
+    catbands = findCategorical( points, columns, categorical )
+
+    # remove duplicate points and round positions
+    # (N.B. normals are averaged alongside the other bands)
+    assert normal_bits in [8, 16], "Error - normal_bits must be 8 or 16"
+    if normals is not None:
+        assert len(normals) == len(points), "Error - there must be one normal per point"
+        points = np.hstack([points, normals])
+    points = cullPoints( points, resolution, keep=list(catbands) )
+    if normals is not None:
+        points, normals = points[:, :-3], points[:, -3:]
     decimals = int( 1-np.log10( resolution ) )
-    np.round( points, int( decimals ) )
 
     # Make sure chunk_size is not bigger than total points
     num_points = len( points )
@@ -307,26 +1484,32 @@ def exportZA(points, zarr_store_path,
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", category=RuntimeWarning)
         sc = MiniBatchKMeans( n_clusters=int( len(points) / chunk_size ), tol=0.1,
-                            n_init='auto' )
-        cid = sc.fit_predict( points[:, :3] )+1
+                            n_init='auto', random_state=42 ) # N.B. deterministic, so re-exports give identical chunks
+        cid = sc.fit_predict( points[:, :3] )+overviews
 
-        # randomly select the first chunk (this should be evenly distributed)
-        # (and inject into cids)
-        cid[ np.random.choice(len(points), int(chunk_size), replace=False) ] = 0 
-        ixx = np.unique(cid) # get unique classes
+    # select the overview chunks as a stratified subsample of the whole cloud
+    # (and inject into cids)
+    assert overviews >= 1, "Error - at least one overview chunk is needed"
+    n_overview = min( int(chunk_size) * overviews, len(points) )
+    order = progressiveOrder( points, resolution, count=n_overview )[:n_overview]
+    cid[ order ] = np.arange(n_overview) // int(chunk_size)
+    ixx = np.unique(cid) # get unique classes
 
     # define colors json object defining visualisation options
     if stylesheet is None:
         if points.shape[1] >= 6:
             stylesheet = {'rgb':{'color':{'R':[3,0,1],'G':[4,0,1],'B':[5,0,1]}}}
         else:
-            stylesheet = {'elev':(2, {'scale':'viridis', 'limits':(-100,100,255)})}
+            stylesheet = {'elev':{'color':(2, {'scale':'viridis', 'limits':'auto'})}}
     
     if styles is None:
         styles = list( stylesheet.keys() )
     for k in styles:
         assert k in stylesheet, "Style %s is not in the stylesheet?"%k
-    
+
+    # build dictionaries for categorical bands
+    dictionaries = {k : buildDictionary( points[:, b] ) for b, k in catbands.items()}
+
     # create a zarr object and set relevant metadata
     origin = np.mean( points[:,:3], axis=0 ).astype(int)
     z = zarr.open_group(zarr_store_path, mode='w')  # top-level group
@@ -336,29 +1519,91 @@ def exportZA(points, zarr_store_path,
                     "chunks" : len(ixx),
                     "styles" : styles,
                     "stylesheet" : stylesheet,
+                    "progressive" : progressive,
+                    "overviews" : overviews,
+                    "layout" : "rows" if columns is None else "columns",
                     **kwds })
+    if columns is not None:
+        # store which arrays are needed to draw each style or group
+        def lookup(bands):
+            return ['xyz'] + [k for k, v in columns.items() if (k != 'xyz') and (len(set(v) & set(bands)) > 0)]
+        z.attrs['columns'] = columns
+        z.attrs['style_columns'] = {k : lookup(styleBands(stylesheet[k])) for k in styles}
+        if 'groups' in kwds:
+            z.attrs['group_columns'] = {k : lookup(styleBands(v)) for k, v in kwds['groups'].items()}
+    if block_size is not None:
+        z.attrs['block_size'] = int(block_size)
+    if normals is not None:
+        z.attrs['normals'] = normalAttrs( columns is not None, normal_bits )
 
-    # build chunks and add to the zarr object
-    centers = []
-    compressor = Blosc(cname="zstd", clevel=3, shuffle=Blosc.SHUFFLE)
-    #compressor = BloscCodec(cname="zstd", clevel=9, shuffle="shuffle")
-    for i,ix in tqdm( enumerate(ixx), desc="Extracting chunks", leave=False):
+    # split chunks into one or more arrays
+    def getChunk(ix):
         c = points[ cid == ix, : ]
+        n = normals[ cid == ix, : ] if normals is not None else None
         c[:,:3] -= origin
         c = c.astype(np.float32)
-        main_array = z.create_dataset(
-            name="c%d"%i,
-            shape=c.shape,
-            chunks=(c.shape[0], c.shape[1]),
-            dtype=c.dtype,
-            compressor=compressor
-        )
-        main_array[:] = c
+        if progressive:
+            o = progressiveOrder( c, resolution )
+            c = c[ o ]
+            n = n[ o ] if n is not None else None
+        return c, n
+    def split(c):
+        return splitChunk( c, columns, dictionaries )
+
+    # choose compressor (for each array)
+    default = Blosc(cname="zstd", clevel=3, shuffle=Blosc.SHUFFLE)
+    #compressor = BloscCodec(cname="zstd", clevel=9, shuffle="shuffle")
+    keys = [None] if columns is None else list(columns.keys())
+    codecs = {k : (default, None) for k in keys}
+    for k in dictionaries: # bitshuffle is much better for small integer codes
+        codecs[k] = (Blosc(cname="zstd", clevel=3, shuffle=Blosc.BITSHUFFLE), None)
+    if isinstance(codec, str):
+        # test candidates on a few evenly spaced chunks
+        samples = [ split( getChunk(ix)[0] ) for ix in ixx[ np.linspace(0, len(ixx)-1, min(4, len(ixx))).astype(int) ] ]
+        report = {}
+        for k in keys:
+            chains = []
+            if codec_filters:
+                chains = [[Delta(dtype=samples[0][k].dtype.str)]]
+                if k == 'xyz': # N.B. only positions are quantised (rows layouts also store attributes in the same array)
+                    chains.append( [Quantize(digits=decimals, dtype='<f4')] )
+            compressor, filters, report[k or 'chunks'] = tuneCodec( [s[k] for s in samples], goal=codec, filters=chains )
+            codecs[k] = (compressor, filters or None)
+        z.attrs['compression'] = report
+    elif codec is not None:
+        codecs = {k : (codec, None) for k in keys} # use the specified compressor
+
+    # build chunks and add to the zarr object
+    centers = []
+    stats = BandStats( points.shape[1] )
+    presence = {k : [] for k in dictionaries}
+    for i,ix in tqdm( enumerate(ixx), desc="Extracting chunks", leave=False):
+        c, n = getChunk(ix)
+        arrays = split(c)
+        for k in dictionaries: # record which categories occur in this chunk
+            presence[k].append( np.unique(arrays[k]).tolist() )
+        writeChunk( z, i, arrays, codecs, block_size )
+        if n is not None:
+            writeNormals( z, i, n, columns is not None, normal_bits, block_size )
 
         # also aggregate chunk centers
         centers.append( np.mean(c, axis=0 ) )
+        stats.update( c ) # and band statistics
     centers=np.array(centers, dtype=np.float32)
 
+    # store band statistics and use them to fill in any missing style limits
+    z.attrs['stats'] = stats.toDict()
+    z.attrs['stylesheet'] = fitStyles( stylesheet, stats )
+
+    # store dictionaries and category presence
+    if len(dictionaries) > 0:
+        z.attrs['categorical'] = {k : dict( band=columns[k][0],
+                                            dtype=np.dtype(np.uint8 if len(v) <= 256 else np.uint16).name,
+                                            dictionary=dictionaryToJSON(v),
+                                            presence=presence[k] ) for k, v in dictionaries.items() }
+        if 'groups' in kwds:
+            z.attrs['group_chunks'] = groupChunks( kwds['groups'], z.attrs['categorical'] )
+
     # Save chunk-centers
     _ = z.create_dataset(
         name="chunk_centers",
@@ -366,6 +1611,13 @@ def exportZA(points, zarr_store_path,
         shape=centers.shape,
         chunks=(centers.shape[0], centers.shape[1]),
         dtype=centers.dtype,
-        compressor=compressor
+        compressor=default
     )
-    
\ No newline at end of file
+
+    # render a preview image from the overview chunks
+    if preview is not None:
+        writePreview( zarr_store_path, size=preview, view=preview_view )
+
+    # move chunk payloads to a shared blob store
+    if blob_store is not None:
+        storeBlobs( zarr_store_path, blob_store )
@@ -0,0 +1,172 @@
+"""
+Store repeat surveys (epochs) of the same scene as one stream, with later epochs stored as per-chunk changes
+relative to the first.
+
+The first (base) epoch is exported as a normal stream (see `exportZA`). Points in each later epoch are then matched
+to the nearest base point (within the stream's resolution) and each chunk of the base stream gets, per epoch, the
+indices of base points that were removed, the indices and new values of base points whose attributes changed, and
+any added points (assigned to the chunk of their nearest base point). Only chunks that changed are stored, so
+unchanged parts of a scene are stored (and downloaded) once, and viewers switching between epochs only need to fetch
+the changed chunks (see the "epochs" attribute). For example:
+
+```
+exportEpochs( [scan_2024_01, scan_2024_02, scan_2024_03], 'cliff.zarr',
+              names=['2024-01', '2024-02', '2024-03'], resolution=0.05 )
+points = readEpoch( 'cliff.zarr', '2024-03', 12 ) # chunk 12 as it was in March
+```
+"""
+import numpy as np
+from rockhopper.clouds import exportZA, readPoints, cullPoints, storeBlobs
+
+def exportEpochs(epochs, zarr_store_path, names=None, distance=None, tolerance=1e-5, blob_store=None, **kwds):
+    """
+    Export several epochs of the same scene as a single stream (see the module docstring).
+
+    Parameters
+    ----------
+    epochs : list
+        A list of (N, d) arrays containing the points of each epoch (see `exportZA`). All epochs must have the
+        same bands. The first epoch is used as the base.
+    zarr_store_path : str
+        Path to the Zarr store to create.
+    names : list
+        A name for each epoch (e.g., the survey date). Defaults to `e0`, `e1`, ...
+    distance : float
+        The distance within which points in a later epoch are considered to be the same as a base point. Defaults to
+        the stream's resolution. N.B. position changes smaller than this are ignored.
+    tolerance : float | np.ndarray
+        The largest difference in attributes (bands 3 and up; either a single value or one per band) for which
+        matched points are considered unchanged. Values are compared after conversion to float32 (as stored), and
+        the default (1e-5) only ignores rounding errors.
+    blob_store : str
+        If not None, chunk payloads (including the deltas) are moved into this shared blob store (see `storeBlobs`).
+
+    Keywords
+    ---------
+    All other keywords are passed to `exportZA` when exporting the base epoch. N.B. normals (if given) are only
+    stored for the base epoch.
+
+    Returns
+    --------
+    The "epochs" attribute of the created stream.
+    """
+    import zarr
+    from numcodecs import Blosc
+    from scipy.spatial import KDTree
+    from tqdm import tqdm
+    if names is None:
+        names = ['e%d' % i for i in range(len(epochs))]
+    names = [str(n) for n in names]
+    assert len(names) == len(epochs), "Error - there must be one name per epoch"
+    assert len(set(names)) == len(names), "Error - epoch names must be unique"
+    for e in epochs[1:]:
+        assert e.shape[1] == epochs[0].shape[1], "Error - all epochs must have the same number of bands"
+
+    # export the base epoch and read it back (so that indices match the stored chunks)
+    exportZA( epochs[0], zarr_store_path, **kwds )
+    z = zarr.open_group(zarr_store_path, mode='r+')
+    attrs = z.attrs.asdict()
+    origin = np.array( attrs['origin'] )
+    resolution = attrs['resolution']
+    distance = resolution if distance is None else distance
+    keep = [v['band'] for v in attrs.get('categorical', {}).values()]
+    chunks = [readPoints( zarr_store_path, i ).astype(np.float64) for i in range(attrs['chunks'])]
+    base = np.vstack( chunks )
+    cid = np.repeat( np.arange(len(chunks)), [len(c) for c in chunks] ) # chunk of each base point
+    offset = np.cumsum( [0] + [len(c) for c in chunks] ) # index of first base point in each chunk
+    tree = KDTree( base[:, :3] )
+
+    # added points are assigned to the chunk of the nearest base point that is not in an overview chunk
+    # (N.B. these are a sparse subsample of the whole cloud, so should stay small)
+    spatial = np.nonzero( cid >= attrs['overviews'] )[0]
+    if len(spatial) == 0:
+        spatial = np.arange(len(base))
+    spatial_tree = KDTree( base[spatial, :3] )
+
+    compressor = Blosc(cname="zstd", clevel=3, shuffle=Blosc.SHUFFLE)
+    out = dict( base=names[0], names=names, array='{epoch}/c{i}/{kind}', deltas={} )
+    for k in range(1, len(epochs)):
+        # cull as for the base epoch and match points to the base
+        points = cullPoints( np.array(epochs[k], dtype=np.float64), resolution, keep=keep )
+        points[:, :3] -= origin
+        d, nearest = tree.query( points[:, :3], distance_upper_bound=distance )
+        matched = np.isfinite(d)
+
+        # if several points match the same base point, keep the closest (and treat the others as added)
+        o = np.lexsort( (d, nearest) )
+        first = np.append( True, nearest[o][1:] != nearest[o][:-1] )
+        duplicate = np.full( len(points), False )
+        duplicate[o[~first]] = True
+        matched &= ~duplicate
+        removed = np.full( len(base), True )
+        removed[nearest[matched]] = False
+
+        # find matched points with changed attributes
+        m = np.nonzero(matched)[0]
+        diff = np.abs( points[m, 3:].astype(np.float32).astype(np.float64) - base[nearest[m], 3:] ) # N.B. as stored
+        changed = m[ np.any( diff > np.broadcast_to(tolerance, diff.shape[1:]), axis=1 ) ]
+        added = np.nonzero(~matched)[0]
+        added_cid = cid[ spatial[ spatial_tree.query( points[added, :3] )[1] ] ] if len(added) > 0 else np.array([], dtype=int)
+
+        # write the deltas of each changed chunk
+        group = 'e%d' % k
+        delta = dict( group=group, chunks=[], added=int(len(added)), removed=int(np.sum(removed)), changed=int(len(changed)) )
+        removed_cid = cid[removed]
+        changed_cid = cid[nearest[changed]]
+        for i in tqdm( np.unique( np.concatenate([added_cid, removed_cid, changed_cid]) ).astype(int),
+                       desc="Writing deltas for %s" % names[k], leave=False ):
+            arrays = dict( added=points[ added[added_cid == i] ].astype(np.float32),
+                           removed=(np.nonzero(removed[offset[i]:offset[i+1]])[0]).astype(np.uint32),
+                           changed=(nearest[ changed[changed_cid == i] ] - offset[i]).astype(np.uint32) )
+            arrays['values'] = points[ changed[changed_cid == i], 3: ].astype(np.float32)
+            for kind, a in arrays.items():
+                if len(a) > 0:
+                    z.create_dataset( name=out['array'].format(epoch=group, i=i, kind=kind), data=a, shape=a.shape,
+                                      chunks=a.shape, dtype=a.dtype, compressor=compressor )
+            delta['chunks'].append( int(i) )
+        out['deltas'][names[k]] = delta
+    z.attrs['epochs'] = out
+
+    # move chunk payloads to a shared blob store
+    if blob_store is not None:
+        storeBlobs( zarr_store_path, blob_store )
+    return out
+
+def readEpoch(zarr_store_path, epoch, index):
+    """
+    Read the points in one chunk of a multi-epoch stream (see `exportEpochs`) as they were in the specified epoch.
+
+    Parameters
+    ----------
+    zarr_store_path : str
+        Path to the Zarr store.
+    epoch : str
+        The name of the epoch.
+    index : int
+        The index of the chunk to read.
+
+    Returns
+    --------
+    A numpy array of shape (n, d) containing the points (relative to the stream's origin), with bands in their
+    original order (see `readPoints`).
+    """
+    import zarr
+    z = zarr.open_group(zarr_store_path, mode='r')
+    info = z.attrs['epochs']
+    assert epoch in info['names'], "Error - %s is not an epoch of %s" % (epoch, zarr_store_path)
+    points = readPoints( zarr_store_path, index )
+    if (epoch == info['base']) or (index not in info['deltas'][epoch]['chunks']):
+        return points
+    def get(kind):
+        pth = info['array'].format(epoch=info['deltas'][epoch]['group'], i=index, kind=kind)
+        return z[pth][:] if pth in z else None
+    changed = get('changed')
+    if changed is not None:
+        points[changed, 3:] = get('values')
+    removed = get('removed')
+    if removed is not None:
+        points = np.delete( points, removed, axis=0 )
+    added = get('added')
+    if added is not None:
+        points = np.vstack( [points, added] )
+    return points
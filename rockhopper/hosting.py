@@ -0,0 +1,172 @@
+"""
+Host many virtual field trips from a single server process.
+"""
+import os
+import threading
+import time
+from flask import Flask, jsonify, Response
+from flask_cors import CORS
+from werkzeug.utils import redirect
+from rockhopper.server import VFT, FileCache, WriteQueue, ServerThread, read_json
+from rockhopper.metrics import Metrics
+
+class TourHost(object):
+    """
+    A server that mounts many VFT directories under different URL prefixes (e.g., `/geo101/` and `/geo102/`)
+    in a single process and on a single port. All tours share the same file cache (see `FileCache`), markdown
+    cache and background writer (see `WriteQueue`). Tours can be defined in a json configuration file, which
+    is reloaded (and tours mounted or unmounted accordingly) whenever it changes.
+    """
+    def __init__(self, tours={}, config=None, devMode=False, reload_interval=1.0, write_delay=0.5, metrics=None):
+        """
+        Parameters
+        -------------
+        tours : dict
+            A dictionary of `{prefix : vft_path}` or `{prefix : {"vft_path" : ..., "cloud_path" : ...}}` defining
+            the tours to host.
+        config : str
+            A path to a json file containing a dictionary (with the same format as `tours`) of further tours
+            to host. This is checked for changes every `reload_interval` seconds.
+        devMode : bool
+            True if the hosted tours can be edited. Default is False, as this is mostly useful for deployment.
+        reload_interval : float
+            The minimum time (in seconds) between checks for changes to the config file.
+        write_delay : float
+            See `VFT`.
+        metrics : bool | Metrics
+            True (or a `rockhopper.metrics.Metrics` instance) if request metrics should be recorded for all tours
+            and exposed at `/metrics`. Default is None (off).
+        """
+        self.devMode = devMode
+        self.cache = FileCache()
+        self.writer = WriteQueue( delay=write_delay )
+        self.metrics = Metrics() if metrics is True else (metrics or None)
+        self.vfts = {} # prefix : VFT
+        self.specs = {} # prefix : (vft_path, cloud_path)
+        self.static = {} # tours passed directly (rather than through the config)
+        self.config = config
+        self.config_stamp = None
+        self.reload_interval = reload_interval
+        self.last_check = 0
+        self.lock = threading.Lock()
+        self.server_thread = None
+        self.host = None
+        self.port = None
+        for prefix, spec in tours.items():
+            self.static[prefix.strip('/')] = spec
+            self.mount( prefix, spec )
+        self.reload( force=True )
+
+        # root app lists the hosted tours
+        self.app = Flask(__name__)
+        CORS(self.app)
+
+        @self.app.route("/")
+        def serve_root():
+            """
+            List hosted tours
+            """
+            return jsonify({p : f"/{p}/" for p in sorted(self.vfts.keys())})
+
+        @self.app.route("/metrics")
+        def serve_metrics():
+            """
+            Request metrics for all tours (see `rockhopper.metrics.Metrics`)
+            """
+            if self.metrics is None:
+                return jsonify(isError=True, message="Metrics are disabled.", statusCode=404, data={}), 404
+            return Response(self.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    def mount(self, prefix, spec):
+        """
+        Mount a VFT under the specified URL prefix.
+
+        Parameters
+        -------------
+        prefix : str
+            The URL prefix (e.g., 'geo101').
+        spec : str | dict
+            The path to the VFT directory, or a dictionary containing "vft_path" and (optionally) "cloud_path".
+        """
+        if isinstance(spec, dict):
+            vft_path, cloud_path = spec['vft_path'], spec.get('cloud_path', None)
+        else:
+            vft_path, cloud_path = spec, None
+        prefix = prefix.strip('/')
+        assert len(prefix) > 0, "A non-empty prefix is needed for each tour."
+        with self.lock:
+            if self.specs.get(prefix, None) == (vft_path, cloud_path):
+                return # already mounted
+            self.vfts[prefix] = VFT( vft_path, cloud_path=cloud_path, devMode=self.devMode,
+                                     writer=self.writer, cache=self.cache, metrics=self.metrics )
+            self.specs[prefix] = (vft_path, cloud_path)
+
+    def unmount(self, prefix):
+        """
+        Stop serving the tour with the specified prefix.
+        """
+        with self.lock:
+            self.vfts.pop(prefix.strip('/'), None)
+            self.specs.pop(prefix.strip('/'), None)
+
+    def reload(self, force=False):
+        """
+        Re-read the config file (if it has changed) and mount or unmount tours accordingly.
+        """
+        if self.config is None:
+            return
+        now = time.monotonic()
+        if (not force) and (now - self.last_check < self.reload_interval):
+            return
+        self.last_check = now
+        stamp = os.stat(self.config).st_mtime_ns if os.path.exists(self.config) else None
+        if stamp == self.config_stamp:
+            return
+        self.config_stamp = stamp
+        tours = (read_json(self.config) or {}) if stamp is not None else {}
+        tours = {p.strip('/') : v for p, v in tours.items()}
+        for prefix in list(self.vfts.keys()):
+            if (prefix not in tours) and (prefix not in self.static):
+                self.unmount(prefix)
+        for prefix, spec in tours.items():
+            self.mount(prefix, spec)
+
+    def __call__(self, environ, start_response):
+        """
+        Dispatch requests to the relevant tour (based on the first part of the URL path).
+        """
+        self.reload()
+        path = environ.get('PATH_INFO', '')
+        prefix = path.lstrip('/').split('/')[0]
+        vft = self.vfts.get(prefix, None)
+        if vft is None:
+            return self.app(environ, start_response)
+        if path.strip('/') == prefix and not path.endswith('/'): # N.B. the viewer loads its files by relative path
+            location = environ.get('SCRIPT_NAME', '') + '/' + prefix + '/'
+            if environ.get('QUERY_STRING', ''):
+                location += '?' + environ['QUERY_STRING']
+            return redirect(location, code=308)(environ, start_response)
+        environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + '/' + prefix
+        environ['PATH_INFO'] = path.lstrip('/')[len(prefix):] or '/'
+        return vft.app(environ, start_response)
+
+    def start(self, port=4002, host='127.0.0.1'):
+        """
+        Start serving all tours (in a background thread).
+        """
+        if self.server_thread and self.server_thread.is_alive():
+            print("Server already started")
+            return
+        self.host = host
+        self.port = port
+        self.server_thread = ServerThread( self, self.host, self.port, threaded=True )
+        self.server_thread.start()
+        print(f"Hosting {len(self.vfts)} tours at http://{self.host}:{self.port}")
+
+    def stop(self):
+        """
+        Stop the server and write any pending changes.
+        """
+        if self.server_thread:
+            self.server_thread.shutdown()
+        self.writer.flush()
@@ -0,0 +1,102 @@
+"""
+Watch a VFT for changes and notify connected clients (used for live reloading by the development server).
+"""
+import os
+import queue
+import threading
+import time
+
+class ChangeWatcher(object):
+    """
+    Poll a VFT directory (and the metadata of its point cloud streams) for changes, and push the
+    path of each changed file to all subscribers. Polling only runs while there are subscribers.
+    """
+    def __init__(self, vft_path, cloud_path=None, interval=0.5, skip=('static', 'icon')):
+        """
+        Parameters
+        ----------
+        vft_path : str
+            The VFT directory to watch.
+        cloud_path : str
+            The directory containing point cloud streams. Only the attributes (`.zattrs`) of each
+            stream are watched, as these are rewritten whenever a stream is (re)exported.
+        interval : float
+            The time (in seconds) between checks for changes.
+        skip : tuple
+            Subdirectories of vft_path to ignore (by default, the viewer's own files).
+        """
+        self.vft_path = os.path.abspath(vft_path)
+        self.cloud_path = os.path.abspath(cloud_path) if cloud_path else None
+        self.interval = interval
+        self.skip = skip
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stamps = self.scan()
+
+    def scan(self):
+        """
+        Get the (size, modification time) of every watched file.
+        """
+        out = {}
+        for dirpath, dirnames, filenames in os.walk(self.vft_path):
+            if dirpath == self.vft_path:
+                dirnames[:] = [d for d in dirnames if d not in self.skip]
+            dirnames[:] = [d for d in dirnames if not d.endswith('.zarr')] # clouds stored in the VFT
+            for f in filenames:
+                if f.startswith('.') and f.endswith('.tmp'):
+                    continue # partially written files (see `write_atomic`)
+                self.stamp(os.path.join(dirpath, f), out)
+        for root in [self.cloud_path, self.vft_path]:
+            if root and os.path.exists(root):
+                for d in os.listdir(root):
+                    if d.endswith('.zarr'):
+                        self.stamp(os.path.join(root, d, '.zattrs'), out)
+        return out
+
+    def stamp(self, path, out):
+        try:
+            st = os.stat(path)
+            out[path] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            pass # e.g., deleted while scanning
+
+    def subscribe(self):
+        """
+        Get a queue that will receive the path of each changed file.
+        """
+        q = queue.Queue()
+        with self.lock:
+            self.subscribers.append(q)
+            if (self.thread is None) or (not self.thread.is_alive()):
+                self.stamps = self.scan()
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            if q in self.subscribers:
+                self.subscribers.remove(q)
+
+    def notify(self, path):
+        """
+        Send a change notification for the specified file to all subscribers.
+        """
+        with self.lock:
+            for q in self.subscribers:
+                q.put(os.path.abspath(path))
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if len(self.subscribers) == 0:
+                    self.thread = None
+                    return # nobody is listening
+            stamps = self.scan()
+            changed = [p for p, s in stamps.items() if self.stamps.get(p, None) != s]
+            changed += [p for p in self.stamps if p not in stamps] # deleted
+            self.stamps = stamps
+            for p in sorted(changed):
+                self.notify(p)
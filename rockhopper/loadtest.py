@@ -0,0 +1,282 @@
+"""
+Simulate many viewers streaming a virtual field trip at once, to measure how a server copes (e.g., before a class arrives).
+
+Each simulated viewer replays the requests made by the bundled viewer when visiting a site: `index.json`, the
+annotations and markdown tabs (or tab bundle), and then, for point cloud sites, the zarr metadata, `chunk_centers`
+and each chunk in the order `PointStream.js` streams them (chunk 0 first, then the chunk closest to the
+centre of the view). For example:
+
+```
+from rockhopper.loadtest import runLoadTest
+stats = runLoadTest( vft, clients=20, duration=60 )
+print( stats.report() )
+```
+"""
+import json
+import time
+import threading
+import http.client
+import gzip
+from urllib.parse import urljoin, urlsplit
+import numpy as np
+from rockhopper.metrics import routeName
+from rockhopper.clouds import defaultView
+
+class LoadStats(object):
+    """
+    Thread-safe record of request latencies and sizes, grouped by route (see `rockhopper.metrics.routeName`).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {} # route : ([latencies], [bytes], errors)
+        self.start = time.monotonic()
+        self.end = None
+
+    def record(self, route, seconds, nbytes, ok=True):
+        with self.lock:
+            latency, size, errors = self.routes.setdefault(route, ([], [], [0]))
+            latency.append(seconds)
+            size.append(nbytes)
+            if not ok:
+                errors[0] += 1
+
+    def summary(self):
+        """
+        Get the request count, error count, bytes transferred, throughput (requests per second) and
+        50th, 95th and 99th percentile latencies (in milliseconds) for each route.
+        """
+        elapsed = max((self.end or time.monotonic()) - self.start, 1e-9)
+        out = {}
+        with self.lock:
+            for route, (latency, size, errors) in sorted(self.routes.items()):
+                p50, p95, p99 = np.percentile(np.array(latency) * 1000, [50, 95, 99])
+                out[route] = dict( requests=len(latency), errors=errors[0], bytes=int(np.sum(size)),
+                                   rps=len(latency) / elapsed, p50=float(p50), p95=float(p95), p99=float(p99) )
+        return out
+
+    def report(self):
+        """
+        Format the summary (see `LoadStats.summary`) as a table.
+        """
+        summary = self.summary()
+        elapsed = (self.end or time.monotonic()) - self.start
+        lines = ["%-16s %8s %6s %10s %8s %9s %9s %9s" % ('route', 'requests', 'errors', 'MB', 'req/s',
+                                                          'p50 (ms)', 'p95 (ms)', 'p99 (ms)')]
+        for route, s in summary.items():
+            lines.append( "%-16s %8d %6d %10.2f %8.1f %9.1f %9.1f %9.1f" % (route, s['requests'], s['errors'],
+                            s['bytes'] / 1e6, s['rps'], s['p50'], s['p95'], s['p99']) )
+        total = sum([s['bytes'] for s in summary.values()])
+        lines.append( "%d requests (%.2f MB) in %.1f seconds (%.1f MB/s)" % (
+                        sum([s['requests'] for s in summary.values()]), total / 1e6, elapsed, total / 1e6 / max(elapsed, 1e-9)) )
+        return "\n".join(lines)
+
+class Viewer(object):
+    """
+    A simulated viewer that requests the files needed to visit sites in a tour.
+    """
+    def __init__(self, base_url, stats, seed=None, max_chunks=None, timeout=30):
+        """
+        Parameters
+        ----------
+        base_url : str
+            The URL of the tour (e.g., `http://127.0.0.1:4002/`).
+        stats : LoadStats
+            Where to record request latencies.
+        seed : int
+            Seed for random choices (sites and views).
+        max_chunks : int
+            The maximum number of chunks to stream at each site, or None to stream all of them.
+        timeout : float
+            The timeout for each request (in seconds).
+        """
+        self.base_url = base_url.rstrip('/') + '/'
+        self.stats = stats
+        self.rng = np.random.default_rng(seed)
+        self.max_chunks = max_chunks
+        self.timeout = timeout
+        self.connections = {} # N.B. re-use connections (keep-alive) like browsers do
+
+    def get(self, url):
+        """
+        Request a URL and record its latency. Returns the response body, or None if the request failed.
+        """
+        url = urljoin(self.base_url, url)
+        parts = urlsplit(url)
+        t0 = time.perf_counter()
+        body, ok = None, False
+        for attempt in range(2): # retry once if a kept-alive connection was closed
+            conn = self.connections.get(parts.netloc, None)
+            if conn is None:
+                cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+                conn = self.connections[parts.netloc] = cls(parts.netloc, timeout=self.timeout)
+            try:
+                conn.request('GET', parts.path + ('?' + parts.query if parts.query else ''),
+                             headers={'Accept-Encoding' : 'gzip'})
+                r = conn.getresponse()
+                body = r.read()
+                ok = r.status < 400
+                if r.getheader('Content-Encoding', '') == 'gzip':
+                    body = gzip.decompress(body)
+                if r.will_close:
+                    conn.close()
+                    del self.connections[parts.netloc]
+                break
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                self.connections.pop(parts.netloc, None)
+        self.stats.record( routeName(parts.path), time.perf_counter() - t0, len(body or b''), ok )
+        return body if ok else None
+
+    def getJSON(self, url):
+        body = self.get(url)
+        return json.loads(body) if body else None
+
+    def getArray(self, url, block=None):
+        """
+        Request a (2D) zarr array, or only one block (row of chunks) of it.
+        """
+        from numcodecs import get_codec
+        meta = self.getJSON(url + '/.zarray')
+        if meta is None:
+            return None
+        out = []
+        nblocks = int(np.ceil(meta['shape'][0] / max(meta['chunks'][0], 1)))
+        sep = meta.get('dimension_separator', '.')
+        for b in ([block] if block is not None else range(nblocks)):
+            data = self.get(url + '/%d%s0' % (b, sep))
+            if data is None:
+                continue
+            if meta['compressor'] is not None:
+                data = get_codec(meta['compressor']).decode(data)
+            for f in reversed(meta.get('filters', None) or []):
+                data = get_codec(f).decode(data)
+            a = np.frombuffer(data, dtype=meta['dtype']).reshape(meta['chunks'])
+            out.append(a[: meta['shape'][0] - b*meta['chunks'][0]])
+        return np.vstack(out) if out else None
+
+    def visit(self, site=None):
+        """
+        Visit a site (or a random one, if None), as the viewer would when the site is opened.
+        """
+        index = self.getJSON('index.json')
+        if (index is None) or (len(index.get('sites', {})) == 0):
+            return
+        if site is None:
+            site = self.rng.choice(sorted(index['sites'].keys()))
+        s = index['sites'][site]
+
+        # annotations and tabs
+        if 'annotShards' in index:
+            self.get(index['annotShards'].replace('{site}', site))
+        else:
+            self.get(index.get('annotURL', './annotations.json'))
+        if 'bundleURL' in index:
+            self.get(index['bundleURL'].replace('{site}', site).replace('{lang}', index.get('languages', ['en'])[0]))
+        else:
+            for tabs in [s.get('tabs', {}), index.get('tabs', {})]:
+                for k, paths in tabs.items():
+                    if (k != '_order') and (len(paths) > 0):
+                        self.get(paths[0])
+
+        # stream point cloud
+        if s.get('mediaType', 'cloud') == 'cloud':
+            self.stream(s)
+        else:
+            self.get(s['mediaURL'])
+
+    def stream(self, site):
+        """
+        Stream the chunks of a point cloud site in the same order as `PointStream.js`.
+        """
+        url = urljoin(self.base_url, site['mediaURL']).rstrip('/')
+        if self.get(url + '/.zgroup') is None:
+            return
+        centers = self.getArray(url + '/chunk_centers')
+        attrs = self.getJSON(url + '/.zattrs')
+        if (centers is None) or (attrs is None):
+            return
+
+        # set the view (as in PointStream.js)
+        xyz = centers[:, :3].astype(np.float64)
+        view = site.get('view', {}) or {}
+        if 'tgt' in view:
+            tgt, pos = np.array(view['tgt']), np.array(view['pos'])
+        else:
+            pos, tgt = defaultView( xyz )
+        pos = pos + self.rng.normal(scale=0.1 * np.linalg.norm(tgt - pos) + 1e-9, size=3) # viewers look around a bit
+
+        # stream chunk 0 and then chunks in order of their angle from the view direction
+        # (N.B. approximately the distance from the centre of the screen)
+        v = xyz - pos
+        v /= np.linalg.norm(v, axis=1)[:, None] + 1e-12
+        d = (tgt - pos) / (np.linalg.norm(tgt - pos) + 1e-12)
+        order = [0] + [int(i) for i in np.argsort(-(v @ d)) if i != 0]
+        if self.max_chunks is not None:
+            order = order[:self.max_chunks]
+        columns = None
+        if attrs.get('layout', 'rows') == 'columns':
+            columns = attrs['style_columns'][attrs['styles'][0]]
+        for i in order:
+            if columns is None:
+                self.getArray(url + '/c%d' % i)
+            else:
+                for k in columns:
+                    self.getArray(url + '/c%d/%s' % (i, k))
+
+    def close(self):
+        for c in self.connections.values():
+            c.close()
+        self.connections = {}
+
+def runLoadTest(target, clients=10, visits=1, duration=None, max_chunks=None, sites=None, ramp=0.0, port=4002, seed=42):
+    """
+    Run a number of concurrent simulated viewers (see `Viewer`) against a tour.
+
+    Parameters
+    ----------
+    target : str | rockhopper.VFT
+        The URL of the tour, or a VFT (which is started on the specified port, if it isn't already running).
+    clients : int
+        The number of concurrent viewers.
+    visits : int
+        The number of sites each viewer visits (ignored if a duration is given).
+    duration : float
+        If not None, viewers keep visiting sites until this many seconds have passed.
+    max_chunks : int
+        The maximum number of chunks each viewer streams per site visit, or None to stream entire clouds.
+    sites : list
+        The sites to visit. If None, each viewer visits random sites.
+    ramp : float
+        The time (in seconds) over which to start the viewers, rather than starting them all at once.
+    port : int
+        The port to start a VFT on.
+    seed : int
+        Seed for the random choices made by the viewers.
+
+    Returns
+    --------
+    A LoadStats instance containing the results (see `LoadStats.report`).
+    """
+    if not isinstance(target, str):
+        if (target.server_thread is None) or (not target.server_thread.is_alive()):
+            target.start(port=port)
+        target = f"http://{target.host}:{target.port}/"
+    stats = LoadStats()
+    end = None if duration is None else time.monotonic() + duration
+
+    def run(i):
+        viewer = Viewer(target, stats, seed=seed + i, max_chunks=max_chunks)
+        time.sleep( ramp * i / max(clients, 1) )
+        n = 0
+        while (n < visits) if end is None else (time.monotonic() < end):
+            site = None if not sites else sites[(i + n) % len(sites)]
+            viewer.visit(site)
+            n += 1
+        viewer.close()
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats.end = time.monotonic()
+    return stats
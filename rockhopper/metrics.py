@@ -0,0 +1,218 @@
+"""
+Lightweight request metrics for the VFT server, exposed in the Prometheus text format (see `Metrics`).
+"""
+import re
+import time
+import bisect
+import logging
+import threading
+
+def routeName(path):
+    """
+    Group a URL path into a route (e.g., 'chunk', 'markdown' or 'index.json'), such that metrics
+    (and load test results; see `rockhopper.loadtest`) can be reported per type of request.
+    """
+    name = path.rstrip('/').split('/')[-1]
+    if path.endswith('/') or (name == 'index.html') or (name == ''):
+        return 'index.html'
+    if name in ['index.json', 'update', 'patch', 'events', 'metrics']:
+        return name
+    if name.endswith('.md'):
+        return 'markdown'
+    if '/bundles/' in path:
+        return 'bundle'
+    if '/chunk_centers/' in path:
+        return 'chunk_centers'
+    if name in ['.zgroup', '.zattrs', '.zarray']:
+        return 'zarr metadata'
+    if '.zarr/' in path:
+        return 'chunk'
+    if name.endswith('.json'):
+        return 'annotations'
+    if '/static/' in path:
+        return 'static'
+    return 'other'
+
+class Metrics(object):
+    """
+    Record request counts, latencies and bytes served by a VFT (or several VFTs; see `rockhopper.hosting.TourHost`)
+    and render them in the Prometheus text format. Requests are recorded by wrapping a WSGI app (see `Metrics.wrap`),
+    which only adds a few dictionary updates per request, so this can be left on in production.
+    """
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    chunk_pattern = re.compile(r'/([^/]+\.zarr)/c(\d+)/')
+
+    def __init__(self, slow=None, slow_log=None, chunks=False):
+        """
+        Parameters
+        ----------
+        slow : float
+            If not None, requests taking longer than this many seconds are logged (as warnings) to the
+            `rockhopper.slow` logger.
+        slow_log : str
+            A file to write the slow request log to. If None, the log is handled however the `rockhopper.slow`
+            logger is configured.
+        chunks : bool
+            True if bytes served should also be recorded for each chunk of each stream. This is useful to see
+            which parts of a cloud are viewed most, but creates many more time series.
+        """
+        self.lock = threading.Lock()
+        self.latency = {} # (tour, route) : [bucket counts, sum, count]
+        self.requests = {} # (tour, route, status) : count
+        self.bytes = {} # (tour, route) : bytes
+        self.streams = {} # (tour, stream, site) : bytes
+        self.chunk_bytes = {} # (tour, stream, chunk) : bytes
+        self.in_flight = 0
+        self.chunks = chunks
+        self.slow = slow
+        self.log = logging.getLogger('rockhopper.slow')
+        if slow_log is not None:
+            self.log.addHandler( logging.FileHandler(slow_log) )
+            self.log.setLevel( logging.INFO )
+        self.caches = [] # FileCache instances to report hit rates for
+        self.started = time.time()
+
+    def wrap(self, app, index=None):
+        """
+        Wrap a WSGI app such that its requests are recorded.
+
+        Parameters
+        ----------
+        app : callable
+            The WSGI app (e.g., `flask_app.wsgi_app`).
+        index : callable
+            A function returning the tour's index.json dictionary, used to find the site(s) that a stream belongs to.
+
+        Returns
+        --------
+        The wrapped WSGI app.
+        """
+        def wrapped(environ, start_response):
+            t0 = time.perf_counter()
+            status = [None]
+            def start(s, headers, exc_info=None):
+                status[0] = s.split(' ')[0]
+                return start_response(s, headers, exc_info) if exc_info else start_response(s, headers)
+            with self.lock:
+                self.in_flight += 1
+            try:
+                body = app(environ, start)
+            except Exception:
+                self.finish(environ, '500', time.perf_counter() - t0, 0, index)
+                raise
+            return Body(body, lambda nbytes: self.finish(environ, status[0], time.perf_counter() - t0, nbytes, index))
+        return wrapped
+
+    def finish(self, environ, status, seconds, nbytes, index=None):
+        """
+        Record a completed request.
+        """
+        tour = environ.get('SCRIPT_NAME', '').strip('/')
+        path = environ.get('PATH_INFO', '')
+        route = routeName(path)
+        stream = None
+        if route in ['chunk', 'chunk_centers', 'zarr metadata']:
+            m = self.chunk_pattern.search(path)
+            stream = m.group(1) if m else path.lstrip('/').split('/')[0]
+        with self.lock:
+            self.in_flight -= 1
+            h = self.latency.setdefault( (tour, route), [[0]*len(self.buckets), 0.0, 0] )
+            i = bisect.bisect_left(self.buckets, seconds)
+            if i < len(self.buckets):
+                h[0][i] += 1
+            h[1] += seconds
+            h[2] += 1
+            key = (tour, route, status or '500')
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.bytes[(tour, route)] = self.bytes.get((tour, route), 0) + nbytes
+        if stream is not None:
+            site = ''
+            for k, s in ((index() if index else {}) or {}).get('sites', {}).items():
+                if s.get('mediaURL', '').lstrip('./').rstrip('/') == stream:
+                    site = k
+                    break
+            with self.lock:
+                key = (tour, stream, site)
+                self.streams[key] = self.streams.get(key, 0) + nbytes
+                m = self.chunk_pattern.search(path)
+                if self.chunks and m:
+                    key = (tour, stream, m.group(2))
+                    self.chunk_bytes[key] = self.chunk_bytes.get(key, 0) + nbytes
+        if (self.slow is not None) and (seconds > self.slow):
+            self.log.warning( "%s %s%s %s %.1f ms %d bytes" % (environ.get('REQUEST_METHOD', 'GET'),
+                              environ.get('SCRIPT_NAME', ''), path, status, seconds * 1000, nbytes) )
+
+    def render(self):
+        """
+        Get the current metrics in the Prometheus text exposition format.
+        """
+        def labels(**kwds):
+            return '{' + ','.join(['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                   for k, v in kwds.items()]) + '}'
+        out = []
+        with self.lock:
+            out += ['# HELP rockhopper_request_duration_seconds Time taken to serve requests.',
+                    '# TYPE rockhopper_request_duration_seconds histogram']
+            for (tour, route), (counts, total, n) in sorted(self.latency.items()):
+                c = 0
+                for le, v in zip(self.buckets, counts):
+                    c += v
+                    out.append( 'rockhopper_request_duration_seconds_bucket%s %d' % (labels(tour=tour, route=route, le=le), c) )
+                out.append( 'rockhopper_request_duration_seconds_bucket%s %d' % (labels(tour=tour, route=route, le='+Inf'), n) )
+                out.append( 'rockhopper_request_duration_seconds_sum%s %f' % (labels(tour=tour, route=route), total) )
+                out.append( 'rockhopper_request_duration_seconds_count%s %d' % (labels(tour=tour, route=route), n) )
+            out += ['# HELP rockhopper_requests_total Requests served.',
+                    '# TYPE rockhopper_requests_total counter']
+            out += ['rockhopper_requests_total%s %d' % (labels(tour=t, route=r, status=s), v)
+                    for (t, r, s), v in sorted(self.requests.items())]
+            out += ['# HELP rockhopper_response_bytes_total Bytes served (after compression).',
+                    '# TYPE rockhopper_response_bytes_total counter']
+            out += ['rockhopper_response_bytes_total%s %d' % (labels(tour=t, route=r), v)
+                    for (t, r), v in sorted(self.bytes.items())]
+            out += ['# HELP rockhopper_stream_bytes_total Bytes served from each point cloud stream.',
+                    '# TYPE rockhopper_stream_bytes_total counter']
+            out += ['rockhopper_stream_bytes_total%s %d' % (labels(tour=t, stream=s, site=site), v)
+                    for (t, s, site), v in sorted(self.streams.items())]
+            if self.chunks:
+                out += ['# HELP rockhopper_chunk_bytes_total Bytes served from each chunk of each stream.',
+                        '# TYPE rockhopper_chunk_bytes_total counter']
+                out += ['rockhopper_chunk_bytes_total%s %d' % (labels(tour=t, stream=s, chunk=c), v)
+                        for (t, s, c), v in sorted(self.chunk_bytes.items())]
+            out += ['# HELP rockhopper_requests_in_flight Requests currently being served.',
+                    '# TYPE rockhopper_requests_in_flight gauge',
+                    'rockhopper_requests_in_flight %d' % self.in_flight]
+        if len(self.caches) > 0:
+            out += ['# HELP rockhopper_file_cache_hits_total Files served from the in-memory cache.',
+                    '# TYPE rockhopper_file_cache_hits_total counter',
+                    'rockhopper_file_cache_hits_total %d' % sum([c.hits for c in self.caches]),
+                    '# HELP rockhopper_file_cache_misses_total Files read from disk.',
+                    '# TYPE rockhopper_file_cache_misses_total counter',
+                    'rockhopper_file_cache_misses_total %d' % sum([c.misses for c in self.caches]),
+                    '# HELP rockhopper_file_cache_bytes Size of the in-memory file cache.',
+                    '# TYPE rockhopper_file_cache_bytes gauge',
+                    'rockhopper_file_cache_bytes %d' % sum([c.size for c in self.caches])]
+        out += ['# HELP rockhopper_start_time_seconds Time at which metrics collection started.',
+                '# TYPE rockhopper_start_time_seconds gauge',
+                'rockhopper_start_time_seconds %f' % self.started]
+        return '\n'.join(out) + '\n'
+
+class Body(object):
+    """
+    Wrap a WSGI response body to count the bytes sent and call a function once it has been sent.
+    """
+    def __init__(self, body, callback):
+        self.body = body
+        self.callback = callback
+        self.nbytes = 0
+
+    def __iter__(self):
+        for data in self.body:
+            self.nbytes += len(data)
+            yield data
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.callback(self.nbytes)
@@ -1,13 +1,24 @@
-from flask import Flask, send_from_directory, jsonify, send_file, request
+from flask import Flask, send_from_directory, jsonify, send_file, request, Response, abort, current_app
 from flask_cors import CORS
 from werkzeug.serving import make_server
+from werkzeug.security import safe_join
 import threading
+import tempfile
+import atexit
+import time
+import mimetypes
+import hashlib
+import gzip
+import queue
+from collections import OrderedDict
 import json, os
 import logging 
 from pathlib import Path
 import numpy as np
-from rockhopper.clouds import loadPLY, exportZA
+from rockhopper.clouds import loadPLY, exportZA, fingerprintCloud, updateStyles, EXPORT_ARGS, VIEWER_FOV
 import rockhopper.ui
+from rockhopper.live import ChangeWatcher
+from rockhopper.metrics import Metrics
 import shutil
 import numpy as np
 
@@ -30,29 +41,325 @@ def read_json(file_path):
     except json.JSONDecodeError:
         print(f"Error: The file at {file_path} is not a valid JSON file.")
 
-def write_json(data, filename):
+def format_json(data, ichar='  '):
     """
-    Write a json file using json.dumps, but some fancy formatting.
+    Format a json object as text, with nested dictionaries indented but lists (and numpy arrays)
+    kept on a single line. This is non-recursive and reuses a single encoder, so is fast
+    even for large annotation files.
     """
-    def custom_serializer(value, indent=0, ichar='  '):
-        if isinstance(value, list):
-            return json.dumps(value, separators=(',', ': ')) # Lists on one line
-        elif isinstance(value, np.ndarray):
-            return json.dumps(value.tolist(), separators=(',', ': ')) # Numpy arrays on one line
-        elif isinstance(value, dict):
-            lines = []
-            for key, value in value.items():
-                value_str = custom_serializer(value, indent+1)
-                indented = ichar*indent+f'{json.dumps(key)}: {value_str}' # Indent the key-value pair
-                lines.append(ichar*indent + indented)
-            return '{\n' + ',\n'.join(lines)+'  }'
+    encode = json.JSONEncoder(separators=(',', ': ')).encode
+    def leaf(value):
+        if isinstance(value, np.ndarray):
+            value = value.tolist() # Numpy arrays on one line
+        return encode(value) # Lists on one line
+    if not isinstance(data, dict):
+        return leaf(data)
+    parts = ['{\n']
+    stack = [[iter(data.items()), 0, True]] # (items, indent, first) for each open dictionary
+    while len(stack) > 0:
+        frame = stack[-1]
+        try:
+            key, value = next(frame[0])
+        except StopIteration:
+            stack.pop() # close dictionary
+            parts.append('  }')
+            continue
+        if not frame[2]:
+            parts.append(',\n')
+        frame[2] = False
+        parts.append(ichar*2*frame[1] + encode(key) + ': ') # Indent the key-value pair
+        if isinstance(value, dict):
+            parts.append('{\n')
+            stack.append([iter(value.items()), frame[1]+1, True])
         else:
-            # Pretty-print non-list values (like dicts, strings, numbers)
-            return json.dumps(value, indent=0)
+            parts.append(leaf(value))
+    return ''.join(parts)
+
+def write_json(data, filename):
+    """
+    Write a json file using json.dumps, but some fancy formatting (see `format_json`).
+    """
+    write_atomic(format_json(data), filename)
+
+def write_atomic(text, filename):
+    """
+    Write a text file atomically, by writing to a temporary file in the same directory and
+    then renaming it. This means readers (or a crash) never see a half-written file.
+    """
+    path = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(path, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path, prefix='.%s.' % os.path.basename(filename), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def render_markdown(text, cache=None):
+    """
+    Render markdown text to HTML using the `markdown` package (if installed), caching results by
+    the hash of the text such that unchanged files are only rendered once.
+
+    Parameters
+    ----------
+    text : str
+        The markdown text to render.
+    cache : dict
+        A dictionary mapping content hashes to rendered HTML, or None to disable caching.
+
+    Returns
+    --------
+    A tuple containing the content hash and the rendered HTML (or None if `markdown` is not installed).
+    """
+    key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    if (cache is not None) and (key in cache):
+        return key, cache[key]
+    try:
+        import markdown
+    except ImportError:
+        return key, None # the viewer will render the raw markdown instead
+    html = markdown.markdown(text, extensions=['tables', 'fenced_code'])
+    if cache is not None:
+        cache[key] = html
+    return key, html
+
+class WriteQueue(object):
+    """
+    A background writer that coalesces rapid successive writes to the same file. Each write is
+    delayed until no newer version of the file has been queued for `delay` seconds (or at most
+    `max_delay` seconds after the first queued version), and is then written atomically (see `write_atomic`).
+    Reads should go through `read_json(...)`, `exists(...)` and `listdir(...)` so that queued
+    changes (including queued deletions; see `remove(...)`) are visible immediately. Writes that fail (e.g., if the disk is full) are kept queued and retried
+    with an increasing delay, and are listed by `failures(...)` until they succeed.
+    """
+    def __init__(self, delay=0.5, max_delay=5.0):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.queue = {} # path : [text, due, deadline]
+        self.errors = {} # path : [error message, failed attempts]
+        self.cond = threading.Condition()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush) # don't lose pending writes on exit
+
+    def put(self, filename, text):
+        """
+        Queue text to be written to the specified file (replacing any pending version of it).
+        """
+        path = os.path.abspath(filename)
+        now = time.monotonic()
+        with self.cond:
+            deadline = self.queue[path][2] if path in self.queue else now + self.max_delay
+            self.queue[path] = [text, min(now + self.delay, deadline), deadline]
+            self.cond.notify()
+
+    def remove(self, filename):
+        """
+        Queue the deletion of the specified file (replacing any pending version of it).
+        """
+        self.put(filename, None)
 
-    with open(filename, 'w') as f:
-        text = custom_serializer(data)
-        f.write(text)
+    def put_json(self, filename, data):
+        """
+        Queue a json object to be written to the specified file (see `format_json`).
+        """
+        self.put(filename, format_json(data))
+
+    def pending(self, filename):
+        """
+        Return the queued text for the specified file, or None if no write is pending (or the file is
+        queued for deletion).
+        """
+        with self.cond:
+            item = self.queue.get(os.path.abspath(filename), None)
+        return None if item is None else item[0]
+
+    def read_json(self, filename):
+        """
+        Read a json file, including any pending changes.
+        """
+        with self.cond:
+            item = self.queue.get(os.path.abspath(filename), None)
+        if item is None:
+            return read_json(filename)
+        return None if item[0] is None else json.loads(item[0])
+
+    def exists(self, filename):
+        """
+        Return True if the file exists or is waiting to be written (and is not queued for deletion).
+        """
+        with self.cond:
+            item = self.queue.get(os.path.abspath(filename), None)
+        if item is None:
+            return os.path.exists(filename)
+        return item[0] is not None
+
+    def listdir(self, path):
+        """
+        List the files in a directory, including any waiting to be written.
+        """
+        path = os.path.abspath(path)
+        out = set(os.listdir(path)) if os.path.exists(path) else set()
+        with self.cond:
+            for p, v in self.queue.items():
+                if os.path.dirname(p) != path:
+                    continue
+                if v[0] is None:
+                    out.discard(os.path.basename(p)) # queued for deletion
+                else:
+                    out.add(os.path.basename(p))
+        return sorted(out)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while len(self.queue) == 0:
+                    self.cond.wait()
+                now = time.monotonic()
+                due = [p for p, v in self.queue.items() if v[1] <= now]
+                if len(due) == 0:
+                    self.cond.wait(min([v[1] for v in self.queue.values()]) - now)
+                    continue
+                items = [(p, self.queue[p][0]) for p in due]
+            for p, text in items:
+                self.write(p, text)
+
+    def write(self, path, text):
+        with self.lock: # one write at a time, so older versions can't overwrite newer ones
+            with self.cond:
+                if (path not in self.queue) or (self.queue[path][0] is not text):
+                    return # already written or superseded
+            try:
+                if text is not None:
+                    write_atomic(text, path)
+                elif os.path.exists(path):
+                    os.remove(path) # queued deletion
+            except OSError as e:
+                with self.cond: # keep the text queued and try again later
+                    attempts = self.errors.get(path, [None, 0])[1] + 1
+                    self.errors[path] = [str(e), attempts]
+                    retry = min( max(self.delay, 0.5) * 2**(attempts - 1), 60.0 )
+                    if path in self.queue:
+                        due = max(self.queue[path][1], time.monotonic() + retry)
+                        self.queue[path][1:] = [due, max(self.queue[path][2], due)]
+                print(f"Error: could not write {path} ({e}); retrying in {retry:.1f}s")
+                return
+            with self.cond:
+                self.errors.pop(path, None)
+                if self.queue[path][0] is text:
+                    del self.queue[path] # N.B. keep newer versions queued while writing
+
+    def failures(self, path=None):
+        """
+        Return a dictionary of `{filename : error message}` for queued files (in the specified directory, or
+        anywhere if None) that could not be written to disk.
+        """
+        path = None if path is None else os.path.join(os.path.abspath(path), '')
+        with self.cond:
+            return {p : v[0] for p, v in self.errors.items() if (path is None) or p.startswith(path)}
+
+    def flush(self):
+        """
+        Write all pending files immediately.
+        """
+        with self.cond:
+            items = [(p, v[0]) for p, v in self.queue.items()]
+        for p, text in items:
+            self.write(p, text)
+
+class FileCache(object):
+    """
+    An in-memory (least recently used) cache of small files and their gzip-compressed versions, checked against
+    each file's size and modification time so that changes on disk are picked up. A single cache can be shared
+    by several VFTs (see `rockhopper.hosting.TourHost`). Rendered markdown (see `render_markdown`) is also stored
+    here, in the `markdown` dictionary.
+    """
+    compressible = ['.json', '.md', '.html', '.js', '.css', '.map', '.txt', '.svg', '.zattrs', '.zarray', '.zgroup']
+
+    def __init__(self, max_bytes=256*2**20, max_file=8*2**20):
+        """
+        Parameters
+        ----------
+        max_bytes : int
+            The maximum total size of cached files (in bytes).
+        max_file : int
+            The largest file to cache (in bytes). Larger files are served directly from disk.
+        """
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.files = OrderedDict() # path : (stamp, data, gzipped data)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.markdown = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Get the (data, gzipped data, (size, modification time)) of a file, or None if it is too large
+        to cache. The gzipped data is None for files that are not worth compressing.
+        """
+        st = os.stat(path)
+        if st.st_size > self.max_file:
+            return None
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self.lock:
+            item = self.files.get(path, None)
+            if (item is not None) and (item[0] == stamp):
+                self.files.move_to_end(path)
+                self.hits += 1
+                return item[1], item[2], stamp
+            self.misses += 1
+        with open(path, 'rb') as f:
+            data = f.read()
+        gz = None
+        ext = os.path.splitext(path)[-1] or os.path.basename(path)
+        if (ext.lower() in self.compressible) and (len(data) > 1024):
+            gz = gzip.compress(data, compresslevel=6)
+        with self.lock:
+            if path in self.files:
+                self.size -= len(self.files[path][1]) + len(self.files[path][2] or b'')
+            self.files[path] = (stamp, data, gz)
+            self.size += len(data) + len(gz or b'')
+            while self.size > self.max_bytes: # evict least recently used files
+                _, old = self.files.popitem(last=False)
+                self.size -= len(old[1]) + len(old[2] or b'')
+        return data, gz, stamp
+
+    def send(self, directory, filename):
+        """
+        Create a flask response for the specified file (as for `flask.send_from_directory`, including
+        ETag and Last-Modified headers, such that conditional requests get a 304 response).
+        """
+        path = safe_join(os.path.abspath(directory), filename)
+        if (path is None) or (not os.path.isfile(path)):
+            abort(404)
+        item = self.get(path)
+        if item is None:
+            return send_from_directory(directory, filename) # too big to cache
+        data, gz, (size, mtime) = item
+        response = Response(data, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        etag = '%x-%x' % (mtime, size)
+        if (gz is not None) and ('gzip' in request.headers.get('Accept-Encoding', '')):
+            response.set_data(gz)
+            response.headers['Content-Encoding'] = 'gzip'
+            etag += '-gz' # N.B. a different representation of the same file
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(etag)
+        response.last_modified = mtime / 1e9
+        max_age = current_app.get_send_file_max_age(filename)
+        if max_age is None:
+            response.cache_control.no_cache = True
+        else:
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+        return response.make_conditional(request)
 
 defaultMD = """
 # My new markdown file 
@@ -108,13 +415,14 @@ Including YouTube videos can also help explain content in an engaging way.
 """
 
 class ServerThread(threading.Thread):
-    def __init__(self, app, host, port):
+    def __init__(self, app, host, port, threaded=False):
         threading.Thread.__init__(self)
         self.host = host
         self.port = port
-        self.server = make_server(host, port, app)
-        self.ctx = app.app_context()
-        self.ctx.push()
+        self.server = make_server(host, port, app, threaded=threaded)
+        if hasattr(app, 'app_context'):
+            self.ctx = app.app_context()
+            self.ctx.push()
 
     def run(self):
         self.server.serve_forever()
@@ -128,7 +436,8 @@ class VFT(object):
     data, defining field trip structure and creating dummy content. It also runs a local
     development server that can be used to define content and create annotations and labels. 
     """
-    def __init__(self, vft_path, cloud_path=None, overwrite=False, devMode=True):
+    def __init__(self, vft_path, cloud_path=None, overwrite=False, devMode=True, write_delay=0.5,
+                 writer=None, cache=None, metrics=None):
         """
         Initialize the VFT application with specified paths and configurations.
 
@@ -143,9 +452,22 @@ class VFT(object):
         devMode : bool
             True (default) if the server will allow editing of files. This is useful for development, but can be set to False to test
             behaviour during deployment.
+        write_delay : float
+            Changes to tour files are written in the background, once no further changes have been made for this many
+            seconds (see `WriteQueue`). This avoids repeatedly rewriting files during rapid edits. Call `flush()` to
+            write changes immediately.
+        writer : WriteQueue
+            A background writer to use (e.g., shared with other VFTs). If None, a new one is created.
+        cache : FileCache
+            A cache for served files and rendered markdown (e.g., shared with other VFTs). If None, a new one is created.
+        metrics : bool | Metrics
+            True (or a `rockhopper.metrics.Metrics` instance, e.g., shared with other VFTs) if request latencies and
+            bytes served should be recorded and exposed (in the Prometheus text format) at `/metrics`. Default is None (off).
         """
             
         # basic VFT properties
+        self.writer = writer or WriteQueue( delay=write_delay )
+        self.cache = cache or FileCache()
         self.vft_path = vft_path
         self.cloud_path = cloud_path
         os.makedirs(vft_path, exist_ok=True)
@@ -155,15 +477,24 @@ class VFT(object):
         self.port = None
         self.host = None
         self.devMode = devMode
+        self.lock = threading.Lock()
+        self.watcher = None # created when the first client listens for changes (see `/events`)
 
         # copy required files from rockhopper.ui
         rockhopper.ui.copyTo(vft_path, overwrite=overwrite)
 
         # setup app
-        self.app = Flask(__name__, static_folder=vft_path)
+        self.app = Flask(__name__, static_folder=os.path.abspath(vft_path)) # N.B. relative paths would resolve against this module
         CORS(self.app)
         self.server_thread = None
 
+        # record request metrics?
+        self.metrics = Metrics() if metrics is True else (metrics or None)
+        if self.metrics is not None:
+            if self.cache not in self.metrics.caches:
+                self.metrics.caches.append( self.cache )
+            self.app.wsgi_app = self.metrics.wrap( self.app.wsgi_app, index=lambda: self.index )
+
         # hide annoying messages
         log = logging.getLogger('werkzeug')
         log.setLevel(logging.ERROR)
@@ -182,8 +513,8 @@ class VFT(object):
             """
             # load index from file (in case of manual changes)
             pth = os.path.join( self.vft_path, 'index.json' )
-            if os.path.exists(pth):
-                self.index = read_json( pth )
+            if self.writer.exists(pth):
+                self.index = self.writer.read_json( pth )
             else:
                 self.updateIndex()
 
@@ -191,7 +522,7 @@ class VFT(object):
             if 'devURL' in self.index:
                 del self.index['devURL'] # remove this property if it exists
             if self.devMode:
-                self.index['devURL'] = f"http://{self.host}:{self.port}" # add devURL in dev mode
+                self.index['devURL'] = request.url_root.rstrip('/') # add devURL in dev mode (N.B. includes any URL prefix)
 
             # serve
             return jsonify(self.index)
@@ -211,32 +542,142 @@ class VFT(object):
             filename = data['filename']
             content = data['content']
             dtype = data['dtype']
+            root = os.path.join(os.path.abspath(self.vft_path), '')
+            if not os.path.abspath(os.path.join(root, filename)).startswith(root):
+                return jsonify(isError=True, message=f"Invalid filename {filename}",
+                               statusCode=400, data={}), 400
             if 'json' in dtype.lower(): # parse content of json text to a json dictionary
                 content = json.loads(content)
-                write_json(content, os.path.join(self.vft_path, filename)) # write relevant file with pretty formatting
+                with self.lock: # N.B. annotations can also be patched concurrently (see `/patch`)
+                    if self.isAnnotURL(filename) and ('annotShards' in self.index):
+                        try:
+                            for site in content: # check all site names before changing anything
+                                self.checkSite(site)
+                        except AssertionError as e:
+                            return jsonify(isError=True, message=str(e), statusCode=400, data={}), 400
+                        for site in self.getAnnotations().keys() - content.keys(): # sites that were removed
+                            self.deleteAnnotations(site)
+                        for site, annot in content.items(): # only rewrite the shards that changed
+                            self.writeAnnotations(site, annot)
+                    else:
+                        self.writer.put_json(os.path.join(self.vft_path, filename), content) # write relevant file with pretty formatting
             else: # write relevant file directly
-                with open( os.path.join(self.vft_path, filename), 'w' ) as f:
-                    f.write(content)
+                self.writer.put(os.path.join(self.vft_path, filename), content)
                             
             # update index (if this has changed)
             if 'index.json' in filename:
                 self.updateIndex()
             
             # return success
-            return jsonify(isError=False, 
-                           message="Success",
-                           statusCode=200,
-                           data={}), 200
+            return self.saved({})
         
+        @self.app.route("/patch", methods=['POST'])
+        def patch():
+            """
+            Add, modify or delete a single annotation (see `patchAnnotation`)
+            """
+            if not self.devMode:
+                return jsonify(isError=True, 
+                               message="Development mode is off. Cannot update files.",
+                               statusCode=403,
+                               data={}), 403
+            data = request.json
+            try:
+                ix = self.patchAnnotation( data['site'], data['op'], data['kind'],
+                                           index=data.get('index', None),
+                                           annotation=data.get('annotation', None) )
+            except (KeyError, IndexError, TypeError, ValueError, AssertionError) as e:
+                return jsonify(isError=True,
+                               message=f"Invalid patch: {e}",
+                               statusCode=400,
+                               data={}), 400
+            return self.saved({'index':ix})
+
+        @self.app.route("/events")
+        def events():
+            """
+            Push a notification (as a Server-Sent Event) whenever a file in this tour changes (see `describeChange`)
+            """
+            if not self.devMode:
+                return jsonify(isError=True, 
+                               message="Development mode is off. Live reloading is disabled.",
+                               statusCode=403,
+                               data={}), 403
+            if self.watcher is None:
+                self.watcher = ChangeWatcher(self.vft_path, self.cloud_path)
+            q = self.watcher.subscribe()
+            def stream():
+                try:
+                    yield "retry: 2000\n\n"
+                    while True:
+                        try:
+                            path = q.get(timeout=15)
+                        except queue.Empty:
+                            yield ": ping\n\n" # keep connection alive
+                            continue
+                        yield f"data: {json.dumps(self.describeChange(path))}\n\n"
+                finally:
+                    self.watcher.unsubscribe(q) # client disconnected
+            return Response(stream(), mimetype='text/event-stream',
+                            headers={'Cache-Control':'no-cache', 'X-Accel-Buffering':'no'})
+
+        @self.app.route("/metrics")
+        def serve_metrics():
+            """
+            Request metrics (see `rockhopper.metrics.Metrics`)
+            """
+            if self.metrics is None:
+                return jsonify(isError=True, 
+                               message="Metrics are disabled.",
+                               statusCode=404,
+                               data={}), 404
+            return Response(self.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+        @self.app.route("/bundles/<name>.json")
+        def serve_bundle(name):
+            """
+            Serve all tabs for a site in one language (see `getBundle`)
+            """
+            site, _, lang = name.rpartition('_') # N.B. site names can contain underscores
+            if (not site) or (site not in self.index['sites']) or (lang not in self.index['languages']):
+                return jsonify(isError=True, message=f"Unknown site or language {name}",
+                               statusCode=404, data={}), 404
+            return jsonify(self.getBundle(site, lang))
+
         @self.app.route("/<path:filename>")
         def serve_file(filename):
             """
             Other static files
             """
+            if self.isAnnotURL(filename) and ('annotShards' in self.index):
+                return jsonify(self.getAnnotations()) # merge shards (for viewers that expect a single file)
+            pth = os.path.join(self.vft_path, filename)
+            text = self.writer.pending(pth)
+            if text is not None: # serve changes that are still waiting to be written
+                return Response(text, mimetype=mimetypes.guess_type(filename)[0] or 'text/plain')
+            if os.path.exists(pth) and not self.writer.exists(pth): # waiting to be deleted
+                return jsonify(isError=True, message=f"{filename} was deleted", statusCode=404, data={}), 404
             if self.cloud_path is not None:
                 if os.path.exists(os.path.join(self.cloud_path, filename)):
-                    return send_from_directory(self.cloud_path, filename)
-            return send_from_directory(self.app.static_folder, filename)
+                    return self.cache.send(self.cloud_path, filename)
+            return self.cache.send(self.app.static_folder, filename)
+
+    def saved(self, data):
+        """
+        Build the response to a request that changed files in this tour. If queued files could not be written
+        to disk (see `WriteQueue.failures`), the changes are kept in memory and retried, and a 202 (Accepted)
+        response listing the failed files is returned instead of 200 (Success).
+        """
+        failed = {os.path.relpath(p, self.vft_path) : e for p, e in self.writer.failures(self.vft_path).items()}
+        if len(failed) > 0:
+            return jsonify(isError=True,
+                           message=f"Changes could not be written to disk (retrying): {failed}",
+                           statusCode=202,
+                           data=dict(data, failed=failed)), 202
+        return jsonify(isError=False, 
+                       message="Success",
+                       statusCode=200,
+                       data=data), 200
 
     def updateIndex(self):
         """
@@ -244,8 +685,8 @@ class VFT(object):
         when changes are made.
         """
         pth = os.path.join( self.vft_path, 'index.json' )
-        if os.path.exists(pth):
-            self.index = read_json( pth )
+        if self.writer.exists(pth):
+            self.index = self.writer.read_json( pth )
         else:
             # create a new index.json
             self.index = {"annotURL": "./annotations.json",
@@ -261,9 +702,8 @@ class VFT(object):
             self.writeIndex() # save
 
         # also write annotations file
-        if not os.path.exists( os.path.join(self.vft_path, self.index['annotURL']) ):
-            with open(os.path.join(self.vft_path, self.index['annotURL']),'w') as f:
-                f.write("{}\n") # stub
+        if not self.writer.exists( os.path.join(self.vft_path, self.index['annotURL']) ):
+            self.writer.put(os.path.join(self.vft_path, self.index['annotURL']), "{}\n") # stub
     
         # make sure the 'devURL' property never sneaks into the hardcopy of index.json
         if 'devURL' in self.index: 
@@ -272,10 +712,295 @@ class VFT(object):
     def writeIndex(self):
         if 'devURL' in self.index: # hide this property
             del self.index['devURL']
-        write_json(self.index, os.path.join(self.vft_path, 'index.json'))
+        self.writer.put_json(os.path.join(self.vft_path, 'index.json'), self.index)
         #with open(os.path.join(self.vft_path, 'index.json'), 'w' ) as f:
         #    json.dump(self.index, f, indent=2,  )
     
+    def getBundle(self, site, lang):
+        """
+        Get all the tabs shown at a site in one language as a single json object, such that switching
+        sites needs only one request. Markdown is also pre-rendered to HTML (if the `markdown`
+        package is installed).
+
+        Parameters
+        ------------
+        site : str
+            The name of the site.
+        lang : str
+            The language code (e.g., 'en').
+
+        Returns
+        --------
+        A dictionary containing the site, language, tab order and a dictionary of tabs. Each tab
+        contains the url, markdown, html and content hash of its markdown file.
+        """
+        ix = self.index['languages'].index(lang)
+        globalTabs = self.index.get('tabs', {})
+        siteTabs = self.index['sites'][site].get('tabs', {})
+        order = siteTabs.get('_order', [k for k in siteTabs if k != '_order']) + \
+                globalTabs.get('_order', [k for k in globalTabs if k != '_order']) # N.B. as in the viewer
+        order = list(dict.fromkeys(order)) # tabs listed as both site and global tabs are shown once
+        tabs = {}
+        for name in order:
+            paths = globalTabs.get(name, siteTabs.get(name, [])) # N.B. global tabs take precedence, as in the viewer
+            if ix >= len(paths):
+                continue # no translation
+            pth = os.path.join(self.vft_path, paths[ix])
+            text = self.writer.pending(pth)
+            if (text is None) and os.path.exists(pth):
+                with open(pth, 'r', encoding='utf-8') as f:
+                    text = f.read()
+            if text is None:
+                continue # missing file
+            key, html = render_markdown(text, self.cache.markdown)
+            tabs[name] = dict(url=paths[ix], markdown=text, html=html, hash=key)
+        return dict(site=site, language=lang, order=[k for k in order if k in tabs], tabs=tabs)
+
+    def buildBundles(self):
+        """
+        Write a bundle (see `getBundle`) for each site and language to `vft_path/bundles` for static
+        hosting, and add the "bundleURL" template to index.json so the viewer can find them.
+        """
+        for site in self.index['sites']:
+            for lang in self.index['languages']:
+                self.writer.put_json(os.path.join(self.vft_path, f'bundles/{site}_{lang}.json'),
+                                     self.getBundle(site, lang))
+        self.index['bundleURL'] = './bundles/{site}_{lang}.json'
+        self.writeIndex()
+
+    def buildPrefetch(self, batch_size=8, fov=VIEWER_FOV, aspect=1.5):
+        """
+        Precompute the order in which chunks should be fetched for the start view of each point cloud site and
+        for each of its labels and annotations, and store these plans alongside each (local) stream (see
+        `rockhopper.clouds.writePrefetch`). Views of labels and annotations are the site's start view, moved to
+        centre on the label or annotation. Plans are named `site` (the start view), `site/labels/label` and
+        `site/lines/0`, `site/planes/0`, etc. (the annotations).
+
+        Parameters
+        ----------
+        batch_size : int
+            The number of chunks clients should request at once.
+        fov : float
+            The vertical field of view of the viewer's camera (in degrees). Defaults to `VIEWER_FOV`.
+        aspect : float
+            The aspect ratio assumed for the viewer's screen.
+
+        Returns
+        --------
+        A dictionary containing the number of views planned for each stream.
+        """
+        import zarr
+        from rockhopper.clouds import writePrefetch, defaultView
+        streams = {} # path : {name : view}
+        for site, s in self.index['sites'].items():
+            if s.get('mediaType', 'cloud') != 'cloud':
+                continue
+            pth = None
+            for root in [self.cloud_path, self.vft_path]:
+                if root and os.path.exists( os.path.join(root, s['mediaURL'], 'chunk_centers') ):
+                    pth = os.path.join(root, s['mediaURL'])
+                    break
+            if pth is None:
+                continue # e.g., streamed from another server
+            view = s.get('view', {}) or {}
+            if ('pos' in view) and ('tgt' in view):
+                pos, tgt = np.array(view['pos']), np.array(view['tgt'])
+            else:
+                pos, tgt = defaultView( zarr.open_group(pth, mode='r')['chunk_centers'][:] )
+            views = streams.setdefault(pth, {})
+            views[site] = dict( pos=pos.tolist(), tgt=tgt.tolist() )
+            def pan(center):
+                return dict( pos=(pos - tgt + center).tolist(), tgt=np.array(center).tolist() )
+            for k, label in s.get('labels', {}).items():
+                views[f'{site}/labels/{k}'] = pan( label['pos'] )
+            for kind, annots in self.getAnnotations(site).items():
+                for i, a in enumerate(annots):
+                    if len(a.get('verts', [])) > 0:
+                        views[f'{site}/{kind}/{i}'] = pan( np.mean([[v['x'], v['y'], v['z']] for v in a['verts']], axis=0) )
+        for pth, views in streams.items():
+            writePrefetch( pth, views, batch_size=batch_size, fov=fov, aspect=aspect )
+        return {pth : len(views) for pth, views in streams.items()}
+
+    def describeChange(self, path):
+        """
+        Describe a changed file such that clients can refresh only what is affected.
+
+        Parameters
+        ------------
+        path : str
+            The path of the changed file.
+
+        Returns
+        --------
+        A dictionary containing the "file" (relative to vft_path or cloud_path), the "kind" of
+        change ('index', 'annotations', 'markdown', 'cloud' or 'file') and the "sites" affected
+        (or None if all sites may be affected). Markdown changes also include the affected "tabs".
+        """
+        path = os.path.abspath(path)
+        root = self.vft_path
+        if self.cloud_path and path.startswith(os.path.abspath(self.cloud_path) + os.sep):
+            root = self.cloud_path
+        rel = os.path.relpath(path, os.path.abspath(root)).replace(os.sep, '/')
+        out = dict(file=rel, kind='file', sites=None)
+        sites = self.index.get('sites', {})
+        if (root == self.vft_path) and (rel == 'index.json'):
+            out['kind'] = 'index'
+        elif (root == self.vft_path) and self.isAnnotURL(rel):
+            out['kind'] = 'annotations'
+        elif 'annotShards' in self.index and (root == self.vft_path):
+            prefix, suffix = os.path.normpath(self.index['annotShards']).split('{site}')
+            if rel.startswith(prefix.replace(os.sep, '/')) and rel.endswith(suffix):
+                out['kind'] = 'annotations'
+                out['sites'] = [rel[len(prefix):len(rel)-len(suffix)]]
+        if (out['kind'] == 'file') and rel.endswith('.md'):
+            out['kind'] = 'markdown'
+            out['tabs'] = []
+            norm = os.path.normpath(rel)
+            for k, v in self.index.get('tabs', {}).items():
+                if (k != '_order') and any(os.path.normpath(p) == norm for p in v):
+                    out['tabs'].append(k) # global tab; all sites affected
+            local = [(site, k) for site, s in sites.items() for k, v in s.get('tabs', {}).items()
+                     if (k != '_order') and any(os.path.normpath(p) == norm for p in v)]
+            if (len(out['tabs']) == 0) and (len(local) > 0):
+                out['sites'] = sorted(set([site for site, _ in local]))
+            out['tabs'] += [k for _, k in local]
+        elif (out['kind'] == 'file') and ('.zarr/' in rel):
+            out['kind'] = 'cloud'
+            stream = rel.split('.zarr/')[0] + '.zarr'
+            out['sites'] = [k for k, v in sites.items() if v.get('mediaURL', '').lstrip('./') == stream]
+        return out
+
+    def isAnnotURL(self, filename):
+        """
+        Return True if the specified (relative) filename is the annotation file (`annotURL`).
+        """
+        return os.path.normpath(filename) == os.path.normpath(self.index.get('annotURL', './annotations.json'))
+
+    def shardAnnotations(self, template='./annotations/{site}.json'):
+        """
+        Split the annotations file (`annotURL`) into one file per site, such that annotations
+        can be loaded lazily when a site is opened and edits only rewrite the affected site. The
+        location of the shards is stored as "annotShards" in index.json.
+
+        Parameters
+        ------------
+        template : str
+            The path (relative to `vft_path`) to store each shard at. This must contain "{site}".
+        """
+        assert '{site}' in template, "Shard template must contain '{site}'"
+        annotations = self.getAnnotations()
+        self.index['annotShards'] = template
+        for site, annot in annotations.items():
+            self.writeAnnotations(site, annot)
+        self.writeIndex()
+
+    def checkSite(self, site):
+        """
+        Check that a site name (e.g., from a request) cannot point outside of the annotation shard directory
+        (see `shardAnnotations`), i.e. that it contains no path separators and is not '.' or '..'.
+        """
+        assert isinstance(site, str) and (site.strip('.') != '') and not any(c in site for c in '/\\\0'), \
+                f"Invalid site name {site}"
+
+    def shardPath(self, site):
+        """
+        Get the path of the annotation shard for the specified site (see `shardAnnotations`).
+        """
+        self.checkSite(site)
+        return os.path.join(self.vft_path, self.index['annotShards'].format(site=site))
+
+    def getAnnotations(self, site=None):
+        """
+        Load the annotations for the specified site, or for all sites if site is None.
+        """
+        empty = {"lines": [], "planes": [], "traces": []}
+        if 'annotShards' in self.index:
+            if site is not None:
+                pth = self.shardPath(site)
+                return self.writer.read_json(pth) if self.writer.exists(pth) else empty
+            out = {}
+            template = os.path.abspath(os.path.join(self.vft_path, self.index['annotShards']))
+            prefix, suffix = template.split('{site}')
+            for f in self.writer.listdir(os.path.dirname(prefix)):
+                pth = os.path.join(os.path.dirname(prefix), f)
+                if pth.startswith(prefix) and pth.endswith(suffix):
+                    out[pth[len(prefix):len(pth)-len(suffix)]] = self.writer.read_json(pth)
+            return out
+        pth = os.path.join(self.vft_path, self.index['annotURL'])
+        out = (self.writer.read_json(pth) if self.writer.exists(pth) else None) or {}
+        if site is not None:
+            return out.get(site, empty)
+        return out
+
+    def writeAnnotations(self, site, annotations):
+        """
+        Write the annotations for the specified site. If annotations are sharded (see
+        `shardAnnotations`), only this site's shard is rewritten (and only if it changed).
+        """
+        if 'annotShards' in self.index:
+            pth = self.shardPath(site)
+            if self.writer.exists(pth) and (self.writer.read_json(pth) == annotations):
+                return # no changes
+            self.writer.put_json(pth, annotations)
+        else:
+            out = self.getAnnotations()
+            out[site] = annotations
+            self.writer.put_json(os.path.join(self.vft_path, self.index['annotURL']), out)
+
+    def deleteAnnotations(self, site):
+        """
+        Delete all annotations for the specified site (including its shard, if annotations are sharded).
+        """
+        if 'annotShards' in self.index:
+            pth = self.shardPath(site)
+            if self.writer.exists(pth):
+                self.writer.remove(pth)
+        else:
+            out = self.getAnnotations()
+            if out.pop(site, None) is not None:
+                self.writer.put_json(os.path.join(self.vft_path, self.index['annotURL']), out)
+
+    def patchAnnotation(self, site, op, kind, index=None, annotation=None):
+        """
+        Add, modify or delete a single annotation.
+
+        Parameters
+        ------------
+        site : str
+            The site the annotation belongs to.
+        op : str
+            The operation to apply; 'add', 'modify' or 'delete'.
+        kind : str
+            The type of annotation (e.g., 'lines', 'planes' or 'traces').
+        index : int
+            The index of the annotation to modify or delete.
+        annotation : dict
+            The new annotation (for 'add' and 'modify').
+
+        Returns
+        --------
+        The index of the added or modified annotation (or None for 'delete').
+        """
+        assert op in ['add', 'modify', 'delete'], f"Unknown operation {op}"
+        self.checkSite(site)
+        if op != 'add':
+            assert (index is not None) and str(index).isdigit(), f"Invalid annotation index {index}" # N.B. not negative
+        with self.lock:
+            annot = self.getAnnotations(site)
+            items = annot.setdefault(kind, [])
+            if op == 'add':
+                assert annotation is not None, "No annotation specified"
+                items.append(annotation)
+                index = len(items) - 1
+            elif op == 'modify':
+                assert annotation is not None, "No annotation specified"
+                items[int(index)] = annotation
+            else:
+                del items[int(index)]
+                index = None
+            self.writeAnnotations(site, annot)
+        return index
+
     def start(self, port=4002):
         if self.server_thread and self.server_thread.is_alive():
             print("Server already started")
@@ -286,13 +1011,20 @@ class VFT(object):
         self.host = '127.0.0.1'
 
         # launch!
-        self.server_thread = ServerThread( self.app, self.host, self.port )
+        self.server_thread = ServerThread( self.app, self.host, self.port, threaded=True ) # N.B. threaded so /events doesn't block
         self.server_thread.start()
         print(f"Development server started at http://{self.host}:{self.port}")
 
     def stop(self):
         if self.server_thread:
             self.server_thread.shutdown()
+        self.flush()
+
+    def flush(self):
+        """
+        Write any pending changes to tour files immediately.
+        """
+        self.writer.flush()
 
     def setLanguages( self, languages = ['en'] ):
         """
@@ -356,7 +1088,7 @@ class VFT(object):
             self.index['sites'][site.lower()]['tabs'][name] = paths
         self.writeIndex() # save changes
 
-    def addCloud( self, site, name, cloud=None, site_kwds={}, **kwds):
+    def addCloud( self, site, name, cloud=None, site_kwds={}, workers=1, tile_size=100.0, cache=True, normals=True, **kwds):
         """
         Convert a PLY point cloud to streamable format and store it in the 
         specified cloud_path (if this is not None).
@@ -374,6 +1106,19 @@ class VFT(object):
             must be `x, y, z, r, g, b`. If None, it is assumed that the cloud specified by
             `name` has already been created.
         site_kwds : keywords to pass to `self.addSite( ... )` when creating a new site.
+        workers : int
+            If greater than one, the cloud is split into tiles that are converted by this many worker
+            processes (see `rockhopper.tiling.convertTiled`). Default is 1 (convert in this process).
+        tile_size : float
+            The width and height of each tile when converting with several workers.
+        cache : bool
+            If True (default), the conversion is skipped if the stream already exists and was created from the same
+            input (with the same size and modification time, for .ply files) and export parameters. If only the
+            stylesheet, groups or other metadata have changed then just the stream's attributes are updated
+            (see `rockhopper.clouds.updateStyles`). Set as False to always convert.
+        normals : bool | np.ndarray
+            True (default) if normals contained in the .ply file should be included in the stream (see the `normals`
+            argument of `rockhopper.exportZA`). For arrays, an (n, 3) array of normals can be passed instead.
 
         Keywords
         ---------
@@ -407,6 +1152,9 @@ class VFT(object):
                 `chroma.scale(...)` function (e.g., `'viridis'`, `'spectral'`, `'RdYlBu'`).  
             - `limits`: The `(min, max, nsteps)` defining the colour domain and the number
                 of intervals used in the ramp. These values are passed to `chroma.limits(...)`.
+                If `limits` is omitted (or set to 'auto'), the 2nd and 98th percentiles of the band
+                (computed during export) are used instead. The same applies to ternary mappings
+                defined with only a band index, e.g. `'R': (3,)`.
 
             Default
             -------
@@ -417,7 +1165,7 @@ class VFT(object):
                                 'G': (4, 0, 1),
                                 'B': (5, 0, 1)}},
                 'elev': {'color': (2, {'scale': 'viridis',
-                                    'limits': (-100, 100, 255)})}
+                                    'limits': 'auto'})}
             }
             ```
 
@@ -500,9 +1248,29 @@ class VFT(object):
         
         if cloud is not None:
             assert self.cloud_path is not None, "Create a VFT with a `cloud_path` to add local cloud streams."
+            out_path = os.path.join( self.cloud_path, f"{name}.zarr")
+
+            # check if this stream is already up to date
+            if not isinstance(normals, np.ndarray):
+                normals = bool(normals) and isinstance(cloud, (str, Path)) # N.B. only .ply files provide normals
+            fingerprint = fingerprintCloud( cloud, tile_size=tile_size if workers > 1 else None, normals=normals, **kwds )
+            current = {}
+            if cache and os.path.exists( os.path.join(out_path, '.zattrs') ):
+                current = (read_json( os.path.join(out_path, '.zattrs') ) or {}).get('fingerprint', {})
+            if (current.get('input', None) == fingerprint['input']) and (current.get('export', None) == fingerprint['export']):
+                if current.get('style', None) != fingerprint['style']:
+                    print("Updating styles of %s" % out_path)
+                    updateStyles( out_path, **{k : v for k, v in kwds.items() if k not in EXPORT_ARGS} )
+                else:
+                    print("Skipping %s (already up to date)" % out_path)
+                cloud = None # no need to convert
+                self.setFingerprint( out_path, fingerprint )
+
+        if cloud is not None:
             if isinstance(cloud, str) or isinstance(cloud, Path):
                 cloud = loadPLY( cloud )
                 # retrieve attributes from resulting dict
+                normals = cloud.get('normals', None) if normals is True else None
                 xyz = cloud['xyz']
                 rgb = cloud['rgb']
                 if 'attr' in cloud:
@@ -511,17 +1279,72 @@ class VFT(object):
                 else:
                     cloud = np.hstack([xyz, rgb])
         
+            if not isinstance(normals, np.ndarray):
+                normals = None
             print("Building stream with shape %s"%str(cloud.shape))
 
             # export array
-            out_path = os.path.join( self.cloud_path, f"{name}.zarr")
-            exportZA( cloud, out_path, **kwds)
+            if workers > 1:
+                from rockhopper.tiling import convertTiled
+                convertTiled( cloud, out_path, workers=workers, tile_size=tile_size, normals=normals, **kwds )
+            else:
+                exportZA( cloud, out_path, normals=normals, **kwds)
+            self.setFingerprint( out_path, fingerprint )
 
-        # add site for this cloud
+        # add site for this cloud (with its preview image, if there is one)
         if site is not None:
+            if (self.cloud_path is not None) and os.path.exists( os.path.join(self.cloud_path, f"{name}.zarr", 'preview.png') ):
+                site_kwds = {'previewURL' : f"{name}.zarr/preview.png", **site_kwds}
             self.addSite( site, mediaURL=f"{name}.zarr", mediaType='cloud', 
                         pointSize = kwds.get('resolution',0.1), **site_kwds )
 
+    def addEpochs( self, site, name, clouds, epochs=None, site_kwds={}, **kwds):
+        """
+        Convert several epochs (repeat surveys) of the same scene to a single stream, in which later epochs are stored
+        as changes relative to the first (see `rockhopper.epochs.exportEpochs`), and add it as a site.
+
+        Parameters
+        ----------
+        site : str
+            The name of the "site" to create in the tour. Set as None to convert the epochs without adding a new site.
+        name : str
+            The name to use for the created `zarr` stream.
+        clouds : list
+            A list of .ply files or (n,d) numpy arrays containing each epoch (see `addCloud`).
+        epochs : list
+            A name for each epoch (e.g., the survey date). These are also listed in the site's "epochs" entry.
+        site_kwds : keywords to pass to `self.addSite( ... )` when creating a new site.
+
+        Keywords
+        ---------
+        All keywords are passed to `rockhopper.epochs.exportEpochs(...)` (and then to `rockhopper.exportZA`).
+        """
+        from rockhopper.epochs import exportEpochs
+        assert self.cloud_path is not None, "Create a VFT with a `cloud_path` to add local cloud streams."
+        out_path = os.path.join( self.cloud_path, f"{name}.zarr")
+        points = []
+        for cloud in clouds:
+            if isinstance(cloud, str) or isinstance(cloud, Path):
+                cloud = loadPLY( cloud )
+                cloud = np.hstack([cloud['xyz'], cloud['rgb']] + ([cloud['attr']] if 'attr' in cloud else []))
+            points.append( cloud )
+        print("Building stream with %d epochs" % len(points))
+        info = exportEpochs( points, out_path, names=epochs, **kwds )
+
+        # add site for this cloud
+        if site is not None:
+            if os.path.exists( os.path.join(out_path, 'preview.png') ):
+                site_kwds = {'previewURL' : f"{name}.zarr/preview.png", **site_kwds}
+            self.addSite( site, mediaURL=f"{name}.zarr", mediaType='cloud', epochs=info['names'],
+                        pointSize = kwds.get('resolution',0.1), **site_kwds )
+
+    def setFingerprint( self, zarr_store_path, fingerprint ):
+        """
+        Store the fingerprint of a converted stream (see `rockhopper.clouds.fingerprintCloud`) in its attributes.
+        """
+        import zarr
+        zarr.open_group( zarr_store_path, mode='r+' ).attrs['fingerprint'] = fingerprint
+
     def addPhotosphere( self, site, image, **kwds):
         """
         Copy the specified photosphere into this VFT and add it as a site.
@@ -0,0 +1,473 @@
+"""
+Convert large point clouds to streamable zarr datasets using several (local or remote) worker processes.
+
+The cloud is first split into spatial tiles and a job manifest is written to a "job" directory (see `planTiles`).
+Workers (e.g., local processes, or processes on several machines sharing a filesystem) then claim tiles
+using lock files and cull, partition and write the chunks of each tile (see `runWorker`). Finally, the tiles are
+merged into a single stream with consistent chunk numbering, chunk centers and attributes (see `mergeTiles`).
+Each completed tile is recorded in the job directory, so a crashed conversion can be resumed by re-running
+the workers (and then the merge).
+
+```
+planTiles(points, 'cloud.job', tile_size=100, resolution=0.05)
+runWorker('cloud.job') # on as many processes / machines as needed
+mergeTiles('cloud.job', 'cloud.zarr')
+```
+"""
+import os
+import json
+import time
+import shutil
+import socket
+import threading
+import warnings
+import numpy as np
+from rockhopper.clouds import (resolveColumns, findCategorical, cullPoints, splitChunk, writeChunk,
+                               progressiveOrder, styleBands, groupChunks, BandStats, fitStyles, storeBlobs,
+                               writeNormals, normalAttrs, writePreview, fingerprintCloud, buildDictionary,
+                               dictionaryToJSON)
+
+def planTiles(points, job_path, tile_size=100.0,
+              chunk_size=200000, resolution=0.1,
+              stylesheet=None, styles=None, codec=None,
+              progressive=False, block_size=None, overviews=1, columns=None, categorical=None,
+              normals=None, normal_bits=16, preview=256, preview_view='auto', fingerprint=None, **kwds):
+    """
+    Split a point cloud into square (x-y) tiles and write these, along with a job manifest, to a job directory.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Shape (N, d) array of points to convert (see `exportZA`).
+    job_path : str
+        The directory to store the tiles, manifest and intermediate results in. This must be on a filesystem
+        that is shared by all workers.
+    tile_size : float
+        The width and height of each tile (in the units of the point positions).
+    codec : numcodecs.abc.Codec
+        The compressor to use for the point chunks. Unlike `exportZA`, auto-tuning ('size' or 'speed') is not
+        supported, as each tile is compressed separately.
+    fingerprint : dict
+        A fingerprint of the input and arguments (see `rockhopper.clouds.fingerprintCloud`), stored in the manifest
+        such that a resumed job can check it is converting the same cloud (see `convertTiled`).
+
+    All other arguments (and keywords) are as for `exportZA`. N.B. duplicate points are culled within each tile, so
+    a few duplicates can remain along tile boundaries.
+
+    Returns
+    --------
+    The job manifest (a dictionary), which is also written to `job_path/manifest.json`.
+    """
+    assert (codec is None) or (not isinstance(codec, str)), "Error - codec auto-tuning is not supported for tiled conversion."
+    assert overviews >= 1, "Error - at least one overview chunk is needed"
+    columns = resolveColumns( columns, points.shape[1] )
+    catbands = findCategorical( points, columns, categorical )
+    dictionaries = {k : buildDictionary( points[:, b] ) for b, k in catbands.items()}
+    if stylesheet is None:
+        if points.shape[1] >= 6:
+            stylesheet = {'rgb':{'color':{'R':[3,0,1],'G':[4,0,1],'B':[5,0,1]}}}
+        else:
+            stylesheet = {'elev':{'color':(2, {'scale':'viridis', 'limits':'auto'})}}
+    if styles is None:
+        styles = list( stylesheet.keys() )
+    for k in styles:
+        assert k in stylesheet, "Style %s is not in the stylesheet?"%k
+
+    # carry normals along as extra bands (N.B. these are split off again after culling)
+    nbands = points.shape[1]
+    if normals is not None:
+        assert len(normals) == len(points), "Error - there must be one normal per point"
+        points = np.hstack([points, normals])
+
+    # remove the overview points (a stratified subsample of the whole cloud)
+    # N.B. these are merged into the overview chunks by `mergeTiles`
+    os.makedirs( os.path.join(job_path, 'tiles'), exist_ok=True )
+    n_overview = min( int(chunk_size) * overviews, len(points) )
+    order = progressiveOrder( points, resolution, count=n_overview )[:n_overview]
+    np.save( os.path.join(job_path, 'overview.npy'), points[order] )
+    mask = np.full( len(points), True )
+    mask[order] = False
+    points = points[mask]
+
+    # split remaining points into tiles
+    origin = np.mean( points[:,:3], axis=0 ).astype(int)
+    ij = np.floor( (points[:, :2] - np.min(points[:, :2], axis=0)) / tile_size ).astype(np.int64)
+    key = ij[:, 0] * (np.max(ij[:, 1]) + 1) + ij[:, 1]
+    tiles = []
+    for i, k in enumerate( np.unique(key) ):
+        t = points[ key == k ]
+        np.save( os.path.join(job_path, 'tiles', 't%04d.npy' % i), t )
+        tiles.append( dict( id=i, count=len(t),
+                            min=np.min(t[:, :3], axis=0).tolist(), max=np.max(t[:, :3], axis=0).tolist() ) )
+
+    manifest = dict( origin=[int(o) for o in origin],
+                     bands=int(nbands),
+                     tiles=tiles,
+                     chunk_size=int(chunk_size),
+                     resolution=resolution,
+                     stylesheet=stylesheet,
+                     styles=styles,
+                     codec=None if codec is None else codec.get_config(),
+                     progressive=progressive,
+                     block_size=block_size,
+                     normals=None if normals is None else int(normal_bits),
+                     preview=preview,
+                     preview_view=preview_view if isinstance(preview_view, str) else list(preview_view),
+                     overviews=overviews,
+                     columns=columns,
+                     catbands={str(b) : k for b, k in catbands.items()},
+                     dictionaries={k : dictionaryToJSON(v) for k, v in dictionaries.items()},
+                     fingerprint=fingerprint,
+                     kwds=kwds )
+    with open( os.path.join(job_path, 'manifest.json'), 'w' ) as f:
+        json.dump( manifest, f )
+    return manifest
+
+def claimTile(job_path, tile, timeout=3600):
+    """
+    Try to claim a tile for processing by (atomically) creating a lock file. Locks that have not been refreshed
+    (see `keepAlive`) for `timeout` seconds are assumed to belong to a crashed worker, and are taken over.
+
+    Returns
+    --------
+    True if the tile was claimed.
+    """
+    lock = os.path.join(job_path, 'locks', 't%04d.lock' % tile)
+    os.makedirs( os.path.dirname(lock), exist_ok=True )
+    for attempt in range(2):
+        try:
+            fd = os.open( lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY )
+            with os.fdopen(fd, 'w') as f:
+                json.dump( dict(host=socket.gethostname(), pid=os.getpid(), time=time.time()), f )
+            return True
+        except FileExistsError:
+            pass
+        if attempt > 0:
+            return False
+        try: # take over stale locks (N.B. rename is atomic, so only one worker can succeed)
+            if time.time() - os.stat(lock).st_mtime < timeout:
+                return False
+            stale = lock + '.%s.%d' % (socket.gethostname(), os.getpid())
+            os.rename( lock, stale )
+            if time.time() - os.stat(stale).st_mtime < timeout:
+                os.rename( stale, lock ) # another worker claimed it in the meantime; put it back
+                return False
+            os.remove( stale )
+        except OSError:
+            return False # another worker got there first
+    return False
+
+def keepAlive(job_path, tile, interval):
+    """
+    Refresh the modification time of a tile's lock every `interval` seconds (in a background thread), such that
+    other workers don't take over tiles that are slow to process (see `claimTile`).
+
+    Returns
+    --------
+    A threading.Event that stops the refreshing when set.
+    """
+    lock = os.path.join(job_path, 'locks', 't%04d.lock' % tile)
+    stop = threading.Event()
+    def run():
+        while not stop.wait(interval):
+            try:
+                os.utime(lock)
+            except OSError:
+                return # lock was removed
+    threading.Thread(target=run, daemon=True).start()
+    return stop
+
+def processTile(job_path, tile, manifest=None):
+    """
+    Cull, partition and write the chunks of one tile. Chunks are written to `job_path/parts/tNNNN.zarr`
+    (relative to the stream's origin) and a summary (chunk centers, category presence and band statistics)
+    is written to `job_path/done` once the tile is complete.
+    """
+    import zarr
+    from sklearn.cluster import MiniBatchKMeans
+    if manifest is None:
+        manifest = readManifest(job_path)
+    catbands = {int(b) : k for b, k in manifest['catbands'].items()}
+    dictionaries = {k : np.array(v, dtype=np.float32) for k, v in manifest['dictionaries'].items()}
+    resolution = manifest['resolution']
+
+    points = np.load( os.path.join(job_path, 'tiles', 't%04d.npy' % tile) )
+    points = cullPoints( points, resolution, keep=list(catbands) )
+    points, normals = points[:, :manifest['bands']], points[:, manifest['bands']:]
+
+    # partition into chunks
+    nchunks = max(1, int(round( len(points) / manifest['chunk_size'] )))
+    if nchunks > 1:
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", category=RuntimeWarning)
+            sc = MiniBatchKMeans( n_clusters=nchunks, tol=0.1, n_init='auto', random_state=tile )
+            cid = sc.fit_predict( points[:, :3] )
+    else:
+        cid = np.zeros( len(points), dtype=int )
+
+    codecs = getCodecs(manifest)
+
+    # write chunks (to a temporary location, in case we crash)
+    final = os.path.join(job_path, 'parts', 't%04d.zarr' % tile)
+    tmp = final + '.%s.%d.tmp' % (socket.gethostname(), os.getpid())
+    z = zarr.open_group(tmp, mode='w')
+    stats = BandStats( points.shape[1], seed=tile )
+    centers = []
+    presence = {k : [] for k in dictionaries}
+    for i, ix in enumerate( np.unique(cid) ):
+        c = writeTileChunk( z, i, points[ cid == ix, : ], normals[ cid == ix, : ], manifest, codecs, presence )
+        centers.append( np.mean(c, axis=0).tolist() )
+        stats.update( c )
+    if os.path.exists(final):
+        shutil.rmtree(final) # left over from a crashed attempt
+    os.replace( tmp, final )
+
+    # record that this tile is done
+    os.makedirs( os.path.join(job_path, 'done'), exist_ok=True )
+    stats.save( os.path.join(job_path, 'done', 't%04d.npz' % tile) )
+    done = os.path.join(job_path, 'done', 't%04d.json' % tile)
+    with open( done + '.tmp', 'w' ) as f:
+        json.dump( dict( tile=tile, total=len(points), centers=centers, presence=presence,
+                         host=socket.gethostname(), pid=os.getpid() ), f )
+    os.replace( done + '.tmp', done )
+
+def writeTileChunk(z, index, points, normals, manifest, codecs, presence):
+    """
+    Write one chunk of a tiled conversion (as for `exportZA`), and return its (float32, origin relative) points.
+    """
+    c = points.copy()
+    c[:,:3] -= np.array(manifest['origin'])
+    c = c.astype(np.float32)
+    if manifest['progressive']:
+        o = progressiveOrder( c, manifest['resolution'] )
+        c, normals = c[ o ], normals[ o ]
+    dictionaries = {k : np.array(v, dtype=np.float32) for k, v in manifest['dictionaries'].items()}
+    arrays = splitChunk( c, manifest['columns'], dictionaries )
+    for k in dictionaries: # record which categories occur in this chunk
+        presence[k].append( np.unique(arrays[k]).tolist() )
+    writeChunk( z, index, arrays, codecs, manifest['block_size'] )
+    if manifest['normals'] is not None:
+        writeNormals( z, index, normals, manifest['columns'] is not None, manifest['normals'], manifest['block_size'] )
+    return c
+
+def getCodecs(manifest):
+    """
+    Get the `(compressor, filters)` to use for each array of a tiled conversion (as for `exportZA`).
+    """
+    from numcodecs import Blosc, get_codec
+    keys = [None] if manifest['columns'] is None else list(manifest['columns'].keys())
+    if manifest['codec'] is not None:
+        return {k : (get_codec(manifest['codec']), None) for k in keys}
+    codecs = {k : (Blosc(cname="zstd", clevel=3, shuffle=Blosc.SHUFFLE), None) for k in keys}
+    for k in manifest['dictionaries']: # bitshuffle is much better for small integer codes
+        codecs[k] = (Blosc(cname="zstd", clevel=3, shuffle=Blosc.BITSHUFFLE), None)
+    return codecs
+
+def readManifest(job_path):
+    with open( os.path.join(job_path, 'manifest.json'), 'r' ) as f:
+        return json.load(f)
+
+def isDone(job_path, tile):
+    return os.path.exists( os.path.join(job_path, 'done', 't%04d.json' % tile) )
+
+def runWorker(job_path, timeout=3600):
+    """
+    Process tiles from the specified job until none remain unclaimed. Several workers can be run at once
+    (on one or more machines), and re-running workers after a crash resumes the job.
+
+    Parameters
+    ----------
+    job_path : str
+        The job directory (see `planTiles`).
+    timeout : float
+        The age (in seconds) after which the lock of an unfinished tile is assumed to belong to a crashed worker.
+        Locks of tiles being processed are refreshed several times within this period (see `keepAlive`).
+
+    Returns
+    --------
+    The number of tiles processed by this worker.
+    """
+    manifest = readManifest(job_path)
+    n = 0
+    for t in manifest['tiles']:
+        if isDone(job_path, t['id']) or (not claimTile(job_path, t['id'], timeout=timeout)):
+            continue
+        if isDone(job_path, t['id']):
+            continue # finished while we were claiming it
+        stop = keepAlive(job_path, t['id'], timeout / 4)
+        try:
+            processTile(job_path, t['id'], manifest)
+        finally:
+            stop.set()
+        n += 1
+    return n
+
+def mergeTiles(job_path, zarr_store_path, cleanup=False):
+    """
+    Merge the processed tiles of a job into a single stream (with the same format as `exportZA`).
+
+    Parameters
+    ----------
+    job_path : str
+        The job directory (see `planTiles`). All tiles must have been processed (see `runWorker`).
+    zarr_store_path : str
+        Path to the Zarr store to create (or overwrite).
+    cleanup : bool
+        True if the job directory should be deleted once the stream has been created.
+    """
+    import zarr
+    from numcodecs import Blosc
+    manifest = readManifest(job_path)
+    missing = [t['id'] for t in manifest['tiles'] if not isDone(job_path, t['id'])]
+    assert len(missing) == 0, "Error - %d tiles have not been processed yet (see `runWorker`)." % len(missing)
+    columns = manifest['columns']
+    kwds = manifest['kwds']
+    chunk_size = manifest['chunk_size']
+    resolution = manifest['resolution']
+    dictionaries = {k : np.array(v, dtype=np.float32) for k, v in manifest['dictionaries'].items()}
+    catbands = {int(b) : k for b, k in manifest['catbands'].items()}
+
+    # build the overview chunks
+    overview = np.load( os.path.join(job_path, 'overview.npy') )
+    overview = cullPoints( overview, resolution, keep=list(catbands) )
+    overview = overview[ progressiveOrder( overview, resolution ) ]
+    overview, normals = overview[:, :manifest['bands']], overview[:, manifest['bands']:]
+    codecs = getCodecs(manifest)
+    z = zarr.open_group(zarr_store_path, mode='w')
+    stats = BandStats( manifest['bands'] )
+    centers = []
+    presence = {k : [] for k in dictionaries}
+    nov = 0
+    for i in range( manifest['overviews'] ):
+        c = overview[ i*chunk_size : (i+1)*chunk_size ]
+        if len(c) == 0:
+            break
+        c = writeTileChunk( z, i, c, normals[ i*chunk_size : (i+1)*chunk_size ], manifest, codecs, presence )
+        centers.append( np.mean(c, axis=0) )
+        stats.update( c )
+        nov += 1
+
+    # copy the chunks of each tile (renumbering them as we go)
+    total = len(overview)
+    n = nov
+    for t in manifest['tiles']:
+        with open( os.path.join(job_path, 'done', 't%04d.json' % t['id']), 'r' ) as f:
+            done = json.load(f)
+        part = os.path.join(job_path, 'parts', 't%04d.zarr' % t['id'])
+        for i in range( len(done['centers']) ):
+            shutil.copytree( os.path.join(part, 'c%d' % i), os.path.join(zarr_store_path, 'c%d' % n) )
+            if os.path.exists( os.path.join(part, 'n%d' % i) ): # normals (rows layout)
+                shutil.copytree( os.path.join(part, 'n%d' % i), os.path.join(zarr_store_path, 'n%d' % n) )
+            n += 1
+        centers += [np.array(c) for c in done['centers']]
+        for k in dictionaries:
+            presence[k] += done['presence'][k]
+        stats.merge( BandStats.load( os.path.join(job_path, 'done', 't%04d.npz' % t['id']) ) )
+        total += done['total']
+
+    # write attributes (as for `exportZA`)
+    stylesheet = manifest['stylesheet']
+    styles = manifest['styles']
+    z.attrs.update({"origin": manifest['origin'],
+                    "resolution" : resolution,
+                    "total" : int(total),
+                    "chunks" : n,
+                    "styles" : styles,
+                    "stylesheet" : fitStyles( stylesheet, stats ),
+                    "progressive" : manifest['progressive'],
+                    "overviews" : nov,
+                    "layout" : "rows" if columns is None else "columns",
+                    "stats" : stats.toDict(),
+                    "tiles" : len(manifest['tiles']),
+                    **kwds })
+    if columns is not None:
+        def lookup(bands):
+            return ['xyz'] + [k for k, v in columns.items() if (k != 'xyz') and (len(set(v) & set(bands)) > 0)]
+        z.attrs['columns'] = columns
+        z.attrs['style_columns'] = {k : lookup(styleBands(stylesheet[k])) for k in styles}
+        if 'groups' in kwds:
+            z.attrs['group_columns'] = {k : lookup(styleBands(v)) for k, v in kwds['groups'].items()}
+    if manifest['block_size'] is not None:
+        z.attrs['block_size'] = int(manifest['block_size'])
+    if manifest['normals'] is not None:
+        z.attrs['normals'] = normalAttrs( columns is not None, manifest['normals'] )
+    if len(dictionaries) > 0:
+        z.attrs['categorical'] = {k : dict( band=columns[k][0],
+                                            dtype=np.dtype(np.uint8 if len(v) <= 256 else np.uint16).name,
+                                            dictionary=dictionaryToJSON(v),
+                                            presence=presence[k] ) for k, v in dictionaries.items() }
+        if 'groups' in kwds:
+            z.attrs['group_chunks'] = groupChunks( kwds['groups'], z.attrs['categorical'] )
+
+    # Save chunk-centers
+    centers = np.array(centers, dtype=np.float32)
+    _ = z.create_dataset(
+        name="chunk_centers",
+        data=centers,
+        shape=centers.shape,
+        chunks=(centers.shape[0], centers.shape[1]),
+        dtype=centers.dtype,
+        compressor=Blosc(cname="zstd", clevel=3, shuffle=Blosc.SHUFFLE)
+    )
+    if manifest.get('preview', None) is not None:
+        writePreview( zarr_store_path, size=manifest['preview'], view=manifest.get('preview_view', 'auto') )
+    if cleanup:
+        shutil.rmtree(job_path)
+
+def convertTiled(points, zarr_store_path, job_path=None, workers=4, tile_size=100.0, cleanup=True, blob_store=None,
+                 timeout=3600, **kwds):
+    """
+    Convert a point cloud to a streamable zarr dataset using several local worker processes (see `planTiles`,
+    `runWorker` and `mergeTiles`). If the job directory already contains a manifest (e.g., because a previous
+    conversion crashed), the job is resumed rather than re-planned, unless it was planned for a different
+    cloud or different arguments (in which case it is restarted).
+
+    Parameters
+    ----------
+    points : np.ndarray | None
+        Shape (N, d) array of points to convert. Can be None when resuming an existing job.
+    zarr_store_path : str
+        Path to the Zarr store to create.
+    job_path : str
+        The job directory. Defaults to `zarr_store_path` with a `.job` extension.
+    workers : int
+        The number of local worker processes to use. More workers (e.g., on other machines) can join the job
+        by calling `runWorker(job_path)`.
+    tile_size : float
+        The width and height of each tile (see `planTiles`).
+    cleanup : bool
+        True (default) if the job directory should be deleted once the stream has been created.
+    blob_store : str
+        If not None, chunk payloads are moved into this shared blob store (see `rockhopper.clouds.storeBlobs`).
+    timeout : float
+        The time (in seconds) after which tiles claimed by a worker that stopped responding are taken over
+        (see `runWorker`).
+
+    Keywords
+    ---------
+    All other keywords are passed to `planTiles` (and have the same meaning as for `exportZA`).
+    """
+    import multiprocessing
+    if job_path is None:
+        job_path = os.path.splitext( str(zarr_store_path) )[0] + '.job'
+    fingerprint = None
+    if points is not None:
+        fingerprint = fingerprintCloud( points, tile_size=tile_size, **kwds )
+        if os.path.exists( os.path.join(job_path, 'manifest.json') ) and \
+                (readManifest(job_path).get('fingerprint', None) != fingerprint):
+            print("Restarting %s (planned for a different cloud or arguments)" % job_path)
+            shutil.rmtree( job_path )
+    if not os.path.exists( os.path.join(job_path, 'manifest.json') ):
+        assert points is not None, "Error - no existing job to resume at %s" % job_path
+        manifest = planTiles( points, job_path, tile_size=tile_size, fingerprint=fingerprint, **kwds )
+        print("Split cloud into %d tiles" % len(manifest['tiles']))
+    if workers > 1:
+        procs = [multiprocessing.Process( target=runWorker, args=(job_path, timeout) ) for i in range(workers)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+    runWorker( job_path, timeout=timeout ) # N.B. also picks up anything the processes failed to finish
+    mergeTiles( job_path, zarr_store_path, cleanup=cleanup )
+    if blob_store is not None:
+        storeBlobs( zarr_store_path, blob_store )
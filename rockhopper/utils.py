@@ -107,4 +107,23 @@ def equirect_to_latlon( output_path, front, right, back, left, top, bottom ):
 
     # Save the final panorama
     Image.fromarray(output).save(output_path)
-    print("Saved equirectangular image to %s"%output_path)
\ No newline at end of file
+    print("Saved equirectangular image to %s"%output_path)
+
+def writePNG( path, image ):
+    """
+    Write an (h, w, 3) RGB or (h, w, 4) RGBA uint8 image to a PNG file. This only uses the standard library,
+    so (unlike `equirect_to_latlon`) does not need Pillow.
+    """
+    import zlib
+    import struct
+    image = np.ascontiguousarray( image, dtype=np.uint8 )
+    h, w, c = image.shape
+    assert c in [3, 4], "Error - image must have 3 (RGB) or 4 (RGBA) channels"
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    raw = np.hstack( [np.zeros((h, 1), dtype=np.uint8), image.reshape(h, w*c)] ) # filter type 0 for each row
+    with open(path, 'wb') as f:
+        f.write( b'\x89PNG\r\n\x1a\n' )
+        f.write( chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 6 if c == 4 else 2, 0, 0, 0)) )
+        f.write( chunk(b'IDAT', zlib.compress(raw.tobytes(), 9)) )
+        f.write( chunk(b'IEND', b'') )
@@ -16,5 +16,6 @@ setup(
     package_data = {"":["*.html",
                         "*.css","*.css.map","*.md",
                         "*.js","*.js.map","*.com",
-                        "*.png","*.json","*.txt"]}
+                        "*.png","*.json","*.txt"]},
+    entry_points = {"console_scripts":["rockhopper=rockhopper.cli:main"]}
 )
\ No newline at end of file
@@ -0,0 +1,37 @@
+import os
+import shutil
+import numpy as np
+from rockhopper.clouds import exportZA, readPoints, storeBlobs, pruneBlobs
+
+def cloud():
+    xy = np.mgrid[0:30:0.5, 0:20:0.5].reshape(2, -1).T
+    return np.c_[xy, np.sin(xy[:, 0] / 5), np.random.default_rng(0).uniform(0, 1, (len(xy), 3))]
+
+def count(path):
+    return sum( len(f) for _, _, f in os.walk(path) )
+
+def test_dedupe_and_prune(tmp_path):
+    blobs = str(tmp_path / 'blobs')
+    a, b = str(tmp_path / 'a.zarr'), str(tmp_path / 'b.zarr')
+    for pth in [a, b]:
+        exportZA( cloud(), pth, chunk_size=500, resolution=0.2, preview=None )
+    ref = [readPoints(a, i) for i in range(3)]
+
+    # the second (identical) stream adds no new blobs
+    first = storeBlobs( a, blobs )
+    assert first['new'] == first['files'] == count(blobs) and first['saved'] == 0
+    second = storeBlobs( b, blobs )
+    assert second['new'] == 0 and second['saved'] > 0
+    assert count(blobs) == first['files']
+    for i in range(3):
+        assert np.array_equal( readPoints(b, i), ref[i] )
+    assert storeBlobs( b, blobs )['saved'] == 0 # already linked
+
+    # blobs are only pruned once no stream links them
+    shutil.rmtree( a )
+    assert pruneBlobs( blobs ) == 0
+    for i in range(3):
+        assert np.array_equal( readPoints(b, i), ref[i] )
+    shutil.rmtree( b )
+    assert pruneBlobs( blobs ) > 0
+    assert count(blobs) == 0
@@ -0,0 +1,41 @@
+import numpy as np
+from rockhopper.epochs import exportEpochs, readEpoch
+from rockhopper.clouds import readPoints
+
+def grid(seed=0):
+    rng = np.random.default_rng(seed)
+    xy = np.mgrid[0:40:0.5, 0:20:0.5].reshape(2, -1).T
+    return np.c_[xy, np.sin(xy[:, 0] / 5), rng.uniform(0, 1, (len(xy), 3))]
+
+def test_identical_epochs_have_no_deltas(tmp_path):
+    base = grid()
+    info = exportEpochs( [base, base.copy()], str(tmp_path / 'a.zarr'), chunk_size=800, resolution=0.2, preview=None )
+    delta = info['deltas']['e1']
+    assert (delta['added'], delta['removed'], delta['changed']) == (0, 0, 0)
+    assert delta['chunks'] == []
+
+def test_one_altered_chunk_gives_one_delta(tmp_path):
+    pth = str(tmp_path / 'a.zarr')
+    base = grid()
+    exportEpochs( [base], pth, chunk_size=800, resolution=0.2, preview=None )
+    import zarr
+    attrs = zarr.open_group(pth, mode='r').attrs.asdict()
+
+    # recolour the points in one (non-overview) chunk
+    i = attrs['overviews'] + 1
+    xy = readPoints( pth, i )[:, :2] + np.array(attrs['origin'][:2]) # N.B. z is rounded to the resolution
+    epoch = base.copy()
+    hit = np.zeros( len(epoch), dtype=bool )
+    for p in xy:
+        hit |= np.all( np.abs(epoch[:, :2] - p) < 1e-3, axis=1 )
+    epoch[hit, 3] = 0.123
+    info = exportEpochs( [base, epoch], pth, chunk_size=800, resolution=0.2, preview=None )
+    delta = info['deltas']['e1']
+    assert delta['chunks'] == [i]
+    assert (delta['added'], delta['removed'], delta['changed']) == (0, 0, hit.sum())
+
+    # and the epoch is reconstructed from the base and delta
+    c = readEpoch( pth, 'e1', i )
+    assert len(c) == len(xy)
+    assert np.allclose( c[:, 3], 0.123 )
+    assert np.array_equal( readEpoch( pth, 'e1', i - 1 ), readPoints( pth, i - 1 ) )
@@ -0,0 +1,60 @@
+import json
+import numpy as np
+from scipy.spatial import KDTree
+from rockhopper.clouds import exportZA, readChunk, readPoints
+
+def cloud(n=6000, seed=0):
+    rng = np.random.default_rng(seed)
+    xy = np.mgrid[0:60:0.5, 0:25:0.5].reshape(2, -1).T[:n]
+    return np.c_[xy, np.cos(xy[:, 0] / 7), rng.uniform(0, 1, (len(xy), 3))]
+
+def test_export_and_read(tmp_path):
+    pth = str(tmp_path / 'a.zarr')
+    pts = cloud()
+    exportZA( pts, pth, chunk_size=1000, resolution=0.2, preview=None )
+    attrs = json.load( open(tmp_path / 'a.zarr' / '.zattrs') )
+    out = np.vstack( [readChunk(pth, i) for i in range(attrs['chunks'])] )
+    assert len(out) == attrs['total'] == len(pts) # N.B. no duplicates at this resolution
+    out[:, :3] += attrs['origin']
+    order = np.lexsort( out[:, :2].T )
+    ref = pts[ np.lexsort( pts[:, :2].T ) ]
+    assert np.allclose( out[order, :2], ref[:, :2], atol=1e-4 )
+    assert np.allclose( out[order, 3:], ref[:, 3:], atol=1e-6 )
+
+def test_columns_layout_matches_rows(tmp_path):
+    pts = cloud()
+    exportZA( pts.copy(), str(tmp_path / 'rows.zarr'), chunk_size=1000, resolution=0.2, preview=None )
+    exportZA( pts.copy(), str(tmp_path / 'cols.zarr'), chunk_size=1000, resolution=0.2, columns=True, preview=None )
+    for i in range(3):
+        assert np.array_equal( readPoints(str(tmp_path / 'rows.zarr'), i), readPoints(str(tmp_path / 'cols.zarr'), i) )
+
+def test_codec_filters_only_quantise_positions(tmp_path):
+    pts = cloud()
+    for columns in [None, True]:
+        pth = str(tmp_path / ('a%s.zarr' % columns))
+        exportZA( pts.copy(), pth, chunk_size=1000, resolution=0.2, codec='size', codec_filters=True,
+                  columns=columns, preview=None )
+        attrs = json.load( open(pth + '/.zattrs') )
+        out = np.vstack( [readPoints(pth, i) for i in range(attrs['chunks'])] )
+        d, ix = KDTree( pts[:, :2] ).query( out[:, :2] + attrs['origin'][:2] )
+        assert np.max(d) < 0.1 # positions are quantised to the resolution
+        assert np.allclose( out[:, 3:], pts[ix, 3:], atol=1e-6 ) # but attributes are lossless
+
+def classified(seed=0):
+    pts = cloud(seed=seed)
+    pts[:, 3] = np.arange(len(pts)) % 5
+    pts[::7, 3] = np.nan # unclassified points
+    return pts
+
+def test_categorical_bands_with_nan(tmp_path):
+    pth = str(tmp_path / 'a.zarr')
+    pts = classified()
+    exportZA( pts.copy(), pth, chunk_size=1000, resolution=0.2, categorical='auto', preview=None,
+              columns={'xyz' : [0, 1, 2], 'cls' : [3], 'gb' : [4, 5]} )
+    def strict(c):
+        raise ValueError("%s is not valid json" % c)
+    attrs = json.load( open(pth + '/.zattrs'), parse_constant=strict ) # N.B. no NaN in the stats or styles
+    assert attrs['categorical']['cls']['dictionary'] == [0, 1, 2, 3, 4, None]
+    out = np.vstack( [readPoints(pth, i) for i in range(attrs['chunks'])] )
+    assert np.sum( np.isnan(out[:, 3]) ) == np.sum( np.isnan(pts[:, 3]) )
+    assert np.array_equal( np.unique(out[:, 3][~np.isnan(out[:, 3])]), np.arange(5) )
@@ -0,0 +1,60 @@
+import os
+import json
+import numpy as np
+from rockhopper.server import VFT
+
+def cloud(seed=0):
+    rng = np.random.default_rng(seed)
+    xy = np.mgrid[0:30:0.5, 0:20:0.5].reshape(2, -1).T
+    cls = (xy[:, 0] // 10) % 3 # classes in stripes, so not every chunk has every class
+    return np.c_[xy, np.zeros(len(xy)), rng.uniform(0, 1, (len(xy), 3)), cls]
+
+ARGS = dict( chunk_size=500, resolution=0.2, preview=None, categorical=[6],
+             columns={'xyz' : [0, 1, 2], 'rgb' : [3, 4, 5], 'cls' : [6]} )
+
+def payloads(pth):
+    out = {}
+    for dirpath, _, files in os.walk(pth):
+        for f in files:
+            if not f.startswith('.'):
+                st = os.stat( os.path.join(dirpath, f) )
+                out[os.path.join(dirpath, f)] = (st.st_ino, st.st_mtime_ns)
+    return out
+
+def attrs(pth):
+    return json.load( open(os.path.join(pth, '.zattrs')) )
+
+def test_unchanged_clouds_are_not_rewritten(tmp_path):
+    vft = VFT( str(tmp_path / 'vft'), cloud_path=str(tmp_path / 'clouds'), write_delay=0 )
+    pth = str(tmp_path / 'clouds' / 'a.zarr')
+    groups = {'g' : {'iq' : [6, '=', 1], 'color' : [1, 0, 0], 'blend' : 0.5}}
+    vft.addCloud( 'a', 'a', cloud(), groups=groups, **ARGS )
+    before, first = payloads(pth), attrs(pth)
+    assert 'g' in first['group_chunks']
+
+    # same input and arguments; nothing changes
+    vft.addCloud( 'a', 'a', cloud(), groups=groups, **ARGS )
+    assert payloads(pth) == before and attrs(pth) == first
+
+    # new styles and no groups; only the attributes change
+    stylesheet = {'cls' : {'color' : (6, {'scale' : 'viridis', 'limits' : 'auto'})}}
+    vft.addCloud( 'a', 'a', cloud(), stylesheet=stylesheet, **ARGS )
+    assert payloads(pth) == before
+    a = attrs(pth)
+    assert a['styles'] == ['cls'] and a['style_columns'] == {'cls' : ['xyz', 'cls']}
+    assert not any( k in a for k in ['groups', 'group_columns', 'group_chunks'] )
+    assert a['fingerprint']['style'] != first['fingerprint']['style']
+
+    # new groups are matched to the chunks that contain them
+    groups = {'h' : {'iq' : [6, '=', 2], 'color' : [0, 1, 0], 'blend' : 0.5}}
+    vft.addCloud( 'a', 'a', cloud(), stylesheet=stylesheet, groups=groups, **ARGS )
+    assert payloads(pth) == before
+    a = attrs(pth)
+    code = a['categorical']['cls']['dictionary'].index(2)
+    expected = [i for i, p in enumerate(a['categorical']['cls']['presence']) if code in p]
+    assert a['group_chunks'] == {'h' : {'iq' : expected}} and 0 < len(expected) < a['chunks']
+    assert a['group_columns'] == {'h' : ['xyz', 'cls']}
+
+    # changing an export argument re-chunks the stream
+    vft.addCloud( 'a', 'a', cloud(), stylesheet=stylesheet, groups=groups, **dict(ARGS, chunk_size=400) )
+    assert payloads(pth) != before and attrs(pth)['chunks'] != a['chunks']
@@ -0,0 +1,34 @@
+import json
+import os
+from werkzeug.test import Client
+from rockhopper.server import VFT
+from rockhopper.hosting import TourHost
+
+def tour(path):
+    VFT( path, write_delay=0 ).flush()
+    return path
+
+def test_mount_redirect_and_reload(tmp_path):
+    config = tmp_path / 'tours.json'
+    a, b = tour(str(tmp_path / 'a')), tour(str(tmp_path / 'b'))
+    host = TourHost( tours={'a' : a}, config=str(config), reload_interval=0, write_delay=0 )
+    client = Client( host )
+    assert client.get('/').get_json() == {'a' : '/a/'}
+
+    # tours are served below their prefix, and need a trailing slash (as the viewer uses relative paths)
+    r = client.get('/a/')
+    assert r.status_code == 200 and b'<html' in r.data.lower()
+    assert client.get('/a/index.json').get_json()['languages'] == ['en']
+    r = client.get('/a?site=x')
+    assert r.status_code == 308 and r.headers['Location'].endswith('/a/?site=x')
+    assert client.get('/b/').status_code == 404
+
+    # tours in the config file are mounted and unmounted when it changes
+    config.write_text( json.dumps({'b' : {'vft_path' : b}}) )
+    assert client.get('/').get_json() == {'a' : '/a/', 'b' : '/b/'}
+    assert client.get('/b/index.json').status_code == 200
+    config.write_text( json.dumps({}) )
+    st = os.stat(config)
+    os.utime( config, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9) ) # N.B. in case the clock is coarse
+    assert client.get('/').get_json() == {'a' : '/a/'} # (static tours stay mounted)
+    assert client.get('/b/index.json').status_code == 404
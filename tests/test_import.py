@@ -0,0 +1,29 @@
+import os
+import sys
+import json
+import subprocess
+
+HEAVY = ['flask', 'flask_cors', 'zarr', 'numcodecs', 'sklearn', 'scipy', 'tqdm']
+BUDGET = 0.5 # seconds allowed for `import rockhopper`
+
+def run(code):
+    root = os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) )
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    out = subprocess.run( [sys.executable, '-c', code], capture_output=True, text=True, env=env, check=True )
+    return json.loads( out.stdout.strip().splitlines()[-1] )
+
+def test_import_is_lazy_and_fast():
+    out = run( "import sys, time, json\n"
+               "t0 = time.perf_counter()\n"
+               "import rockhopper\n"
+               "t = time.perf_counter() - t0\n"
+               f"print(json.dumps(dict(seconds=t, loaded=[m for m in {HEAVY!r} if m in sys.modules])))" )
+    assert out['loaded'] == []
+    assert out['seconds'] < BUDGET
+
+def test_loadPLY_does_not_load_server():
+    out = run( "import sys, json\n"
+               "import rockhopper\n"
+               "rockhopper.loadPLY\n"
+               f"print(json.dumps(dict(loaded=[m for m in {HEAVY!r} if m in sys.modules])))" )
+    assert out['loaded'] == []
@@ -0,0 +1,51 @@
+import json
+import time
+import threading
+from rockhopper.server import VFT
+from rockhopper.live import ChangeWatcher
+
+def read(it, timeout=5.0):
+    """Get the next message from a streamed response (failing rather than hanging if none arrives)."""
+    out = []
+    t = threading.Thread( target=lambda: out.append(next(it)), daemon=True )
+    t.start()
+    t.join(timeout)
+    assert len(out) == 1, "no event received"
+    return out[0].decode() if isinstance(out[0], bytes) else out[0]
+
+def wait(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.02)
+
+def test_changes_are_pushed_to_clients(tmp_path):
+    vft = VFT( str(tmp_path / 'vft'), cloud_path=str(tmp_path / 'clouds'), write_delay=0 )
+    vft.flush()
+    watcher = vft.watcher = ChangeWatcher( vft.vft_path, vft.cloud_path, interval=0.05 )
+    r = vft.app.test_client().get('/events')
+    assert r.status_code == 200 and r.mimetype == 'text/event-stream'
+    it = iter(r.response)
+    assert read(it).startswith('retry:')
+    wait( lambda: watcher.thread is not None )
+
+    # one change gives one event, describing what changed
+    with open(tmp_path / 'vft' / 'md' / 'help_en.md', 'a') as f:
+        f.write('More help.')
+    msg = read(it)
+    assert msg.startswith('data: ') and msg.endswith('\n\n')
+    assert json.loads(msg[6:]) == dict( file='md/help_en.md', kind='markdown', sites=None, tabs=['Help'] )
+    time.sleep(0.3) # several polls
+    assert all( q.empty() for q in watcher.subscribers )
+
+    with open(tmp_path / 'vft' / 'annotations.json', 'w') as f:
+        json.dump({'s1' : {'lines' : [], 'planes' : [], 'traces' : []}}, f)
+    assert json.loads(read(it)[6:]) == dict( file='annotations.json', kind='annotations', sites=None )
+
+    # polling stops once the client disconnects
+    r.close()
+    assert watcher.subscribers == []
+    wait( lambda: watcher.thread is None )
+    q = watcher.subscribe() # and restarts for new clients
+    assert watcher.thread is not None
+    watcher.unsubscribe(q)
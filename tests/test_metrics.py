@@ -0,0 +1,49 @@
+import os
+import pytest
+from rockhopper.metrics import Metrics, routeName
+from rockhopper.server import VFT
+
+def parse(text):
+    """Parse the Prometheus text format into `{'name{labels}' : value}`."""
+    out = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            key, value = line.rsplit(' ', 1)
+            out[key] = float(value)
+    return out
+
+def test_latency_buckets():
+    m = Metrics()
+    env = {'SCRIPT_NAME' : '/tour', 'PATH_INFO' : '/index.json'}
+    for seconds in [0.005, 0.0051, 0.01, 0.3, 20.0]: # N.B. a bucket includes its upper bound (le)
+        m.in_flight += 1
+        m.finish( env, '200', seconds, 10 )
+    out = parse( m.render() )
+    def bucket(le):
+        return out['rockhopper_request_duration_seconds_bucket{tour="tour",route="index.json",le="%s"}' % le]
+    assert [bucket(le) for le in ['0.005', '0.01', '0.25', '0.5', '10.0', '+Inf']] == [1, 3, 3, 4, 4, 5]
+    assert out['rockhopper_request_duration_seconds_count{tour="tour",route="index.json"}'] == 5
+    assert out['rockhopper_request_duration_seconds_sum{tour="tour",route="index.json"}'] == pytest.approx(20.3201)
+    assert out['rockhopper_requests_total{tour="tour",route="index.json",status="200"}'] == 5
+    assert out['rockhopper_response_bytes_total{tour="tour",route="index.json"}'] == 50
+    assert out['rockhopper_requests_in_flight'] == 0
+
+def test_stream_bytes_per_site(tmp_path):
+    m = Metrics( chunks=True )
+    vft = VFT( str(tmp_path / 'vft'), cloud_path=str(tmp_path / 'clouds'), write_delay=0, metrics=m )
+    for stream, size in [('a.zarr', 100), ('b.zarr', 30)]:
+        os.makedirs( tmp_path / 'clouds' / stream / 'c0' )
+        open( tmp_path / 'clouds' / stream / 'c0' / '0.0', 'wb' ).write( b'x' * size )
+    vft.addSite( 'site_a', './a.zarr' )
+    client = vft.app.test_client()
+    assert routeName('/a.zarr/c0/0.0') == 'chunk'
+    for url in ['/a.zarr/c0/0.0', '/a.zarr/c0/0.0', '/b.zarr/c0/0.0']:
+        r = client.get(url)
+        assert r.status_code == 200
+        r.close()
+    out = parse( client.get('/metrics').get_data(as_text=True) )
+    assert out['rockhopper_stream_bytes_total{tour="",stream="a.zarr",site="site_a"}'] == 200
+    assert out['rockhopper_stream_bytes_total{tour="",stream="b.zarr",site=""}'] == 30 # not used by any site
+    assert out['rockhopper_chunk_bytes_total{tour="",stream="a.zarr",chunk="0"}'] == 200
+    assert out['rockhopper_requests_total{tour="",route="chunk",status="200"}'] == 3
+    assert out['rockhopper_response_bytes_total{tour="",route="chunk"}'] == 230
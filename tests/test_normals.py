@@ -0,0 +1,35 @@
+import json
+import numpy as np
+import pytest
+from rockhopper.clouds import encodeNormals, decodeNormals, exportZA, readPoints, readNormals
+
+def angles(a, b):
+    return np.rad2deg( np.arccos( np.clip( np.sum(a * b, axis=1), -1, 1 ) ) )
+
+@pytest.mark.parametrize('bits, tol', [(8, 1.0), (16, 0.02)])
+def test_encode_decode_round_trip(bits, tol):
+    n = np.random.default_rng(0).normal(size=(5000, 3))
+    n = np.vstack( [n, np.eye(3), -np.eye(3)] ) # include the folds of the octahedron
+    n /= np.linalg.norm(n, axis=1)[:, None]
+    codes = encodeNormals( n, bits )
+    assert codes.shape == (len(n), 2) and codes.dtype == (np.uint8 if bits == 8 else np.uint16)
+    out = decodeNormals( codes, bits )
+    assert np.allclose( np.linalg.norm(out, axis=1), 1, atol=1e-5 )
+    assert np.max( angles(out, n) ) < tol
+
+@pytest.mark.parametrize('columns', [None, True])
+def test_export_normals(tmp_path, columns):
+    xy = np.mgrid[0:30:0.5, 0:20:0.5].reshape(2, -1).T
+    pts = np.c_[xy, np.zeros(len(xy)), np.ones((len(xy), 3))]
+    def normal(xy): # a known normal at each position
+        n = np.c_[np.sin(xy[:, 0] / 5), np.cos(xy[:, 1] / 5), np.ones(len(xy))]
+        return n / np.linalg.norm(n, axis=1)[:, None]
+    pth = str(tmp_path / 'a.zarr')
+    exportZA( pts, pth, chunk_size=500, resolution=0.2, normals=normal(xy), columns=columns, preview=None )
+    attrs = json.load( open(pth + '/.zattrs') )
+    assert attrs['normals']['bits'] == 16
+    for i in range( attrs['chunks'] ):
+        p = readPoints( pth, i )
+        n = readNormals( pth, i )
+        assert n.shape == (len(p), 3)
+        assert np.max( angles(n, normal(p[:, :2] + attrs['origin'][:2])) ) < 0.05
@@ -0,0 +1,35 @@
+import json
+import numpy as np
+from scipy.spatial import KDTree
+from rockhopper.clouds import exportZA, readPoints
+
+def cloud(seed=0):
+    rng = np.random.default_rng(seed)
+    dense = rng.uniform(0, 10, (18000, 2)) # N.B. much denser than the sparse block
+    sparse = rng.uniform(0, 10, (500, 2)) + [30, 0]
+    xy = np.vstack([dense, sparse])
+    return np.c_[xy, rng.uniform(0, 0.01, len(xy)), rng.uniform(0, 1, (len(xy), 3))]
+
+def overviews(pth):
+    attrs = json.load( open(pth + '/.zattrs') )
+    return [readPoints(pth, i)[:, :3] + attrs['origin'] for i in range(attrs['overviews'])]
+
+def test_overviews_are_stratified_and_deterministic(tmp_path):
+    args = dict( chunk_size=1000, resolution=0.01, overviews=3, preview=None )
+    exportZA( cloud(), str(tmp_path / 'a.zarr'), **args )
+    exportZA( cloud(), str(tmp_path / 'b.zarr'), **args )
+    a, b = overviews( str(tmp_path / 'a.zarr') ), overviews( str(tmp_path / 'b.zarr') )
+    assert len(a) == 3 and all( len(c) == 1000 for c in a )
+    for ca, cb in zip(a, b):
+        assert np.array_equal( ca, cb ) # same input gives the same overviews
+
+    # the sparse region is represented far better than by a random sample (~3% of the points)
+    assert np.mean( a[0][:, 0] > 20 ) > 0.1
+
+    # each level refines the previous ones (distinct points, closer together)
+    spacing = []
+    for L in range(3):
+        xy = np.vstack( a[:L+1] )[:, :2]
+        assert len( np.unique(xy, axis=0) ) == len(xy)
+        spacing.append( np.median( KDTree(xy).query(xy, k=2)[0][:, 1] ) )
+    assert spacing[0] > spacing[1] > spacing[2]
@@ -0,0 +1,8 @@
+import numpy as np
+from rockhopper.clouds import prefetchOrder
+
+def test_default_fov_matches_viewer():
+    centers = np.array([[0, 0, 0], [0, 10, 5], [0, -3, 0]]) # overview, above the view axis, behind the camera
+    pos, tgt = np.zeros(3), np.array([0, 1, 0])
+    assert prefetchOrder( centers, pos, tgt ) == [0, 1, 2]
+    assert prefetchOrder( centers, pos, tgt, fov=40 ) == [0, 2, 1] # too narrow; ordered by distance
@@ -0,0 +1,49 @@
+import os
+import json
+import zlib
+import struct
+import numpy as np
+from rockhopper.utils import writePNG
+from rockhopper.server import VFT
+
+def readPNG(path):
+    """Decode an 8-bit RGB(A) PNG (with unfiltered rows, as written by `writePNG`), checking each chunk's CRC."""
+    data = open(path, 'rb').read()
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+    pos, chunks = 8, {}
+    while pos < len(data):
+        n, = struct.unpack('>I', data[pos:pos+4])
+        tag, body = data[pos+4:pos+8], data[pos+8:pos+8+n]
+        assert struct.unpack('>I', data[pos+8+n:pos+12+n])[0] == zlib.crc32(tag + body) & 0xffffffff
+        chunks[tag] = chunks.get(tag, b'') + body
+        pos += 12 + n
+    w, h, depth, ctype = struct.unpack('>IIBB', chunks[b'IHDR'][:10])
+    assert depth == 8 and ctype in [2, 6] and b'IEND' in chunks
+    c = 4 if ctype == 6 else 3
+    raw = np.frombuffer( zlib.decompress(chunks[b'IDAT']), dtype=np.uint8 ).reshape(h, 1 + w*c)
+    assert np.all( raw[:, 0] == 0 ) # filter type 0
+    return raw[:, 1:].reshape(h, w, c)
+
+def test_png_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    for c in [3, 4]:
+        image = rng.integers(0, 256, (17, 31, c), dtype=np.uint8)
+        writePNG( str(tmp_path / 'a.png'), image )
+        assert np.array_equal( readPNG(str(tmp_path / 'a.png')), image )
+
+def test_preview_is_written_and_linked(tmp_path):
+    xy = np.mgrid[0:40:0.25, 0:20:0.25].reshape(2, -1).T
+    cloud = np.c_[xy, np.zeros(len(xy)), np.tile([1.0, 0.0, 0.0], (len(xy), 1))] # a flat, red rectangle
+    vft = VFT( str(tmp_path / 'vft'), cloud_path=str(tmp_path / 'clouds'), write_delay=0 )
+    vft.addCloud( 'site', 'a', cloud, chunk_size=2000, resolution=0.1, preview=64, preview_view='top' )
+    vft.flush()
+    assert vft.index['sites']['site']['previewURL'] == 'a.zarr/preview.png'
+    index = json.load( open(tmp_path / 'vft' / 'index.json') )
+    assert index['sites']['site']['previewURL'] == 'a.zarr/preview.png'
+    image = readPNG( os.path.join(str(tmp_path / 'clouds'), index['sites']['site']['previewURL']) )
+    assert image.shape == (32, 64, 4) # longest side is 64 pixels, and the cloud is twice as wide as it is tall
+    drawn = image[..., 3] > 0
+    assert drawn.mean() > 0.8 # mostly covered
+    assert np.all( image[drawn][:, 0] > 128 ) and np.all( image[drawn][:, 1:3] < 128 ) # and red
+    attrs = json.load( open(tmp_path / 'clouds' / 'a.zarr' / '.zattrs') )
+    assert attrs['preview']['file'] == 'preview.png'
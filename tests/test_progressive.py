@@ -0,0 +1,32 @@
+import json
+import numpy as np
+import zarr
+from rockhopper.clouds import progressiveOrder, exportZA, readChunk
+
+def cloud(n=20000, seed=1):
+    rng = np.random.default_rng(seed)
+    return np.c_[rng.uniform(0, 40, (n, 2)), rng.uniform(0, 0.01, n), rng.uniform(0, 1, (n, 3))]
+
+def coverage(xy, bins):
+    lo, hi = xy.min(axis=0), xy.max(axis=0) + 1e-9
+    return np.histogram2d( xy[:, 0], xy[:, 1], bins=bins, range=[[lo[0], hi[0]], [lo[1], hi[1]]] )[0]
+
+def test_prefixes_cover_the_cloud_evenly():
+    pts = cloud()
+    order = progressiveOrder( pts )
+    assert sorted(order) == list(range(len(pts)))
+    assert np.array_equal( order, progressiveOrder(pts) ) # deterministic
+    for bins in [4, 8, 16]:
+        c = coverage( pts[order[:4 * bins**2], :2], bins ) # ~4 points per cell
+        assert c.min() >= 2 and c.max() <= 6, (bins, c.min(), c.max()) # (a random subset gives ~0 - 10)
+
+def test_blocks_give_chunk_prefixes(tmp_path):
+    pth = str(tmp_path / 'a.zarr')
+    exportZA( cloud(), pth, chunk_size=4000, resolution=0.01, progressive=True, block_size=256, preview=None )
+    attrs = json.load( open(pth + '/.zattrs') )
+    z = zarr.open_group( pth, mode='r' )
+    for i in range( attrs['overviews'], attrs['chunks'] ):
+        full = readChunk( pth, i )
+        assert z['c%d' % i].chunks[0] == min(256, len(full))
+        for k in [1, 100, 256, 300, len(full), len(full) + 10]:
+            assert np.array_equal( readChunk(pth, i, k), full[:k] )
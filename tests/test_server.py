@@ -0,0 +1,117 @@
+import os
+import json
+import pytest
+from rockhopper.server import VFT, WriteQueue
+
+@pytest.fixture
+def vft(tmp_path):
+    v = VFT( str(tmp_path / 'vft'), cloud_path=str(tmp_path / 'clouds'), overwrite=True, write_delay=0 )
+    yield v
+    v.flush()
+
+def test_conditional_requests(vft):
+    vft.flush()
+    client = vft.app.test_client()
+    r = client.get('/manifest.json')
+    assert r.status_code == 200
+    assert r.headers.get('ETag') and r.headers.get('Last-Modified')
+    r2 = client.get('/manifest.json', headers={'If-None-Match' : r.headers['ETag']})
+    assert r2.status_code == 304
+    r3 = client.get('/manifest.json', headers={'If-Modified-Since' : r.headers['Last-Modified']})
+    assert r3.status_code == 304
+
+@pytest.mark.parametrize('sharded', [False, True])
+def test_patch_annotations(vft, sharded):
+    if sharded:
+        vft.shardAnnotations()
+    client = vft.app.test_client()
+    line = {'verts' : [{'x' : 0, 'y' : 0, 'z' : 0}, {'x' : 1, 'y' : 1, 'z' : 1}]}
+    r = client.post('/patch', json=dict(site='s1', op='add', kind='lines', annotation=line))
+    assert r.status_code == 200 and r.json['data']['index'] == 0
+    r = client.post('/patch', json=dict(site='s1', op='add', kind='lines', annotation=dict(line, color='#ff0000')))
+    assert r.json['data']['index'] == 1
+    r = client.post('/patch', json=dict(site='s1', op='delete', kind='lines', index=0))
+    assert r.status_code == 200
+    vft.flush()
+    assert vft.getAnnotations('s1')['lines'] == [dict(line, color='#ff0000')]
+
+def test_invalid_patches_are_rejected(vft):
+    client = vft.app.test_client()
+    for patch in [dict(site='s1', op='delete', kind='lines'), # no index
+                  dict(site='s1', op='delete', kind='lines', index='abc'),
+                  dict(site='s1', op='modify', kind='lines', index=5, annotation={}),
+                  dict(site='s1', op='delete', kind='lines', index=-1), # N.B. not counted from the end
+                  dict(site='s1', op='rename', kind='lines'),
+                  dict(site='../../x', op='add', kind='lines', annotation={}),
+                  dict(op='add', kind='lines', annotation={})]:
+        r = client.post('/patch', json=patch)
+        assert r.status_code == 400, patch
+
+@pytest.fixture
+def sharded(vft):
+    vft.shardAnnotations()
+    client = vft.app.test_client()
+    for site in ['s1', 's2']:
+        client.post('/patch', json=dict(site=site, op='add', kind='lines', annotation={'verts' : []}))
+    vft.flush()
+    return client
+
+def test_update_deletes_removed_shards(vft, sharded):
+    content = json.dumps({'s1' : vft.getAnnotations('s1')})
+    r = sharded.post('/update', json=dict(filename=vft.index['annotURL'], content=content, dtype='json'))
+    assert r.status_code == 200
+    assert list(vft.getAnnotations().keys()) == ['s1'] # before and after writing
+    vft.flush()
+    assert list(vft.getAnnotations().keys()) == ['s1']
+    assert not os.path.exists(vft.shardPath('s2'))
+
+def test_paths_outside_the_tour_are_rejected(vft, sharded, tmp_path):
+    content = json.dumps({'s1' : {}, '../../x' : {}})
+    r = sharded.post('/update', json=dict(filename=vft.index['annotURL'], content=content, dtype='json'))
+    assert r.status_code == 400
+    r = sharded.post('/update', json=dict(filename='../x.md', content='# x', dtype='text'))
+    assert r.status_code == 400
+    vft.flush()
+    assert sorted(os.listdir(tmp_path)) == ['clouds', 'vft']
+    assert sorted(vft.getAnnotations().keys()) == ['s1', 's2']
+
+def test_bundles(vft):
+    vft.addSite('my_site', './clouds/a.zarr')
+    vft.addTab('Help', site='my_site') # shadowed by the global "Help" tab
+    vft.addTab('Local', site='my_site')
+    client = vft.app.test_client()
+    r = client.get('/bundles/my_site_en.json')
+    assert r.status_code == 200
+    assert r.json['order'] == ['Help', 'Local', 'Notebook', 'References']
+    assert r.json['tabs']['Help']['url'] == './md/help_en.md'
+    assert r.json['tabs']['Local']['url'] == './md/my_site/local_en.md'
+    for name in ['nounderscore', 'my_site_fr', 'other_en', '_en']:
+        assert client.get(f'/bundles/{name}.json').status_code == 404, name
+
+def test_failed_writes_are_retried(tmp_path):
+    blocker = tmp_path / 'd'
+    blocker.write_text('not a directory')
+    target = str(blocker / 'a.json')
+    w = WriteQueue( delay=0 )
+    w.put( target, 'hello' )
+    w.flush()
+    assert list(w.failures()) == [target]
+    assert w.pending(target) == 'hello' # kept, not dropped
+    blocker.unlink()
+    blocker.mkdir()
+    w.flush()
+    assert w.failures() == {} and w.pending(target) is None
+    assert open(target).read() == 'hello'
+
+def test_failed_writes_are_reported(vft, tmp_path):
+    open(tmp_path / 'vft' / 'blocked', 'w').close()
+    client = vft.app.test_client()
+    update = dict(filename='blocked/notes.md', content='# Notes', dtype='text')
+    assert client.post('/update', json=update).status_code == 200
+    vft.flush()
+    r = client.post('/update', json=update)
+    assert r.status_code == 202 and list(r.json['data']['failed']) == ['blocked/notes.md']
+    (tmp_path / 'vft' / 'blocked').unlink()
+    (tmp_path / 'vft' / 'blocked').mkdir()
+    vft.flush()
+    assert client.post('/update', json=update).status_code == 200
@@ -0,0 +1,55 @@
+import numpy as np
+from rockhopper.clouds import BandStats, fitStyles
+
+def cloud(n=200000, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.c_[rng.normal(5, 2, n), rng.exponential(3, n), rng.uniform(-1, 1, n), 1e6 + rng.normal(0, 1, n)]
+
+def chunks(points, sizes):
+    return np.split( points, np.cumsum(sizes)[:-1] )
+
+QS = [0.02, 0.25, 0.5, 0.75, 0.98]
+
+def check(stats, points):
+    assert stats.n == len(points)
+    assert np.allclose( stats.mean, points.mean(axis=0), rtol=0, atol=1e-9 * np.abs(points).max() )
+    assert np.allclose( stats.m2 / stats.count, points.var(axis=0), rtol=1e-9 )
+    assert np.allclose( stats.min, points.min(axis=0) ) and np.allclose( stats.max, points.max(axis=0) )
+    # quantiles come from a uniform sample, so are approximate
+    spread = np.quantile(points, 0.98, axis=0) - np.quantile(points, 0.02, axis=0)
+    assert np.all( np.abs( stats.quantile(QS) - np.quantile(points, QS, axis=0) ) < 0.02 * spread )
+
+def test_streaming_stats_match_numpy():
+    points = cloud()
+    stats = BandStats( points.shape[1], sample_size=20000 )
+    for c in chunks( points, [1, 999, 50000, 3, 148997] ): # uneven chunks
+        stats.update( c )
+    check( stats, points )
+    assert len(stats.sample) == 20000
+
+def test_merged_stats_match_numpy(tmp_path):
+    points = cloud()
+    parts = chunks( points, [70000, 30000, 100000] )
+    stats = BandStats( points.shape[1], sample_size=20000 )
+    for i, c in enumerate(parts): # e.g., tiles computed by different workers
+        s = BandStats( points.shape[1], sample_size=20000, seed=i )
+        for cc in np.array_split(c, 7):
+            s.update( cc )
+        s.save( str(tmp_path / ('t%d.npz' % i)) )
+        stats.merge( BandStats.load( str(tmp_path / ('t%d.npz' % i)) ) )
+    check( stats, points )
+
+def test_styles_are_fitted_to_quantiles():
+    points = cloud()
+    stats = BandStats( points.shape[1] )
+    stats.update( points )
+    style = fitStyles( {'a' : {'color' : (1, {'scale' : 'viridis', 'limits' : 'auto'})},
+                        'b' : {'color' : {'R' : [0], 'G' : [1, 0, 2], 'B' : [2, None, None]}}}, stats )
+    lo, hi = np.quantile(points, [0.02, 0.98], axis=0)
+    assert np.allclose( style['a']['color'][1]['limits'][:2], [lo[1], hi[1]], rtol=0.05 )
+    assert np.allclose( style['b']['color']['R'][1:], [lo[0], hi[0]], rtol=0.05 )
+    assert style['b']['color']['G'] == [1, 0, 2] # explicit limits are kept
+    assert np.allclose( style['b']['color']['B'][1:], [lo[2], hi[2]], atol=0.05 )
+    # the same limits are recovered from the stored (json) statistics
+    stored = fitStyles( {'a' : {'color' : (1, {'scale' : 'viridis'})}}, stats.toDict() )
+    assert np.allclose( stored['a']['color'][1]['limits'][:2], [lo[1], hi[1]], rtol=0.05 )
@@ -0,0 +1,84 @@
+import os
+import time
+import json
+import multiprocessing
+import numpy as np
+import zarr
+from rockhopper.tiling import convertTiled, planTiles, runWorker, readManifest
+from rockhopper.clouds import fingerprintCloud, readPoints
+
+ARGS = dict( tile_size=10.0, chunk_size=500, resolution=0.2, preview=None )
+
+def cloud(seed=0):
+    rng = np.random.default_rng(seed)
+    xy = np.mgrid[0:40:0.5, 0:40:0.5].reshape(2, -1).T
+    return np.c_[xy, np.sin(xy[:, 0] / 5), rng.uniform(0, 1, (len(xy), 3))]
+
+def assert_same_stream(a, b):
+    za, zb = zarr.open_group(a, mode='r'), zarr.open_group(b, mode='r')
+    assert za.attrs['chunks'] == zb.attrs['chunks']
+    assert za.attrs['total'] == zb.attrs['total']
+    assert np.array_equal( za['chunk_centers'][:], zb['chunk_centers'][:] )
+    for i in range( za.attrs['chunks'] ):
+        assert np.array_equal( readPoints(a, i), readPoints(b, i) )
+
+def test_resume_after_killed_worker(tmp_path):
+    pts = cloud()
+    ref = str(tmp_path / 'ref.zarr')
+    convertTiled( pts, ref, workers=1, **ARGS )
+
+    # start a worker and kill it as soon as it has claimed a tile
+    job = str(tmp_path / 'a.job')
+    kwds = {k : v for k, v in ARGS.items() if k != 'tile_size'}
+    planTiles( pts, job, tile_size=ARGS['tile_size'], fingerprint=fingerprintCloud(pts, **ARGS), **kwds )
+    p = multiprocessing.get_context('spawn').Process( target=runWorker, args=(job, 1.0) )
+    p.start()
+    locks = os.path.join(job, 'locks')
+    t0 = time.time()
+    while (not os.path.exists(locks) or len(os.listdir(locks)) == 0) and (time.time() - t0 < 30):
+        time.sleep(0.005)
+    p.kill()
+    p.join()
+    done = os.path.join(job, 'done')
+    finished = [f for f in os.listdir(done) if f.endswith('.json')] if os.path.exists(done) else []
+    assert len(os.listdir(locks)) > 0
+    assert len(finished) < len( readManifest(job)['tiles'] ) # killed mid-run
+
+    # resume (taking over the dead worker's lock once it times out) and compare with the uninterrupted conversion
+    time.sleep(1.5)
+    out = str(tmp_path / 'a.zarr')
+    convertTiled( pts, out, job_path=job, workers=1, timeout=1.0, **ARGS )
+    assert not os.path.exists(job)
+    assert_same_stream( ref, out )
+
+def test_changed_arguments_restart_job(tmp_path):
+    pts = cloud()
+    job = str(tmp_path / 'a.job')
+    kwds = {k : v for k, v in ARGS.items() if k != 'tile_size'}
+    planTiles( pts, job, tile_size=ARGS['tile_size'], fingerprint=fingerprintCloud(pts, **ARGS), **kwds )
+    convertTiled( pts, str(tmp_path / 'a.zarr'), job_path=job, workers=1, cleanup=False, **dict(ARGS, resolution=0.5) )
+    assert readManifest(job)['resolution'] == 0.5
+    with open( os.path.join(str(tmp_path / 'a.zarr'), '.zattrs') ) as f:
+        assert json.load(f)['resolution'] == 0.5
+
+def test_live_worker_keeps_its_lock(tmp_path):
+    from rockhopper.tiling import claimTile, keepAlive
+    job = str(tmp_path / 'a.job')
+    assert claimTile( job, 0, timeout=0.5 )
+    stop = keepAlive( job, 0, 0.1 )
+    time.sleep(1.0)
+    assert not claimTile( job, 0, timeout=0.5 ) # still being refreshed
+    stop.set()
+    time.sleep(1.0)
+    assert claimTile( job, 0, timeout=0.5 ) # stale
+
+def test_tiled_categorical_bands_with_nan(tmp_path):
+    pts = cloud()
+    pts[:, 3] = np.arange(len(pts)) % 5
+    pts[::7, 3] = np.nan # unclassified points
+    pth = str(tmp_path / 'a.zarr')
+    convertTiled( pts, pth, workers=1, categorical='auto', columns={'xyz' : [0, 1, 2], 'cls' : [3], 'gb' : [4, 5]}, **ARGS )
+    z = zarr.open_group(pth, mode='r')
+    assert z.attrs['categorical']['cls']['dictionary'] == [0, 1, 2, 3, 4, None]
+    out = np.vstack( [readPoints(pth, i) for i in range(z.attrs['chunks'])] )
+    assert np.sum( np.isnan(out[:, 3]) ) == np.sum( np.isnan(pts[:, 3]) )